@@ -1,16 +1,17 @@
-import matplotlib.pyplot as plot
 import os
 import re
 import sys
 import argparse
 import numpy as np
 
-from parser import is_ecg, is_ppg, is_ppg512, is_ppg125, parse_data
+from parser import is_ecg, is_ppg, is_ppg512, is_ppg125, calc_ts
 from parser import TYPE_ECG, TYPE_PPG512
-from annotation import parse_annotation
+from annotation import parse_annotation, parse_timespec, annotation_data
+from cache import load_raw_file
+from index import load_index, read_samples, read_time_range
+from lazy import lazy_import
 from filters import power_line_noise_filter
-from filters import high_pass_filter
-from filters import low_pass_filter
+from filters import band_chain, chain_filter
 from plots import plot_time_domain
 from plots import plot_freq_domain
 from plots import plot_power_line_noise_filter
@@ -18,6 +19,8 @@ from plots import plot_high_pass_filter
 from plots import plot_low_pass_filter
 from plots import plot_annotation
 
+plot = lazy_import('matplotlib.pyplot')
+
 ECG_FS = 512
 PPG_FS_125 = 63 # # we skip a half data point that is ambiance
 PPG_FS_512 = 256 # we skip a half data point that is ambiance
@@ -30,67 +33,68 @@ def parse_args():
     p.add_argument('annotation_file', nargs='?', help='Specify the annotation file')
     p.add_argument('start_data_point', nargs='?', help='Specify the start data point')
     p.add_argument('num_data_point', nargs='?', help='Specify the number of data point to be displayed')
+    p.add_argument('--start_time', help='Display data from, e.g. "2018/01/25 14:05:00"')
+    p.add_argument('--end_time', help='Display data until, e.g. "2018/01/25 14:06:00"')
+    p.add_argument('--no_cache', help='Do not use or write the parsed data cache', action='store_true')
     return p.parse_args()
 
-args = parse_args()
-
-f = open(args.raw_data_file[0])
-ecg_data = parse_data(f, TYPE_ECG)
-
-# back to begining
-f.seek(0)
-ppg_data = parse_data(f, TYPE_PPG512)
-
-# Convert to numpy array
-ecg_data = np.array(ecg_data)
-ppg_data = np.array(ppg_data)
-
-print ecg_data.shape
-print ppg_data.shape
-
-# Slice ECG data as specified
-if args.start_data_point:
-    start = int(args.start_data_point)
-else:
-    start = 0
-
-if args.num_data_point:
-    size = int(args.num_data_point)
-else:
-    size = len(ecg_data)
-
-ecg_data = ecg_data[start:size]
-
-# Slice PPG data as specified
-if args.num_data_point:
-    size = int(args.num_data_point)
-else:
-    size = len(ppg_data)
-
-ppg_data = ppg_data[start:size]
-
-# Read annotation file
-annot = []
-if args.annotation_file:
-   annot_f = open(args.annotation_file)
-   annot = parse_annotation(annot_f)
-
-filtered_ecg_data = ecg_data[:,1]
-filtered_ecg_data = high_pass_filter(filtered_ecg_data, ECG_FS, HIGH_PASS_CUTOFF)
-filtered_ecg_data = low_pass_filter(filtered_ecg_data, ECG_FS, LOW_PASS_CUTOFF)
-filtered_ecg_data = np.column_stack((ecg_data[:,0], filtered_ecg_data))
-
-filtered_ppg_data = ppg_data[:,1]
-filtered_ppg_data = high_pass_filter(filtered_ppg_data, PPG_FS_512, HIGH_PASS_CUTOFF)
-filtered_ppg_data = low_pass_filter(filtered_ppg_data, PPG_FS_512, LOW_PASS_CUTOFF)
-filtered_ppg_data = np.column_stack((ppg_data[:,0], filtered_ppg_data))
-
-fig = plot.figure()
-ax1 = fig.add_subplot(2, 1, 1)
-ax2 = fig.add_subplot(2, 1, 2, sharex=ax1)
-plot_time_domain(ax1, filtered_ppg_data, color='blue')
-plot_time_domain(ax2, filtered_ecg_data, color='black')
-plot_annotation(ax1, annot)
-plot_annotation(ax2, annot)
-
-plot.show()
+def load_signal(raw_data_file, t, args, raw=None, index=None):
+    """ Return (timestamp, mv) of the part to be displayed """
+    if args.start_time or args.end_time:
+        # seek to and parse the given time range only
+        start_ms = parse_timespec(args.start_time) if args.start_time else 0
+        end_ms = parse_timespec(args.end_time) if args.end_time else np.inf
+        data = read_time_range(raw_data_file, t, start_ms, end_ms, index, interpolate=True)
+    elif args.start_data_point or args.num_data_point:
+        # seek to and parse the given data points only
+        start = int(args.start_data_point or 0)
+        stop = start + int(args.num_data_point) if args.num_data_point else sys.maxint
+        data = read_samples(raw_data_file, t, start, stop, index, interpolate=True)
+    else:
+        data = calc_ts(raw[t])
+    return data[:,[0,2]]
+
+def bp_filter(data, fs):
+    """ high-pass and low-pass (timestamp, mv) rows in a single pass """
+    filtered = chain_filter(data[:,1], band_chain(fs, HIGH_PASS_CUTOFF, LOW_PASS_CUTOFF))
+    return np.column_stack((data[:,0], filtered))
+
+def main():
+    args = parse_args()
+    raw_data_file = args.raw_data_file[0]
+
+    raw = index = None
+    if args.start_time or args.end_time or args.start_data_point or args.num_data_point:
+        index = load_index(raw_data_file, use_cache=not args.no_cache)
+    else:
+        # parse ECG and PPG in a single pass, or open the cached arrays
+        raw = load_raw_file(raw_data_file, [TYPE_ECG, TYPE_PPG512], use_cache=not args.no_cache)
+
+    ecg_data = load_signal(raw_data_file, TYPE_ECG, args, raw, index)
+    ppg_data = load_signal(raw_data_file, TYPE_PPG512, args, raw, index)
+
+    print ecg_data.shape
+    print ppg_data.shape
+
+    # Read annotation file
+    if args.annotation_file:
+        with open(args.annotation_file) as annot_f:
+            for line in annot_f:
+                if line.strip():
+                    parse_annotation(line)
+
+    filtered_ecg_data = bp_filter(ecg_data, ECG_FS)
+    filtered_ppg_data = bp_filter(ppg_data, PPG_FS_512)
+
+    fig = plot.figure()
+    ax1 = fig.add_subplot(2, 1, 1)
+    ax2 = fig.add_subplot(2, 1, 2, sharex=ax1)
+    plot_time_domain(ax1, filtered_ppg_data, color='blue')
+    plot_time_domain(ax2, filtered_ecg_data, color='black')
+    plot_annotation(ax1, annotation_data)
+    plot_annotation(ax2, annotation_data)
+
+    plot.show()
+
+if __name__ == "__main__":
+    main()
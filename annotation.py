@@ -3,11 +3,14 @@ import time
 
 annotation_data = []
 
+def parse_timespec(timespec):
+    """ E.g. 2018/01/25 14:05:00, in local time, to ms """
+    dt = datetime.datetime.strptime(timespec, "%Y/%m/%d %H:%M:%S")
+    secs = time.mktime(dt.timetuple())
+    return secs * 1000
+
 def parse_annotation(x):
     timespec, label = x.rstrip('\r\n').split(',')
     label = label.lstrip(' ')
-    # E.g. 2018/01/25 14:05:00
-    dt = datetime.datetime.strptime(timespec, "%Y/%m/%d %H:%M:%S")
-    secs = time.mktime(dt.timetuple())
-    ms = secs * 1000
+    ms = parse_timespec(timespec)
     annotation_data.append((ms, label))
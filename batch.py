@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+
+import main
+import runner
+from cache import cache_path, source_key, CACHE_FOLDER
+from export import output_names, EXPORT_FORMATS
+from runner import RAW_PATTERN
+from stream import STREAM_BLOCK_SIZE
+
+# options which change the outputs of a file
+OUTPUT_OPTIONS = ['fft', 'format', 'precision', 'stream', 'causal', 'chunk_size']
+
+def parse_args():
+    p = argparse.ArgumentParser(description='Export many raw data files across cores')
+    p.add_argument('--fft', help='Apply FFT bandpass filter', action='store_true')
+    p.add_argument('--format', default='csv', choices=sorted(EXPORT_FORMATS.keys()), help='Export format')
+    p.add_argument('--precision', default=6, type=int, help='Digits after the decimal point for fastcsv')
+    p.add_argument('--stream', help='Process each file chunk by chunk in constant memory', action='store_true')
+    p.add_argument('--causal', help='Use causal filters in stream mode instead of block zero-phase ones', action='store_true')
+    p.add_argument('--chunk_size', default=STREAM_BLOCK_SIZE, type=int, help='Bytes of raw data per chunk in stream mode')
+    p.add_argument('--jobs', default=multiprocessing.cpu_count(), type=int, help='Number of worker processes')
+    p.add_argument('--no_cache', help='Do not use or write the parsed data cache', action='store_true')
+    p.add_argument('--output_dir', help='Write outputs here instead of next to the raw data files')
+    p.add_argument('--pattern', default=RAW_PATTERN, help='Raw data files to pick up from directories')
+    p.add_argument('--force', help='Process files even if their outputs are up to date', action='store_true')
+    p.add_argument('inputs', nargs='+', help='Raw data files, directories or glob patterns')
+    args = p.parse_args()
+    if args.stream and args.format == 'npz':
+        p.error('--format npz is not supported in stream mode')
+    return vars(args)
+
+def stamp_path(raw_data_file, output_dir=None):
+    """ The stamp of the last export lives in .npcache of the output directory """
+    cache_dir = os.path.join(output_dir, CACHE_FOLDER) if output_dir else None
+    return os.path.splitext(cache_path(raw_data_file, cache_dir))[0] + '.batch'
+
+def stamp(raw_data_file, options):
+    return {'key': source_key(raw_data_file), 'options': dict((k, options[k]) for k in OUTPUT_OPTIONS)}
+
+def write_stamp(raw_data_file, options, outputs):
+    path = stamp_path(raw_data_file, options['output_dir'])
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path + '.tmp', 'w') as f:
+        json.dump(dict(stamp(raw_data_file, options), outputs=outputs), f)
+    os.rename(path + '.tmp', path)
+
+def remove_stamp(raw_data_file, output_dir=None):
+    path = stamp_path(raw_data_file, output_dir)
+    if os.path.exists(path):
+        os.remove(path)
+
+def is_up_to_date(raw_data_file, options):
+    """ True if the last export of the raw data file finished with the same
+    options and its outputs are still there
+    """
+    try:
+        with open(stamp_path(raw_data_file, options['output_dir'])) as f:
+            last = json.load(f)
+    except (IOError, ValueError):
+        return False
+    current = stamp(raw_data_file, options)
+    return last['key'] == current['key'] and last['options'] == current['options'] and \
+           all(os.path.exists(n) for n in last['outputs'])
+
+def process(job):
+    """ Run in a worker, return (file, bytes, seconds, error) """
+    raw_data_file, options = job
+    start = time.time()
+    try:
+        # a run which does not finish leaves no stamp
+        remove_stamp(raw_data_file, options['output_dir'])
+        main.process_file(raw_data_file, options, options['output_dir'])
+        names = output_names(raw_data_file, options['output_dir'], options['format']).values()
+        write_stamp(raw_data_file, options, sorted(n for n in names if os.path.exists(n)))
+        error = None
+    except Exception:
+        error = traceback.format_exc()
+    return raw_data_file, os.path.getsize(raw_data_file), time.time() - start, error
+
+def run(files, options, workers=1):
+    """ Shard files over a worker pool, return the results of process() """
+    return runner.run(process, files, dict(options, export=True, jobs=1), workers, describe)
+
+def describe(result):
+    raw_data_file, size, secs, _ = result
+    mb = size / float(1 << 20)
+    return '%s: %.1f MB in %.2f s (%.1f MB/s)' % (raw_data_file, mb, secs, mb / max(secs, 1e-6))
+
+def summary(results, skipped):
+    failed = runner.failed(results)
+    size = sum(r[1] for r in results if not r[3]) / float(1 << 20)
+    secs = sum(r[2] for r in results)
+    print '-' * 40
+    print 'processed: %d, skipped: %d, failed: %d' % (len(results) - len(failed), len(skipped), len(failed))
+    print 'throughput: %.1f MB in %.2f worker seconds (%.1f MB/s)' % (size, secs, size / max(secs, 1e-6))
+    runner.print_failures(results)
+
+if __name__ == "__main__":
+    args = parse_args()
+    files, skipped = runner.select_files(args, is_up_to_date)
+    results = run(files, args, args['jobs'])
+    summary(results, skipped)
+    sys.exit(1 if runner.failed(results) else 0)
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import numpy as np
+
+from parser import TYPE_ACC, TYPE_ECG, TYPE_PPG125, TYPE_PPG512, TYPE_HR
+from parser import EKG_ADC_LSB, EKG_GAIN, NUM_COLUMNS, MSEC_PER_SEC
+
+# Synthetic raw data files: ECG, PPG and ACC follow heart beats with a
+# varying RR interval, all types are interleaved second by second as the
+# device writes them, rows go missing now and then, and negative values
+# are stored wrapped into 23 bits as the device does.
+START_TS = 1519268239
+# type: samples per second, samples per row
+RATES = {
+        TYPE_ACC:    (100, 3),
+        TYPE_ECG:    (512, 12),
+        TYPE_PPG125: (125, 6),
+        TYPE_PPG512: (512, 12),
+        }
+FIRST_SEQ = {TYPE_ACC: 100, TYPE_ECG: 20000, TYPE_PPG125: 99000, TYPE_PPG512: 5000}
+CHUNK_SECONDS = 600
+GAP_RATE = 0.002
+MAX_GAP_ROWS = 5
+
+PPG_MV_PER_COUNT = 3.2 * 1000 / 65536
+ECG_MV_PER_COUNT = EKG_ADC_LSB * 1000.0 / EKG_GAIN
+
+# P, Q, R, S, T waves: offset to R (s), width (s), amplitude (mV)
+ECG_WAVES = [(-0.2, 0.025, 0.12), (-0.03, 0.01, -0.15), (0., 0.012, 1.1), (0.03, 0.01, -0.25), (0.25, 0.04, 0.3)]
+
+def parse_args():
+    p = argparse.ArgumentParser(description='Generate a synthetic raw data file')
+    p.add_argument('--hours', default=1., type=float, help='Length of the recording')
+    p.add_argument('--seed', default=1, type=int, help='Random seed')
+    p.add_argument('--gap_rate', default=GAP_RATE, type=float, help='Chance of rows going missing after a row')
+    p.add_argument('output', help='Raw data file to write')
+    return p.parse_args()
+
+def wrap(counts):
+    """ Store negative values as the device does, see convert_ecg_to_mv() """
+    counts = np.round(counts).astype(np.int64)
+    return np.where(counts < 0, counts + (1 << 23), counts)
+
+def beat_times(seconds, rng):
+    """ R peaks with an RR interval around 0.85 s, slowly varying """
+    n = int(seconds / 0.5) + 2
+    rr = 0.85 + 0.1 * np.sin(np.arange(n) * 0.05) + rng.normal(0, 0.03, n)
+    return np.cumsum(np.clip(rr, 0.4, 1.6)) - rr[0]
+
+def since_beat(t, beats):
+    """ Seconds since the closest R peak and the RR interval it starts """
+    i = np.clip(np.searchsorted(beats, t) - 1, 0, len(beats) - 2)
+    after = t - beats[i]
+    near = after > (beats[i + 1] - beats[i]) / 2
+    return np.where(near, t - beats[i + 1], after), beats[i + 1] - beats[i]
+
+def ecg_mv(t, beats, rng):
+    phase, _ = since_beat(t, beats)
+    mv = sum(a * np.exp(-np.square((phase - o) / w)) for o, w, a in ECG_WAVES)
+    # baseline wander, power line and noise
+    return mv + 0.1 * np.sin(2 * np.pi * 0.3 * t) + 0.02 * np.sin(2 * np.pi * 60 * t) + rng.normal(0, 0.01, len(t))
+
+def ppg_mv(t, beats, rng):
+    phase, rr = since_beat(t - 0.2, beats)
+    phase = np.mod(phase, rr)
+    pulse = np.exp(-np.square((phase - 0.1) / 0.08)) + 0.3 * np.exp(-np.square((phase - 0.35) / 0.06))
+    return 200 + 50 * pulse + 10 * np.sin(2 * np.pi * 0.2 * t) + rng.normal(0, 0.5, len(t))
+
+def acc_counts(t, rng):
+    # gravity on z, a little motion on every axis
+    motion = np.cumsum(rng.normal(0, 3, (len(t), 3)), axis=0) * 0.1
+    return np.round(motion + [0, 0, 1000]).astype(np.int64)
+
+def row_numbers(t, start, end):
+    """ Rows of type t whose first sample falls in seconds [start, end) """
+    fs, per_row = RATES[t]
+    first = int(np.ceil(start * fs / float(per_row)))
+    last = int(np.ceil(end * fs / float(per_row)))
+    return np.arange(first, last)
+
+def make_rows(t, rows, beats, rng):
+    """ Raw rows for the given row numbers of type t """
+    fs, per_row = RATES[t]
+    samples = rows[:,np.newaxis] * per_row + np.arange(per_row)
+    st = samples.ravel() / float(fs)
+    m = np.zeros((len(rows), NUM_COLUMNS), np.int64)
+    m[:,0] = t
+    m[:,1] = FIRST_SEQ[t] + rows
+    if t == TYPE_ACC:
+        m[:,[2, 3, 4, 6, 7, 8, 10, 11, 12]] = acc_counts(st, rng).reshape(len(rows), -1)
+    elif t == TYPE_ECG:
+        m[:,2:14] = wrap(ecg_mv(st, beats, rng) / ECG_MV_PER_COUNT).reshape(len(rows), -1)
+    elif t == TYPE_PPG125:
+        # signal and ambient light take turns
+        counts = wrap(ppg_mv(st, beats, rng) / PPG_MV_PER_COUNT).reshape(len(rows), -1)
+        m[:,2:14:2] = counts
+        m[:,3:14:2] = wrap(rng.normal(-20, 1, counts.shape) / PPG_MV_PER_COUNT)
+    else:
+        m[:,2:14] = wrap(ppg_mv(st, beats, rng) / PPG_MV_PER_COUNT).reshape(len(rows), -1)
+    ts = np.floor(samples[:,0] / float(fs)).astype(np.int64)
+    m[:,14] = (ts * MSEC_PER_SEC) % (1 << 24)
+    m[:,15] = START_TS + ts
+    return m, samples[:,0] / float(fs)
+
+def hr_rows(start, end, beats, rng):
+    ts = np.arange(start, end)
+    _, rr = since_beat(ts.astype(float), beats)
+    m = np.zeros((len(ts), NUM_COLUMNS), np.int64)
+    m[:,0] = TYPE_HR
+    m[:,1] = ts
+    m[:,2] = np.round(60 / rr)
+    m[:,3] = rng.choice([0, 1, 2, 3, 255], len(ts)) | 0x100
+    m[:,4] = (ts * MSEC_PER_SEC) % (1 << 24)
+    m[:,15] = START_TS + ts
+    return m, ts + 0.999
+
+def gap_mask(n, rng, gap_rate):
+    """ Rows to keep out of n, dropping runs of rows to leave sequence gaps """
+    keep = np.ones(n, bool)
+    for i in np.flatnonzero(rng.random_sample(n) < gap_rate):
+        keep[i + 1:i + 1 + rng.randint(1, MAX_GAP_ROWS + 1)] = False
+    return keep
+
+def generate(output, hours=1., seed=1, gap_rate=GAP_RATE):
+    """ Write a synthetic raw data file, return the number of rows """
+    rng = np.random.RandomState(seed)
+    seconds = int(hours * 3600)
+    beats = beat_times(seconds + 2, rng)
+    n = 0
+    line = ','.join(['%d'] * NUM_COLUMNS) + '\n'
+    with open(output, 'w') as out:
+        for start in xrange(0, seconds, CHUNK_SECONDS):
+            end = min(start + CHUNK_SECONDS, seconds)
+            rows, when = [], []
+            for t in sorted(RATES):
+                m, w = make_rows(t, row_numbers(t, start, end), beats, rng)
+                keep = gap_mask(len(m), rng, gap_rate)
+                rows.append(m[keep])
+                when.append(w[keep])
+            m, w = hr_rows(start, end, beats, rng)
+            rows.append(m)
+            when.append(w)
+            # interleave the types in time order, hr at the end of each second
+            m = np.concatenate(rows)[np.argsort(np.concatenate(when), kind='mergesort')]
+            for i in xrange(0, len(m), 1 << 14):
+                block = m[i:i + (1 << 14)]
+                out.write((line * len(block)) % tuple(block.ravel().tolist()))
+            n += len(m)
+    return n
+
+if __name__ == "__main__":
+    args = parse_args()
+    print '%d rows' % generate(args.output, args.hours, args.seed, args.gap_rate)
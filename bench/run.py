@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import matplotlib
+matplotlib.use('Agg')
+
+import numpy as np
+
+from bench.generate import generate
+from cache import load_raw_file, cache_path
+from export import open_writer, COLUMN_NAMES
+from filters import acc_bp_filter, ppg125_bp_filter, ppg512_bp_filter, ecg_bp_filter, ecg_pl_filter, ecg_filter
+from filters import ecg_stream
+from hr import hr_rows
+from parser import parse_raw_file, calc_ts, samples_per_row, ReseqState
+from parser import TYPE_ACC, TYPE_ECG, TYPE_PPG125, TYPE_PPG512, TYPE_HR
+
+# Every stage runs in a child process of its own, so its peak RSS is
+# measured alone. The input of a stage is prepared before the clock starts.
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+THRESHOLD = 1.25
+# python, imports and a csv export of a few seconds of data, without scipy
+# and matplotlib being imported
+STARTUP_TARGET = 0.3
+STARTUP_SECONDS = 10
+STREAM_ROWS = 1 << 16
+SIGNALS = [(TYPE_ACC, 'acc'), (TYPE_ECG, 'ecg'), (TYPE_PPG125, 'ppg125'), (TYPE_PPG512, 'ppg512')]
+
+def parse_args():
+    p = argparse.ArgumentParser(description='Time every pipeline stage on a synthetic raw data file')
+    p.add_argument('--hours', default=1., type=float, help='Length of the synthetic recording')
+    p.add_argument('--seed', default=1, type=int, help='Random seed of the synthetic recording')
+    p.add_argument('--workdir', default=None, help='Where the raw data file and outputs go, a temp dir by default')
+    p.add_argument('--repeat', default=1, type=int, help='Run each stage N times and keep the fastest')
+    p.add_argument('--only', default=None, help='Run only the stages matching this regular expression')
+    p.add_argument('--save', default=None, help='Save the results as a baseline to this json file')
+    p.add_argument('--compare', default=None, help='Compare with a baseline json file')
+    p.add_argument('--threshold', default=THRESHOLD, type=float, \
+                   help='Report a regression if a stage is slower than the baseline by this factor')
+    return p.parse_args()
+
+def count(raw):
+    return sum(len(a) for a in raw.values())
+
+def load(raw_file, t):
+    """ A writable copy of the parsed data of type t """
+    return np.array(load_raw_file(raw_file, [t])[t])
+
+def prepared(raw_file, t):
+    """ Data of type t as data_handler has it before filtering """
+    return np.array(ReseqState(samples_per_row(t))(calc_ts(load(raw_file, t))))
+
+def run_chunks(stage, x, rows=STREAM_ROWS):
+    for i in xrange(0, len(x), rows):
+        stage(x[i:i+rows])
+    stage.flush()
+    return len(x)
+
+def export_stage(fmt, out):
+    def run(x):
+        w = open_writer(out + '.' + fmt, fmt, COLUMN_NAMES[TYPE_ECG])
+        w(x)
+        w.close()
+        return len(x)
+    return run
+
+def script_stage(args, cwd):
+    """ Run a script of the repo, the clock includes starting python """
+    def run(samples):
+        with open(os.devnull, 'w') as devnull:
+            subprocess.check_call([sys.executable] + args, cwd=cwd, stdout=devnull, env=dict(os.environ, MPLBACKEND='Agg'))
+        return samples
+    return run
+
+def stages(raw_file, workdir):
+    """ Yield (name, prepare, run): prepare() returns the input of run(),
+    run() returns the number of samples processed
+    """
+    out = os.path.join(workdir, 'out')
+    total = lambda: count(load_raw_file(raw_file))
+
+    def parse(_):
+        with open(raw_file) as f:
+            return count(parse_raw_file(f))
+    yield 'parse', lambda: None, parse
+
+    def cold():
+        path = cache_path(raw_file)
+        if os.path.exists(path):
+            os.remove(path)
+    yield 'cache:cold', cold, lambda _: count(load_raw_file(raw_file))
+    yield 'cache:warm', lambda: load_raw_file(raw_file), lambda _: count(load_raw_file(raw_file))
+
+    for t, name in SIGNALS:
+        yield 'calc_ts:' + name, lambda t=t: load(raw_file, t), lambda x: len(calc_ts(x))
+    for t, name in SIGNALS:
+        yield 'reseq:' + name, lambda t=t: calc_ts(load(raw_file, t)), \
+                lambda x, t=t: len(ReseqState(samples_per_row(t))(x))
+    yield 'hr_rows', lambda: load(raw_file, TYPE_HR), lambda x: len(hr_rows(x))
+
+    for t, fn in [(TYPE_ACC, acc_bp_filter), (TYPE_PPG125, ppg125_bp_filter), (TYPE_PPG512, ppg512_bp_filter),
+                  (TYPE_ECG, ecg_bp_filter), (TYPE_ECG, ecg_pl_filter), (TYPE_ECG, ecg_filter)]:
+        yield 'filter:' + fn.__name__, lambda t=t: prepared(raw_file, t), lambda x, fn=fn: len(fn(x))
+    yield 'filter:ecg_stream:causal', lambda: prepared(raw_file, TYPE_ECG), \
+            lambda x: run_chunks(ecg_stream(zero_phase=False), x)
+    yield 'filter:ecg_stream:zero_phase', lambda: prepared(raw_file, TYPE_ECG), \
+            lambda x: run_chunks(ecg_stream(zero_phase=True), x)
+
+    def psd(x):
+        from spectral import welch
+        welch(x[:,2], 512)
+        return len(x)
+    yield 'welch:ecg', lambda: prepared(raw_file, TYPE_ECG), psd
+
+    def resample(streams):
+        from resample import align
+        align(streams, 128)
+        return sum(len(s[0]) for s in streams)
+    yield 'resample:align', lambda: [(prepared(raw_file, TYPE_ACC), [2, 3, 4]), (prepared(raw_file, TYPE_ECG), [2]),
+                                     (prepared(raw_file, TYPE_PPG125), [2])], resample
+
+    for fmt in ['csv', 'fastcsv', 'npy', 'col']:
+        yield 'export:' + fmt, lambda: prepared(raw_file, TYPE_ECG), export_stage(fmt, os.path.join(out, 'ecg'))
+
+    def plot(x):
+        from plots import plot_time_domain, plot_freq_domain
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        fig = Figure()
+        FigureCanvasAgg(fig)
+        ax1, ax2 = fig.add_subplot(2, 1, 1), fig.add_subplot(2, 1, 2)
+        plot_time_domain(ax1, x[:,1:])
+        plot_freq_domain(ax2, x[:,2], 512)
+        fig.savefig(os.path.join(out, 'plot.png'))
+        return len(x)
+    yield 'plot:ecg', lambda: prepared(raw_file, TYPE_ECG), plot
+
+    def render(x):
+        from render import filter_ecg, StripRenderer
+        StripRenderer().render(filter_ecg(x[:,[0,2]]), os.path.join(out, 'strip.png'))
+        return len(x)
+    yield 'render:ecg', lambda: calc_ts(load(raw_file, TYPE_ECG)), render
+
+    main_py, convert_py, analyze_py = [os.path.join(REPO, s) for s in ['main.py', 'convert.py', 'analyze.py']]
+    short_file = os.path.join(workdir, 'bench_startup.csv')
+    def short():
+        if not os.path.exists(short_file):
+            generate(short_file, STARTUP_SECONDS / 3600.)
+        return count(load_raw_file(short_file, use_cache=False))
+    yield 'startup:main.py', short, script_stage([main_py, '--no_cache', '--export', short_file], out)
+    yield 'main.py:export', total, script_stage([main_py, '--no_cache', '--export', '--fft', raw_file], out)
+    yield 'main.py:stream', total, script_stage([main_py, '--stream', '--export', '--fft', raw_file], out)
+    yield 'main.py:plot', total, script_stage([main_py, '--no_cache', '--fft', '--plot_type', '5', raw_file], out)
+    yield 'convert.py', total, script_stage([convert_py, '--no_cache', raw_file], out)
+    yield 'analyze.py', total, script_stage([analyze_py, '--no_cache', raw_file], out)
+
+def measure(prepare, run, repeat=1):
+    """ Run a stage in a child process, return seconds, samples and peak RSS (MB) """
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(r)
+        status = 1
+        try:
+            seconds = []
+            for _ in xrange(repeat):
+                x = prepare()
+                start = time.time()
+                samples = run(x)
+                seconds.append(time.time() - start)
+                del x
+            os.write(w, json.dumps({'seconds': min(seconds), 'samples': samples}))
+            status = 0
+        except Exception:
+            import traceback
+            traceback.print_exc()
+        finally:
+            os._exit(status)
+    os.close(w)
+    data = ''
+    while True:
+        buf = os.read(r, 4096)
+        if not buf:
+            break
+        data += buf
+    os.close(r)
+    _, status, usage = os.wait4(pid, 0)
+    if status:
+        return None
+    result = json.loads(data)
+    # ru_maxrss is in KB on Linux, scripts are run by the child so they count too
+    result['peak_rss_mb'] = usage.ru_maxrss / 1024.
+    return result
+
+def print_result(name, r, base=None):
+    line = '%-32s %9.3f s %14.0f samples/s %8.1f MB' % \
+           (name, r['seconds'], r['samples'] / max(r['seconds'], 1e-9), r['peak_rss_mb'])
+    if base:
+        ratio = r['seconds'] / max(base['seconds'], 1e-9)
+        line += '   x%.2f of baseline' % ratio
+    print line
+    sys.stdout.flush()
+
+def compare(results, baseline, threshold):
+    """ Return the names of the stages slower than the baseline by threshold """
+    return [n for n, r in sorted(results.items())
+            if n in baseline and r['seconds'] > threshold * baseline[n]['seconds']]
+
+if __name__ == "__main__":
+    args = parse_args()
+    workdir = args.workdir or tempfile.mkdtemp(prefix='bench')
+    if not os.path.exists(os.path.join(workdir, 'out')):
+        os.makedirs(os.path.join(workdir, 'out'))
+
+    raw_file = os.path.join(workdir, 'bench_%gh_%d.csv' % (args.hours, args.seed))
+    if not os.path.exists(raw_file):
+        start = time.time()
+        rows = generate(raw_file, args.hours, args.seed)
+        print 'generated %s: %d rows in %.1f s' % (raw_file, rows, time.time() - start)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['stages']
+
+    results = {}
+    for name, prepare, run in stages(raw_file, workdir):
+        if args.only and not re.search(args.only, name):
+            continue
+        r = measure(prepare, run, args.repeat)
+        if r is None:
+            print '%-32s FAILED' % name
+            continue
+        results[name] = r
+        print_result(name, r, baseline.get(name))
+
+    if args.save:
+        meta = {'hours': args.hours, 'seed': args.seed, 'bytes': os.path.getsize(raw_file),
+                'python': platform.python_version(), 'numpy': np.__version__, 'time': time.time()}
+        with open(args.save, 'w') as f:
+            json.dump({'meta': meta, 'stages': results}, f, indent=1, sort_keys=True)
+
+    if not args.workdir:
+        shutil.rmtree(workdir)
+
+    slower = compare(results, baseline, args.threshold)
+    if slower:
+        print 'slower than the baseline by more than x%.2f: %s' % (args.threshold, ', '.join(slower))
+    startup = results.get('startup:main.py', {}).get('seconds', 0)
+    if startup > STARTUP_TARGET:
+        print 'startup of main.py --export took %.3f s, the target is %.3f s' % (startup, STARTUP_TARGET)
+    if slower or startup > STARTUP_TARGET:
+        sys.exit(1)
@@ -0,0 +1,111 @@
+import hashlib
+import json
+import numpy as np
+import os
+import struct
+
+from parser import parse_raw_file
+
+# A cache file holds the arrays of parse_raw_file() for one raw data file:
+#   magic | header length | json header | arrays
+# Every array is stored column by column, so a column is contiguous, and
+# is opened with np.memmap.
+CACHE_MAGIC   = 'BDPCACHE'
+CACHE_VERSION = 1
+CACHE_FOLDER  = '.npcache'
+ALIGN         = 64
+HASH_BLOCK    = 1 << 20
+
+def cache_path(raw_data_file, cache_dir=None):
+    """ By default, the cache lives in .npcache next to the raw data file """
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(raw_data_file), CACHE_FOLDER)
+    return os.path.join(cache_dir, os.path.basename(raw_data_file) + '.npc')
+
+def source_key(raw_data_file):
+    """ size, mtime and a hash of the head and the tail of the file """
+    st = os.stat(raw_data_file)
+    h = hashlib.sha1()
+    with open(raw_data_file, 'rb') as f:
+        h.update(f.read(HASH_BLOCK))
+        if st.st_size > HASH_BLOCK:
+            f.seek(max(st.st_size - HASH_BLOCK, HASH_BLOCK))
+            h.update(f.read(HASH_BLOCK))
+    return [st.st_size, st.st_mtime, h.hexdigest()]
+
+def _align(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+def write_cache(path, key, raw):
+    """ Write {type: array} to path atomically """
+    arrays = []
+    offset = 0
+    for t in sorted(raw.keys()):
+        a = raw[t]
+        arrays.append({'type': t, 'dtype': a.dtype.str, 'shape': list(a.shape), 'offset': offset})
+        offset = _align(offset + a.nbytes)
+    header = json.dumps({'version': CACHE_VERSION, 'key': key, 'arrays': arrays})
+    start = _align(len(CACHE_MAGIC) + 8 + len(header))
+
+    d = os.path.dirname(path)
+    if d and not os.path.exists(d):
+        os.makedirs(d)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(CACHE_MAGIC + struct.pack('<Q', len(header)) + header)
+        for info in arrays:
+            f.seek(start + info['offset'])
+            # column by column
+            np.ascontiguousarray(raw[info['type']].T).tofile(f)
+    os.rename(tmp, path)
+
+def open_cache(path, key=None):
+    """ Return {type: read-only memory-mapped array}, or None if path is
+    missing, broken or not made from the source with the given key
+    """
+    try:
+        with open(path, 'rb') as f:
+            if f.read(len(CACHE_MAGIC)) != CACHE_MAGIC:
+                return None
+            size, = struct.unpack('<Q', f.read(8))
+            header = json.loads(f.read(size))
+    except (IOError, ValueError, struct.error):
+        return None
+    if header.get('version') != CACHE_VERSION or (key is not None and header.get('key') != key):
+        return None
+
+    start = _align(len(CACHE_MAGIC) + 8 + size)
+    raw = {}
+    for info in header['arrays']:
+        shape = tuple(info['shape'])
+        if not np.prod(shape):
+            raw[info['type']] = np.empty(shape, info['dtype'])
+            continue
+        m = np.memmap(path, dtype=info['dtype'], mode='r', offset=start + info['offset'], shape=shape[::-1])
+        raw[info['type']] = m.T
+    return raw
+
+def load_raw_file(raw_data_file, types=None, cache_dir=None, use_cache=True):
+    """
+    parse_raw_file() backed by a memory-mapped cache, which is written on
+    the first parse and reused as long as the raw data file is unchanged.
+    return: {type: numpy array}, arrays are read-only when cached
+    """
+    raw = None
+    if use_cache:
+        path = cache_path(raw_data_file, cache_dir)
+        key = source_key(raw_data_file)
+        raw = open_cache(path, key)
+    if raw is None:
+        with open(raw_data_file) as f:
+            # always parse all types, so the cache is complete
+            raw = parse_raw_file(f)
+        if use_cache:
+            try:
+                write_cache(path, key, raw)
+            except (IOError, OSError):
+                # e.g. read-only directory, just go without cache
+                pass
+    if types is not None:
+        raw = dict((t, raw[t]) for t in types if t in raw)
+    return raw
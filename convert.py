@@ -5,73 +5,59 @@ import argparse
 import numpy as np
 import os
 
+from cache import load_raw_file
+from export import export, COLUMN_NAMES, EXPORT_FORMATS
+from parser import interpolate_ts
+
 def parse_args():
     p = argparse.ArgumentParser()
     p.add_argument('raw_data_file', nargs=1, help='Specify the raw data file')
+    p.add_argument('--format', default='csv', choices=sorted(EXPORT_FORMATS.keys()), help='Export format')
+    p.add_argument('--precision', default=6, type=int, help='Digits after the decimal point for fastcsv')
+    p.add_argument('--no_cache', help='Do not use or write the parsed data cache', action='store_true')
     return vars(p.parse_args())
 
 MSEC_PER_SEC = 1000
 
 def get_interpolated_ts(ts, ratio):
-    new_ts = None
-    vals, idx = np.unique(ts, return_index=True)
-    idx = np.hstack((idx,ts.shape[0])) # so we can do idx[i+1] - idx[i]
-    vals = np.hstack((vals,vals[-1] + MSEC_PER_SEC))
-    for i in xrange(vals.size-1):
-        num = idx[i+1] - idx[i]
-        # we have to expand time intervals according to the ratio for
-        # we might have multiple data in one row
-        tmp = np.linspace(vals[i], vals[i+1], num * ratio, False)
-        new_ts = np.append(new_ts, tmp) if new_ts is not None else tmp
-    return new_ts
-
-EKG_VPP = 4.
-EKG_BITS = 23
-EKG_ADC_LSB = EKG_VPP / (1 << EKG_BITS)
-EKG_GAIN = 6
-
-def convert_ecg_to_mv(raw, ratio=(EKG_ADC_LSB * 1000.0 / EKG_GAIN)):
-    idx = np.where(raw >= (1<<22))
-    raw[idx] -= (1<<23)
-    return raw * ratio
-
-def convert_ppg_to_mv(raw):
-    return convert_ecg_to_mv(raw, 3.2*1000/65536)
+    # we have to expand time intervals according to the ratio for
+    # we might have multiple data in one row
+    return interpolate_ts(ts, ratio)
 
 if __name__ == "__main__":
     args = parse_args()
-    input_file = os.path.basename(args["raw_data_file"][0])
+    raw_data_file = args["raw_data_file"][0]
+    input_file = os.path.basename(raw_data_file)
 
     # 0: ACC, 5: ECG, 9: PPG 125 Hz, 12: PPG 512 Hz
     basename = os.path.splitext(input_file)[0]
+    ext = EXPORT_FORMATS[args["format"]]
     params = {
-             #type: [filename, wanted indexes, data per row, data per item, convert function (if any)]
-              0:  [ basename + "_acc.csv", [2,3,4,6,7,8,10,11,12], 3, 3, None],
-              5:  [ basename + "_ecg.csv", range(2,13), 11, 1, convert_ecg_to_mv],
-              9:  [ basename + "_ppg125.csv", range(2,13,2), 6, 1, convert_ppg_to_mv],
-              12: [ basename + "_ppg512.csv", range(2,14), 12, 1, convert_ppg_to_mv],
+             #type: [filename, data per row, data per row to be kept]
+              0:  [ basename + "_acc" + ext, 3, 3],
+              5:  [ basename + "_ecg" + ext, 12, 11],
+              9:  [ basename + "_ppg125" + ext, 6, 6],
+              12: [ basename + "_ppg512" + ext, 12, 12],
              }
 
-    data = np.genfromtxt(input_file, delimiter=",")
+    # parsed (and mv converted) data of all types, or the cached arrays
+    data = load_raw_file(raw_data_file, use_cache=not args["no_cache"])
     for data_type in params.keys():
-        fname, wanted, data_per_row, data_per_item, fn_convert = params[data_type]
+        fname, data_per_row, wanted = params[data_type]
 
         # check if data_type exists in the input file
-        idx = np.where(data[:,0] == data_type)[0]
-        if len(idx) <= 0:
+        if data_type not in data:
             continue
 
-        # filter out specific type
-        raw = data[idx]
-        # filter out columns and reshape into given row, column
-        raw = raw[:,wanted].reshape(raw.shape[0] * data_per_row, data_per_item)
-        # if further convert() is required, call it
-        if fn_convert:
-            raw = fn_convert(raw)
+        # group samples by row: (rows, data per row, ts + seq + data per item)
+        raw = data[data_type]
+        raw = raw.reshape(-1, data_per_row, raw.shape[1])
+        # keep wanted data of each row, drop ts and seq
+        values = raw[:,:wanted,2:].reshape(-1, raw.shape[2] - 2)
         # get the interpolated timestamp
-        ts = get_interpolated_ts(data[idx,-1] * MSEC_PER_SEC, data_per_row)
+        ts = get_interpolated_ts(raw[:,0,0], wanted)
         # match time stamps w/ the parsed data
-        output = np.column_stack((ts, raw))
-        # dump into output file
-        np.savetxt(fname, output, delimiter=',')
-
+        output = np.column_stack((ts, values))
+        # dump into output file, there is no seq column
+        names = [COLUMN_NAMES[data_type][0]] + COLUMN_NAMES[data_type][2:]
+        export(fname, output, args["format"], names, precision=args["precision"])
@@ -0,0 +1,282 @@
+import json
+import numpy as np
+import os
+import struct
+
+from parser import TYPE_ACC, TYPE_ECG, TYPE_PPG125, TYPE_PPG512, TYPE_HR
+
+COLUMN_NAMES = {
+        TYPE_ACC:    ["timestamp", "seq", "x", "y", "z"],
+        TYPE_ECG:    ["timestamp", "seq", "mv"],
+        TYPE_PPG125: ["timestamp", "seq", "mv"],
+        TYPE_PPG512: ["timestamp", "seq", "mv"],
+        TYPE_HR:     ["timestamp", "reported_hr", "original_hr", "confidence", "is_drop"],
+        }
+
+# format: file extension
+EXPORT_FORMATS = {
+        'csv':     '.csv',
+        'fastcsv': '.csv',
+        'npy':     '.npy',
+        'npz':     '.npz',
+        'col':     '.col',
+        }
+
+# outputs of a raw data file are named <basename>_<signal name>.<ext>
+SIGNAL_NAMES = ["acc", "ecg", "ppg125", "ppg512", "hr", "aligned", "rr", "hrv", "pulse",
+                "acc_psd", "ecg_psd", "ppg125_psd", "ppg512_psd"]
+
+FAST_CSV_ROWS = 1 << 14
+NPY_HEADER_SIZE = 128
+COL_MAGIC = 'BDPCOL1\n'
+COL_GROUP_ROWS = 1 << 18
+COL_ALIGN = 64
+
+# Every writer takes chunks of rows by __call__() and finishes the file by
+# close(). The file is created on the first chunk, so nothing is written
+# for a signal type which never shows up. With append, rows are added to
+# an existing file instead.
+
+class CsvWriter(object):
+    """ np.savetxt, as the csv files always have been written """
+    def __init__(self, fname, fmt='%.18e', header=None, append=False):
+        self.fname = fname
+        self.fmt = fmt
+        self.header = header
+        self.append = append
+        self.out = None
+
+    def _open(self):
+        append = self.append and os.path.exists(self.fname) and os.path.getsize(self.fname)
+        self.out = open(self.fname, 'a' if append else 'w')
+        if self.header and not append:
+            self.out.write(self.header + '\n')
+
+    def __call__(self, x):
+        if self.out is None:
+            self._open()
+        np.savetxt(self.out, x, fmt=self.fmt, delimiter=',')
+
+    def close(self):
+        if self.out:
+            self.out.close()
+
+class FastCsvWriter(CsvWriter):
+    """ Fixed precision csv, formatted a block of rows at a time """
+    def __call__(self, x):
+        if self.out is None:
+            self._open()
+        line = ','.join([self.fmt] * x.shape[1]) + '\n'
+        for i in xrange(0, len(x), FAST_CSV_ROWS):
+            block = x[i:i+FAST_CSV_ROWS]
+            self.out.write((line * len(block)) % tuple(block.ravel().tolist()))
+
+class NpyWriter(object):
+    """ A .npy file, which can be opened with np.load(mmap_mode='r')
+    The header is rewritten with the final shape on close().
+    """
+    def __init__(self, fname, dtype=float, append=False):
+        self.fname = fname
+        self.dtype = np.dtype(dtype)
+        self.append = append
+        self.out = None
+        self.rows = 0
+        self.cols = 0
+
+    def _header(self):
+        d = {'descr': np.lib.format.dtype_to_descr(self.dtype), 'fortran_order': False,
+             'shape': (self.rows, self.cols)}
+        h = repr(d).ljust(NPY_HEADER_SIZE - 10 - 1) + '\n'
+        return np.lib.format.magic(1, 0) + struct.pack('<H', len(h)) + h
+
+    def _reopen(self):
+        """ Continue after the rows of an existing file """
+        self.out = open(self.fname, 'r+b')
+        np.lib.format.read_magic(self.out)
+        (self.rows, self.cols), _, dtype = np.lib.format.read_array_header_1_0(self.out)
+        if self.out.tell() != NPY_HEADER_SIZE or dtype != self.dtype:
+            raise ValueError('%s was not written by NpyWriter' % self.fname)
+        # rows written after the header was last updated are dropped
+        row_size = self.cols * self.dtype.itemsize
+        self.rows = min(self.rows, (os.path.getsize(self.fname) - NPY_HEADER_SIZE) // row_size)
+        self.out.seek(NPY_HEADER_SIZE + self.rows * row_size)
+        self.out.truncate()
+
+    def __call__(self, x):
+        if self.out is None:
+            if self.append and os.path.exists(self.fname):
+                self._reopen()
+            else:
+                self.out = open(self.fname, 'wb')
+                self.cols = x.shape[1]
+                self.out.write(self._header())
+        np.ascontiguousarray(x, dtype=self.dtype).tofile(self.out)
+        self.rows += len(x)
+
+    def close(self):
+        if self.out:
+            self.out.seek(0)
+            self.out.write(self._header())
+            self.out.close()
+
+class NpzWriter(object):
+    """ A .npz file with one array per column, kept in memory until close() """
+    def __init__(self, fname, names, dtype=float):
+        self.fname = fname
+        self.names = names
+        self.dtype = dtype
+        self.chunks = []
+
+    def __call__(self, x):
+        self.chunks.append(np.asarray(x, dtype=self.dtype))
+
+    def close(self):
+        if self.chunks:
+            x = np.concatenate(self.chunks)
+            np.savez(self.fname, **dict((n, x[:,i]) for i, n in enumerate(self.names)))
+
+class ColumnarWriter(object):
+    """ A chunked columnar file:
+    magic | row group | row group | ... | json footer | footer length | magic
+    Each row group stores its columns one after another, so reading a column
+    of a row group is a single np.memmap. The footer keeps the offsets and
+    min/max of each column per row group.
+    """
+    def __init__(self, fname, names, dtype=float, group_rows=COL_GROUP_ROWS, append=False):
+        self.fname = fname
+        self.names = names
+        self.dtype = np.dtype(dtype)
+        self.group_rows = group_rows
+        self.append = append
+        self.out = None
+        self.buf = []
+        self.buffered = 0
+        self.groups = []
+
+    def _flush_group(self, x):
+        group = {'rows': len(x), 'offsets': [], 'min': [], 'max': []}
+        for i in range(len(self.names)):
+            pad = -self.out.tell() % COL_ALIGN
+            self.out.write('\0' * pad)
+            group['offsets'].append(self.out.tell())
+            col = np.ascontiguousarray(x[:,i], dtype=self.dtype)
+            col.tofile(self.out)
+            group['min'].append(col.min().item())
+            group['max'].append(col.max().item())
+        self.groups.append(group)
+
+    def _reopen(self):
+        """ Continue after the row groups of an existing file, the footer is
+        written again on close()
+        """
+        footer = read_columnar_footer(self.fname)
+        if footer['names'] != self.names or footer['dtype'] != self.dtype.str:
+            raise ValueError('%s has other columns' % self.fname)
+        self.groups = footer['row_groups']
+        self.out = open(self.fname, 'r+b')
+        self.out.seek(-len(COL_MAGIC) - 8, os.SEEK_END)
+        size, = struct.unpack('<Q', self.out.read(8))
+        self.out.seek(-len(COL_MAGIC) - 8 - size, os.SEEK_END)
+        self.out.truncate()
+
+    def __call__(self, x):
+        if self.out is None:
+            if self.append and os.path.exists(self.fname):
+                self._reopen()
+            else:
+                self.out = open(self.fname, 'wb')
+                self.out.write(COL_MAGIC)
+        self.buf.append(x)
+        self.buffered += len(x)
+        if self.buffered < self.group_rows:
+            return
+        x = np.concatenate(self.buf)
+        n = len(x) // self.group_rows * self.group_rows
+        for i in xrange(0, n, self.group_rows):
+            self._flush_group(x[i:i+self.group_rows])
+        self.buf = [x[n:]]
+        self.buffered = len(x) - n
+
+    def close(self):
+        if self.out is None:
+            return
+        if self.buffered:
+            self._flush_group(np.concatenate(self.buf))
+        footer = json.dumps({'names': self.names, 'dtype': self.dtype.str, 'row_groups': self.groups})
+        self.out.write(footer + struct.pack('<Q', len(footer)) + COL_MAGIC)
+        self.out.close()
+
+def read_columnar_footer(fname):
+    with open(fname, 'rb') as f:
+        f.seek(-len(COL_MAGIC) - 8, os.SEEK_END)
+        size, = struct.unpack('<Q', f.read(8))
+        if f.read(len(COL_MAGIC)) != COL_MAGIC:
+            raise ValueError('%s is not a columnar file' % fname)
+        f.seek(-len(COL_MAGIC) - 8 - size, os.SEEK_END)
+        return json.loads(f.read(size))
+
+def read_columnar_trailer(fname):
+    """ Return the footer, its length and the magic at the end of the file,
+    which an appending ColumnarWriter writes over
+    """
+    with open(fname, 'rb') as f:
+        f.seek(-len(COL_MAGIC) - 8, os.SEEK_END)
+        size, = struct.unpack('<Q', f.read(8))
+        f.seek(-len(COL_MAGIC) - 8 - size, os.SEEK_END)
+        return f.read()
+
+def iter_row_groups(fname, columns=None):
+    """ Yield {column: memory-mapped array} per row group """
+    footer = read_columnar_footer(fname)
+    names = columns or footer['names']
+    for g in footer['row_groups']:
+        yield dict((n, np.memmap(fname, dtype=footer['dtype'], mode='r', shape=(g['rows'],),
+                                 offset=g['offsets'][footer['names'].index(n)]))
+                   for n in names)
+
+def read_columnar(fname, columns=None):
+    """ Return {column: array} of the whole file """
+    groups = list(iter_row_groups(fname, columns))
+    if len(groups) == 1:
+        return groups[0]
+    footer = read_columnar_footer(fname)
+    names = columns or footer['names']
+    if not groups:
+        return dict((n, np.empty(0, dtype=footer['dtype'])) for n in names)
+    return dict((n, np.concatenate([g[n] for g in groups])) for n in names)
+
+def open_writer(fname, fmt='csv', names=None, integer=False, header=None, precision=6, append=False):
+    """
+    fname:     output file name, see EXPORT_FORMATS for its extension
+    names:     column names, used as keys by npz and col
+    integer:   write integers instead of floats
+    header:    the first line of csv files
+    precision: digits after the decimal point of fastcsv
+    append:    add rows to an existing file, not supported by npz
+    """
+    dtype = np.int64 if integer else np.float64
+    if fmt == 'csv':
+        return CsvWriter(fname, '%d' if integer else '%.18e', header, append)
+    if fmt == 'fastcsv':
+        return FastCsvWriter(fname, '%d' if integer else '%%.%df' % precision, header, append)
+    if fmt == 'npy':
+        return NpyWriter(fname, dtype, append)
+    if fmt == 'npz':
+        if append:
+            raise ValueError('npz files can not be appended to')
+        return NpzWriter(fname, names, dtype)
+    if fmt == 'col':
+        return ColumnarWriter(fname, names, dtype, append=append)
+    raise ValueError('unknown export format: %s' % fmt)
+
+def export(fname, x, fmt='csv', names=None, integer=False, header=None, precision=6):
+    """ Write the whole array at once, see open_writer() """
+    w = open_writer(fname, fmt, names, integer, header, precision)
+    w(x)
+    w.close()
+
+def output_names(raw_data_file, output_dir=None, fmt='csv'):
+    """ Return {"acc_out": <basename>_acc.<ext>, ...} for the raw data file """
+    basename = os.path.splitext(os.path.basename(raw_data_file))[0]
+    ext = EXPORT_FORMATS[fmt]
+    return dict((n + "_out", os.path.join(output_dir or "", basename + "_" + n + ext)) for n in SIGNAL_NAMES)
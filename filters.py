@@ -1,6 +1,7 @@
-import scipy
 import numpy as np
-from scipy import signal
+from lazy import lazy_import
+
+signal = lazy_import('scipy.signal')
 
 ACC_FS = 100
 ECG_FS = 512
@@ -10,16 +11,70 @@ PPG_FS_512 = 512 # don't skip any received data, ambient data has been skipped b
 LOW_PASS_CUTOFF = 5
 HIGH_PASS_CUTOFF = 0.5
 
+# memoized filter designs, see design_filter()
+_designs = {}
+_design_stats = {'hits': 0, 'misses': 0}
+
+def _design(fs, band, order, btype):
+    nyq = 0.5 * fs
+    if btype == 'notch':
+        f0, Q = band
+        b, a = signal.iirnotch(f0 / nyq, Q)
+        return signal.tf2sos(b, a)
+    cutoff = [band[0]/nyq, band[1]/nyq] if btype == 'band' else band/nyq
+    return signal.butter(order, cutoff, btype=btype, analog=False, output='sos')
+
+def design_filter(fs, band, order=3, btype='band'):
+    """ Return the second-order sections of a filter, designed only once
+    fs:    sampling frequency
+    band:  (low, high) for band, cutoff for highpass/lowpass, (f0, Q) for notch
+    btype: 'band', 'highpass', 'lowpass' or 'notch'
+    The returned array is shared, do not modify it.
+    """
+    key = (fs, band, order, btype)
+    sos = _designs.get(key)
+    if sos is None:
+        _design_stats['misses'] += 1
+        sos = _designs[key] = _design(fs, band, order, btype)
+    else:
+        _design_stats['hits'] += 1
+    return sos
+
+def design_cache_info():
+    """ Return hits, misses and size of the filter design cache """
+    return dict(_design_stats, size=len(_designs))
+
+def butter_sos(fs, f1, f2=None, btype='band', order=3):
+    band = (f1, f2) if btype == 'band' else f1
+    return design_filter(fs, band, order, btype)
+
+def notch_sos(fs, f0=65.0, Q=30.0):
+    return design_filter(fs, (f0, Q), btype='notch')
+
 def power_line_noise_filter(data, fs, f0=65.0, Q=30.0):
-    w0 = f0 / (fs/2)
-    b, a = signal.iirnotch(w0, Q)
-    return scipy.signal.filtfilt(b, a, data)
+    return signal.sosfiltfilt(notch_sos(fs, f0, Q), data)
 
 def butter_filter(data, fs, f1, f2=None, btype='band', order=3):
-    nyq = 0.5 * fs
-    cutoff = [f1/nyq, f2/nyq] if btype == 'band' else f1/nyq
-    b, a = scipy.signal.butter(order, cutoff, btype=btype, analog=False)
-    return scipy.signal.filtfilt(b, a, data)
+    return signal.sosfiltfilt(butter_sos(fs, f1, f2, btype, order), data)
+
+def chain_sos(*stages):
+    """ Fuse cascaded filter stages into a single SOS cascade """
+    return np.vstack(stages)
+
+def chain_filter(data, sos, axis=0):
+    """ Zero-phase filter every channel of a 1-D or 2-D array in one pass
+    data: e.g. acc xyz or multi-lead data, one channel per column
+    sos:  a single design or stages fused by chain_sos()
+    """
+    return signal.sosfiltfilt(sos, data, axis=axis)
+
+def band_chain(fs, highcut, lowcut):
+    """ High-pass then low-pass, fused """
+    return chain_sos(butter_sos(fs, highcut, btype='highpass'), butter_sos(fs, lowcut, btype='lowpass'))
+
+def ecg_chain(fs=ECG_FS):
+    """ Power line noise filter then band-pass, fused """
+    return chain_sos(notch_sos(fs), butter_sos(fs, HIGH_PASS_CUTOFF, LOW_PASS_CUTOFF))
 
 def butter_bandpass_filter(data, fs, lowcut, highcut, order=3):
     return butter_filter(data, fs, lowcut, highcut, 'band', order)
@@ -31,8 +86,8 @@ def low_pass_filter(data, fs, cutoff, order=3):
     return butter_filter(data, fs, cutoff, btype='lowpass', order=order)
 
 def acc_bp_filter(data, fs=ACC_FS):
-    for i in range(2,5):
-        data[:,i] = butter_bandpass_filter(data[:,i], fs, HIGH_PASS_CUTOFF, LOW_PASS_CUTOFF)
+    # filter xyz together
+    data[:,2:5] = chain_filter(data[:,2:5], butter_sos(fs, HIGH_PASS_CUTOFF, LOW_PASS_CUTOFF))
     return data
 
 def ppg125_bp_filter(x, fs=PPG_FS_125):
@@ -54,6 +109,107 @@ def ecg_pl_filter(x):
     x[:,2] = power_line_noise_filter(x[:,2], ECG_FS)
     return x
 
+def ecg_filter(x):
+    """ ecg_pl_filter and ecg_bp_filter in a single pass """
+    x[:,2] = chain_filter(x[:,2], ecg_chain())
+    return x
+
+def impulse_length(sos, tol=1e-6, limit=1 << 20):
+    """ Number of samples until the impulse response decays below tol """
+    n = 1024
+    while True:
+        x = np.zeros(n)
+        x[0] = 1.
+        h = np.abs(signal.sosfilt(sos, x))
+        above = np.flatnonzero(h > tol * h.max())
+        if above[-1] < n - 1 or n >= limit:
+            return above[-1] + 1
+        n *= 2
+
+class StreamFilter(object):
+    """ A causal filter which carries its state over consecutive chunks
+    sos:     second-order sections of the filter
+    columns: the columns of a chunk to be filtered
+    """
+    def __init__(self, sos, columns=(2,)):
+        self.sos = sos
+        self.columns = list(columns)
+        self.zi = None
+
+    def __call__(self, x):
+        data = x[:,self.columns]
+        if self.zi is None:
+            # start from the steady state of the first sample
+            zi = signal.sosfilt_zi(self.sos)
+            self.zi = zi[:,:,np.newaxis] * data[0]
+        x[:,self.columns], self.zi = signal.sosfilt(self.sos, data, axis=0, zi=self.zi)
+        return x
+
+    def flush(self):
+        return np.empty((0, 0))
+
+class BlockFiltFilt(StreamFilter):
+    """ A zero-phase filter working on consecutive chunks.
+    Every chunk is filtered forward and backward together with `overlap`
+    samples of history before it and of lookahead after it, which absorb
+    the edge transients. So output is delayed by `overlap` samples and
+    matches filtfilt() on the whole signal up to the decay tolerance.
+    """
+    def __init__(self, sos, columns=(2,), overlap=None):
+        StreamFilter.__init__(self, sos, columns)
+        self.overlap = overlap or impulse_length(sos)
+        self.rows = None
+        # rows at the beginning of self.rows which are already emitted
+        self.history = 0
+
+    def _filter(self, end):
+        out = self.rows[self.history:end].copy()
+        y = signal.sosfiltfilt(self.sos, self.rows[:,self.columns], axis=0)
+        out[:,self.columns] = y[self.history:end]
+        return out
+
+    def __call__(self, x):
+        self.rows = x if self.rows is None else np.vstack((self.rows, x))
+        end = len(self.rows) - self.overlap
+        if end <= self.history:
+            return x[:0]
+        out = self._filter(end)
+        keep = max(end - self.overlap, 0)
+        self.rows = self.rows[keep:]
+        self.history = end - keep
+        return out
+
+    def flush(self):
+        if self.rows is None or len(self.rows) <= self.history:
+            return np.empty((0, 0))
+        out = self._filter(len(self.rows))
+        self.rows = None
+        self.history = 0
+        return out
+
+def stream_filter(sos, columns=(2,), zero_phase=False):
+    if zero_phase:
+        return BlockFiltFilt(sos, columns)
+    return StreamFilter(sos, columns)
+
+def acc_bp_stream(fs=ACC_FS, zero_phase=False):
+    return stream_filter(butter_sos(fs, HIGH_PASS_CUTOFF, LOW_PASS_CUTOFF), [2, 3, 4], zero_phase)
+
+def ppg125_bp_stream(fs=PPG_FS_125, zero_phase=False):
+    return stream_filter(butter_sos(fs, HIGH_PASS_CUTOFF, LOW_PASS_CUTOFF), zero_phase=zero_phase)
+
+def ppg512_bp_stream(zero_phase=False):
+    return ppg125_bp_stream(PPG_FS_512, zero_phase)
+
+def ecg_bp_stream(fs=ECG_FS, zero_phase=False):
+    return stream_filter(butter_sos(fs, HIGH_PASS_CUTOFF, LOW_PASS_CUTOFF), zero_phase=zero_phase)
+
+def ecg_pl_stream(zero_phase=False):
+    return stream_filter(notch_sos(ECG_FS), zero_phase=zero_phase)
+
+def ecg_stream(zero_phase=False):
+    return stream_filter(ecg_chain(), zero_phase=zero_phase)
+
 def acc_mag_filter(x):
     filtered = x[:,1]
     # ??
@@ -1,33 +1,34 @@
 from __future__ import print_function
-import httplib2
+import argparse
+import hashlib
+import io
+import multiprocessing
 import os
+import Queue
+import shutil
+import threading
 import time
-import io
+import traceback
 
-from apiclient import discovery
-from apiclient.http import MediaIoBaseDownload, MediaFileUpload
-from oauth2client import client
-from oauth2client import tools
-from oauth2client.file import Storage
+try:
+    import httplib2
+    from apiclient import discovery
+    from apiclient.http import MediaIoBaseDownload, MediaFileUpload
+    from oauth2client import client
+    from oauth2client import tools
+    from oauth2client.file import Storage
+except ImportError:
+    # only LocalBackend works without the google api client
+    tools = None
 
+import profiling
+from ledger import Ledger, FETCHED, RENDERED, DONE
 from parser import is_ecg, parse_data, TYPE_ECG
-from filters import power_line_noise_filter
-from filters import high_pass_filter
-from filters import low_pass_filter
-from plots import plot_ecg, plot_to_png
+from render import filter_ecg, get_renderer
 
 import numpy as np
-import matplotlib.pyplot as plot
 
-ECG_FS = 512
-LOW_PASS_CUTOFF = 35
-HIGH_PASS_CUTOFF = 0.5
-
-try:
-    import argparse
-    flags = argparse.ArgumentParser(parents=[tools.argparser]).parse_args()
-except ImportError:
-    flags = None
+flags = None
 
 # If modifying these scopes, delete your previously saved credentials
 # at ~/.credentials/drive-python-quickstart.json
@@ -39,6 +40,29 @@ MONITOR_FOLDER_ID = '1JhRkeKNactLp40gmVUSUMKklB5LJwx7j'
 PNG_FOLDER_ID = '1G0pFjG8pp1qG2KxcnE-xIZ64CuKeRkGW'
 POLLING_CHANGES_SECOND = 45
 CACHE_FOLDER = '.cache'
+LEDGER_FILE = os.path.join(CACHE_FOLDER, 'ledger.sqlite')
+# file metadata comes along with the changes, a page of changes at a time
+CHANGES_FIELDS = 'nextPageToken,newStartPageToken,changes(fileId,file(id,name,parents,trashed,md5Checksum,modifiedTime))'
+CHANGES_PAGE_SIZE = 1000
+FETCH_WORKERS = 4
+UPLOAD_WORKERS = 2
+QUEUE_SIZE = 8
+
+def parse_args():
+    p = argparse.ArgumentParser(parents=[tools.argparser] if tools else [])
+    p.add_argument('--local', metavar='WATCH_DIR', help='Monitor a local directory instead of Google Drive')
+    p.add_argument('--png_dir', default='png', help='Where png files of --local are copied to')
+    p.add_argument('--fetch_workers', default=FETCH_WORKERS, type=int, help='Threads downloading files')
+    p.add_argument('--upload_workers', default=UPLOAD_WORKERS, type=int, help='Threads uploading png files')
+    p.add_argument('--jobs', default=multiprocessing.cpu_count(), type=int, \
+                   help='Processes parsing, filtering and rendering files')
+    p.add_argument('--queue_size', default=QUEUE_SIZE, type=int, help='Files waiting between two stages at most')
+    p.add_argument('--once', help='Process pending changes once and exit', action='store_true')
+    p.add_argument('--ledger', default=LEDGER_FILE, help='Database of the processing state of every file')
+    p.add_argument('--profile', metavar='REPORT', \
+                   help='Write the rows, bytes, seconds and memory of each stage to REPORT (json) after every poll')
+    p.add_argument('--cprofile', help='Also write cProfile stats of each stage next to REPORT', action='store_true')
+    return p.parse_args()
 
 def create_cache_dir():
     if not os.path.exists(CACHE_FOLDER):
@@ -101,7 +125,8 @@ def list_changes(service, token):
     """ Return changes and newStartPageToken """
     start = token
     while True:
-        resp = service.changes().list(pageToken=start, spaces='drive').execute()
+        resp = service.changes().list(pageToken=start, spaces='drive', pageSize=CHANGES_PAGE_SIZE,
+                                      fields=CHANGES_FIELDS).execute()
         yield (resp.get('changes'), resp.get('newStartPageToken'))
 
         if resp.get('nextPageToken'):
@@ -109,20 +134,12 @@ def list_changes(service, token):
         if resp.get('newStartPageToken'):
             break;
 
-def filter_changes(service, token):
-    """ Return (trashed, change, newStartPageToken) """
-    for changes, new in list_changes(service, token):
-        for c in changes:
-            if c.get('file'):
-                ignore = False
-                # check if the parent directoy is what we want
-                resp = service.files().get(fileId=c.get('file').get('id'), fields='trashed,parents').execute()
-                if resp.get('parents') and resp.get('parents')[0] == MONITOR_FOLDER_ID:
-                    if resp.get('trashed'):
-                        # ignore those files moved to trash can
-                        yield True, c, new
-                    else:
-                        yield False, c, new
+def filter_changes(changes):
+    """ Return files of the changes in the monitored folder, except those moved to trash can """
+    for c in changes:
+        f = c.get('file')
+        if f and f.get('parents') and f.get('parents')[0] == MONITOR_FOLDER_ID and not f.get('trashed'):
+            yield f
 
 def download_file(service, file_id):
     req = service.files().get_media(fileId=file_id)
@@ -143,66 +160,245 @@ def upload_png(service, local_file_path, remote_file_name):
     resp = service.files().create(body=file_metadata, media_body=media, fields='id').execute()
     print('Uploaded: ', resp)
 
-def process(service, change):
-    # debug
-    print(change)
-    # prepare png name
-    file_name = change.get('file').get('name')
-    png_name = os.path.splitext(file_name)[0] + '.png'
-    local_png_path = os.path.join(CACHE_FOLDER, png_name)
-    # download from upstream
-    f = download_file(service, change.get('file').get('id'))
+class DriveBackend(object):
+    """ Files of MONITOR_FOLDER_ID in, png files to PNG_FOLDER_ID out """
+    def __init__(self, credentials):
+        self.credentials = credentials
+        self.local = threading.local()
+        self.token = None
+        self.new_token = None
+
+    def service(self):
+        # httplib2 is not thread safe, so one connection per thread
+        if not hasattr(self.local, 'service'):
+            http = self.credentials.authorize(httplib2.Http())
+            self.local.service = discovery.build('drive', 'v3', http=http)
+        return self.local.service
+
+    def poll(self):
+        """ Return the files changed since the last commit() """
+        if self.token is None:
+            self.token = get_start_page_token(self.service())
+        print('current token: ', self.token)
+        files = []
+        for changes, new in list_changes(self.service(), self.token):
+            files += filter_changes(changes)
+            self.new_token = new or self.new_token
+        for f in files:
+            f['revision'] = f.get('md5Checksum') or f.get('modifiedTime')
+        return files
+
+    def commit(self):
+        """ The files of the last poll() are done """
+        print('new token: ', self.new_token)
+        if self.new_token:
+            save_start_page_token(self.new_token)
+            self.token = self.new_token
+
+    def download(self, f):
+        return download_file(self.service(), f.get('id'))
+
+    def upload(self, local_file_path, remote_file_name):
+        upload_png(self.service(), local_file_path, remote_file_name)
+
+class LocalBackend(object):
+    """ A local directory standing in for Drive, e.g. for testing: new or
+    modified files in watch_dir are processed and png files are copied to png_dir
+    """
+    def __init__(self, watch_dir, png_dir):
+        self.watch_dir = watch_dir
+        self.png_dir = png_dir
+        if not os.path.exists(png_dir):
+            os.makedirs(png_dir)
+        # name: (size, mtime)
+        self.seen = {}
+        self.pending = {}
+
+    def poll(self):
+        files = []
+        for name in sorted(os.listdir(self.watch_dir)):
+            path = os.path.join(self.watch_dir, name)
+            if not os.path.isfile(path):
+                continue
+            st = os.stat(path)
+            rev = (st.st_size, st.st_mtime)
+            if self.seen.get(name) != rev:
+                files.append({'id': path, 'name': name, 'revision': '%d:%r' % rev})
+                self.pending[name] = rev
+        return files
+
+    def commit(self):
+        self.seen.update(self.pending)
+        self.pending = {}
+
+    def download(self, f):
+        with open(f.get('id'), 'rb') as src:
+            return io.BytesIO(src.read())
+
+    def upload(self, local_file_path, remote_file_name):
+        shutil.copyfile(local_file_path, os.path.join(self.png_dir, remote_file_name))
+        print('Uploaded: ', remote_file_name)
+
+_DONE = object()
+
+def _stage_worker(fn, q_in, q_out, failed):
+    while True:
+        item = q_in.get()
+        if item is _DONE:
+            break
+        try:
+            out = fn(item)
+        except Exception:
+            traceback.print_exc()
+            # list.append is atomic, no lock needed
+            failed.append((item, traceback.format_exc()))
+            out = None
+        if out is not None and q_out is not None:
+            q_out.put(out)
+
+def run_stages(items, stages):
+    """
+    Run items through stages of worker threads connected by bounded queues,
+    return when all items are done or failed
+    stages: list of (fn, workers, queue size), fn returns the item for the
+            next stage, None drops it
+    return: (item, error) of the items a stage raised on, as that stage got them
+    """
+    queues = [Queue.Queue(size) for _, _, size in stages] + [None]
+    threads = []
+    failed = []
+    for i, (fn, workers, _) in enumerate(stages):
+        threads.append([threading.Thread(target=_stage_worker, args=(fn, queues[i], queues[i+1], failed))
+                        for _ in range(workers)])
+        for t in threads[-1]:
+            t.daemon = True
+            t.start()
+    for item in items:
+        queues[0].put(item)
+    # a stage is stopped after all items have left the stage before it
+    for q, workers in zip(queues, threads):
+        for _ in workers:
+            q.put(_DONE)
+        for t in workers:
+            t.join()
+    return failed
+
+def png_name_of(file_name):
+    return os.path.splitext(file_name)[0] + '.png'
+
+def process_data(file_name, data):
+    """ Parse, filter and render the raw data of a file, return the local png path """
+    local_png_path = os.path.join(CACHE_FOLDER, png_name_of(file_name))
     # parse
-    data = parse_data(f, TYPE_ECG)
+    data = profiling.wrap('parse', parse_data)(io.BytesIO(data), TYPE_ECG)
     data = np.array(data)
     # filter
-    filtered = data[:,1]
-    filtered = power_line_noise_filter(filtered, ECG_FS)
-    filtered = high_pass_filter(filtered, ECG_FS, HIGH_PASS_CUTOFF)
-    filtered = low_pass_filter(filtered, ECG_FS, LOW_PASS_CUTOFF)
-    filtered = np.column_stack((data[:,0], filtered))
-    # save to png
-    plot_ecg(filtered)
-    plot_to_png(local_png_path)
-    # upload
-    upload_png(service, local_png_path, png_name)
+    filtered = profiling.wrap('filter', filter_ecg)(data)
+    # save to png, the figure is reused over files
+    profiling.wrap('render', get_renderer().render)(filtered, local_png_path)
+    return local_png_path
+
+def _process_data(args):
+    """ Run in a worker, return the png path and the profiling counters """
+    return process_data(*args), profiling.snapshot()
+
+def monitor_stages(backend, ledger, pool=None, jobs=1, fetch_workers=FETCH_WORKERS,
+                   upload_workers=UPLOAD_WORKERS, queue_size=QUEUE_SIZE):
+    """ download => parse, filter and render => upload
+    ledger: records the state of each file after every stage
+    pool:   a pool of `jobs` processes to parse, filter and render in, one
+            thread per process waits for them; otherwise in a single thread
+    """
+    def tracked(fn):
+        # the time of a whole stage, including waiting for the pool
+        fn = profiling.wrap('stage:' + fn.__name__, fn, cprofile=False)
+        def stage(job):
+            f = job[0] if isinstance(job, tuple) else job
+            try:
+                return fn(job)
+            except Exception:
+                ledger.failed(f.get('id'), traceback.format_exc())
+                raise
+        return stage
+
+    def fetch(f):
+        # debug
+        print(f)
+        row = ledger.get(f.get('id'))
+        if row and row['state'] == RENDERED and os.path.exists(row['png']):
+            # resumed after rendering, only the upload is left
+            return f, None
+        data = profiling.wrap('download', lambda f: backend.download(f).getvalue())(f)
+        content_hash = hashlib.sha1(data).hexdigest()
+        local_png_path = os.path.join(CACHE_FOLDER, png_name_of(f.get('name')))
+        if ledger.done_png(f.get('id'), content_hash, local_png_path):
+            print('Skipped, png is up to date: ', f.get('name'))
+            ledger.update(f.get('id'), DONE, content_hash=content_hash, png=local_png_path)
+            return None
+        ledger.update(f.get('id'), FETCHED, content_hash=content_hash)
+        return f, data
+
+    def process(job):
+        f, data = job
+        if data is None:
+            return f, ledger.get(f.get('id'))['png']
+        args = (f.get('name'), data)
+        if pool:
+            local_png_path, collected = pool.apply(_process_data, (args,))
+            profiling.merge(collected)
+        else:
+            local_png_path = process_data(*args)
+        ledger.update(f.get('id'), RENDERED, png=local_png_path)
+        return f, local_png_path
+
+    def upload(job):
+        f, local_png_path = job
+        profiling.wrap('upload', backend.upload)(local_png_path, png_name_of(f.get('name')))
+        ledger.update(f.get('id'), DONE)
+
+    return [(tracked(fetch), fetch_workers, queue_size),
+            (tracked(process), jobs if pool else 1, queue_size),
+            (tracked(upload), upload_workers, queue_size)]
 
 def main():
+    global flags
+    flags = parse_args()
     create_cache_dir()
-    credentials = get_credentials()
-    http = credentials.authorize(httplib2.Http())
-    service = discovery.build('drive', 'v3', http=http)
-
-    curr_token = get_start_page_token(service)
+    if flags.local:
+        backend = LocalBackend(flags.local, flags.png_dir)
+    else:
+        backend = DriveBackend(get_credentials())
+    ledger = Ledger(flags.ledger)
+    if flags.profile:
+        profiling.enable(flags.cprofile)
+    # fork before any thread is started
+    pool = multiprocessing.Pool(flags.jobs) if flags.jobs > 1 else None
+    stages = monitor_stages(backend, ledger, pool, flags.jobs, flags.fetch_workers, flags.upload_workers,
+                            flags.queue_size)
 
     while True:
-        print('current token: ', curr_token)
-        new_token = None
-        for trashed, c, new_token in filter_changes(service, curr_token):
-            # process changes
-            if not trashed and c:
-                process(service, c)
-
-        print('new token: ', new_token)
-        if new_token:
-             save_start_page_token(new_token)
-             curr_token = new_token
-
-        # print('sleep!')
-	time.sleep(POLLING_CHANGES_SECOND)
-        # print('wakeup!')
-
-    #results = service.files().list(
-    #    pageSize=10,fields="nextPageToken, files(id, name)").execute()
-    #items = results.get('files', [])
-    #if not items:
-    #    print('No files found.')
-    #else:
-    #    print('Files:')
-    #    for item in items:
-    #        print(type(item))
-    #        print(item)
-    #        #print('{0} ({1})'.format(item['name'], item['id']))
+        # files left over by the last run or failed on an earlier poll go first
+        files = ledger.unfinished()
+        if files:
+            print('resuming: ', len(files))
+        new = ledger.add(backend.poll())
+        ids = set(f['id'] for f in new)
+        files = [f for f in files if f['id'] not in ids] + new
+        failed = run_stages(files, stages)
+        if failed:
+            print('failed: ', len(failed))
+        # every file is done or failed in the ledger now, so the token can move on
+        backend.commit()
+        if flags.profile:
+            profiling.write_report(flags.profile)
+        if flags.once:
+            break
+        time.sleep(POLLING_CHANGES_SECOND)
+
+    if pool:
+        pool.close()
+        pool.join()
+    ledger.close()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,43 @@
+import numpy as np
+
+HR_CSV_HEADER = "#timestamp,reported_hr,original_hr,confidence,is_drop"
+
+CONFIDENCE_HIGH = 3
+CONFIDENCE_INVALID = 255
+
+def hr_rows(hr_data, prev=None):
+    """ Carry beats forward or mark drops
+    hr_data: beats, confidence, local timestamp, timestamp rows
+    prev:    the row before hr_data[0], if any
+    return:  timestamp, reported hr, original hr, confidence, is_drop rows
+
+    A row is dropped if its confidence is 255 (-1), or if it is 0 or 1 and
+    the confidence of the previous row is not 3. Otherwise a row of
+    confidence 0 or 1 reports the beats of the previous row.
+    """
+    hr_data = np.asarray(hr_data, dtype=np.int64).reshape(-1, 4)
+    beats = hr_data[:,0]
+    confidence = hr_data[:,1]
+    if prev is None:
+        prev_beats = np.hstack((0, beats[:-1]))
+        prev_confidence = np.hstack((-1, confidence[:-1]))
+    else:
+        prev_beats = np.hstack((prev[0], beats[:-1]))
+        prev_confidence = np.hstack((prev[1], confidence[:-1]))
+
+    low = (confidence == 0) | (confidence == 1)
+    carry = low & (prev_confidence == CONFIDENCE_HIGH)
+    drop = (confidence == CONFIDENCE_INVALID) | (low & ~carry)
+    reported = np.where(carry, prev_beats, beats)
+    return np.column_stack((hr_data[:,3], reported, beats, confidence, drop.astype(np.int64)))
+
+class HrStage(object):
+    """ hr_rows() chunk by chunk, e.g. on a live feed """
+    def __init__(self):
+        self.prev = None
+
+    def __call__(self, x):
+        rows = hr_rows(x, self.prev)
+        if len(x):
+            self.prev = x[-1]
+        return rows
@@ -0,0 +1,148 @@
+import io
+import json
+import numpy as np
+import os
+
+from cache import cache_path, source_key
+from parser import iter_text_blocks, tokenize_block, parse_raw_file, samples_per_row, calc_ts
+from parser import RAW_TYPES, TYPE_ACC, TYPE_HR, COL_TYPE, COL_TS, MSEC_PER_SEC, BLOCK_SIZE
+
+# For every type, the index keeps one entry per second: the timestamp, the
+# byte offset of the first row of that second in the raw data file and the
+# number of samples before that row. Reading a time range or a range of
+# samples then only seeks to and parses the rows between two entries.
+INDEX_VERSION = 1
+
+def index_path(raw_data_file, cache_dir=None):
+    return os.path.splitext(cache_path(raw_data_file, cache_dir))[0] + '.idx.npz'
+
+def build_index(raw_data_file, block_size=BLOCK_SIZE):
+    """ Return {type: (timestamp, byte offset, sample offset) arrays} """
+    parts = dict((t, []) for t in RAW_TYPES)
+    samples = dict((t, 0) for t in RAW_TYPES)
+    last_ts = dict((t, None) for t in RAW_TYPES)
+    with open(raw_data_file, 'rb') as f:
+        for offset, text in iter_text_blocks(f, block_size):
+            m, lines = tokenize_block(text, with_lines=True)
+            # byte offset of every line
+            starts = np.hstack((0, np.flatnonzero(np.frombuffer(text, np.uint8) == ord('\n'))[:-1] + 1))
+            starts = offset + starts[lines]
+            for t in RAW_TYPES:
+                rows = np.flatnonzero(m[:,COL_TYPE] == t)
+                if not rows.size:
+                    continue
+                ts = m[rows,COL_TS]
+                first = np.hstack((ts[0] != last_ts[t], np.diff(ts) != 0))
+                n = samples[t] + np.arange(rows.size) * samples_per_row(t)
+                parts[t].append(np.column_stack((ts[first], starts[rows[first]], n[first])))
+                samples[t] += rows.size * samples_per_row(t)
+                last_ts[t] = ts[-1]
+    index = {}
+    for t, p in parts.items():
+        if p:
+            p = np.concatenate(p)
+            index[t] = (p[:,0], p[:,1], p[:,2])
+    return index
+
+def save_index(path, key, index):
+    d = os.path.dirname(path)
+    if d and not os.path.exists(d):
+        os.makedirs(d)
+    arrays = {'header': np.array(json.dumps({'version': INDEX_VERSION, 'key': key}))}
+    for t, (ts, offsets, samples) in index.items():
+        arrays['%d_ts' % t] = ts
+        arrays['%d_offset' % t] = offsets
+        arrays['%d_sample' % t] = samples
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez(f, **arrays)
+    os.rename(tmp, path)
+
+def open_index(path, key=None):
+    """ Return the saved index, or None if it's missing or stale """
+    try:
+        z = np.load(path)
+        header = json.loads(str(z['header']))
+    except (IOError, ValueError, KeyError):
+        return None
+    if header.get('version') != INDEX_VERSION or (key is not None and header.get('key') != key):
+        return None
+    return dict((t, (z['%d_ts' % t], z['%d_offset' % t], z['%d_sample' % t]))
+                for t in RAW_TYPES if '%d_ts' % t in z.files)
+
+def load_index(raw_data_file, cache_dir=None, use_cache=True):
+    """ Open the sidecar index of the raw data file, build it if needed
+    use_cache: False to build it in memory, without reading or writing the sidecar
+    """
+    if not use_cache:
+        return build_index(raw_data_file)
+    path = index_path(raw_data_file, cache_dir)
+    key = source_key(raw_data_file)
+    index = open_index(path, key)
+    if index is None:
+        index = build_index(raw_data_file)
+        try:
+            save_index(path, key, index)
+        except (IOError, OSError):
+            pass
+    return index
+
+def _empty(t):
+    return np.empty((0, {TYPE_ACC: 5, TYPE_HR: 4}.get(t, 3)))
+
+def _read_rows(raw_data_file, t, start, end):
+    """ Parse rows of type t between byte offsets start and end (None for EOF) """
+    with open(raw_data_file, 'rb') as f:
+        f.seek(start)
+        text = f.read() if end is None else f.read(end - start)
+    data = parse_raw_file(io.BytesIO(text), [t]).get(t)
+    return _empty(t) if data is None else data
+
+def _span(index, t, keys, lo, hi, extra=0):
+    """ Return the first entry covering [lo, hi) of keys, and the byte offsets
+    to read, including `extra` seconds before lo and after hi
+    """
+    _, offsets, _ = index[t]
+    i0 = max(np.searchsorted(keys, lo, 'right') - 1 - extra, 0)
+    i1 = np.searchsorted(keys, hi, 'left') + extra
+    end = offsets[i1] if i1 < len(offsets) else None
+    return i0, offsets[i0], end
+
+def read_time_range(raw_data_file, t, start_ms, end_ms, index=None, interpolate=False):
+    """
+    Parse only the rows of type t with timestamps in [start_ms, end_ms)
+    interpolate: interpolate timestamps as calc_ts() does on the whole file,
+                 and select samples by the interpolated timestamps
+    return:      the same layout as parse_raw_file()
+    """
+    index = index or load_index(raw_data_file)
+    if t not in index:
+        return _empty(t)
+    interpolate = interpolate and t != TYPE_HR
+    lo = np.floor(start_ms / float(MSEC_PER_SEC))
+    hi = np.ceil(end_ms / float(MSEC_PER_SEC))
+    # one more second after tells where the last second ends, one before
+    # gives the step of the final second of the file, as calc_ts() takes it
+    _, start, end = _span(index, t, index[t][0], lo, hi, 1 if interpolate else 0)
+    data = _read_rows(raw_data_file, t, start, end)
+    if interpolate:
+        data = calc_ts(data)
+    ms = data[:,3] * MSEC_PER_SEC if t == TYPE_HR else data[:,0]
+    return data[(ms >= start_ms) & (ms < end_ms)]
+
+def read_samples(raw_data_file, t, start, stop, index=None, interpolate=False):
+    """ Parse only the rows holding samples [start, stop) of type t
+    interpolate: interpolate timestamps as calc_ts() does on the whole file
+    """
+    index = index or load_index(raw_data_file)
+    if t not in index:
+        return _empty(t)
+    interpolate = interpolate and t != TYPE_HR
+    samples = index[t][2]
+    # the seconds either side, see read_time_range()
+    i0, begin, end = _span(index, t, samples, start, stop, 1 if interpolate else 0)
+    data = _read_rows(raw_data_file, t, begin, end)
+    if interpolate:
+        data = calc_ts(data)
+    first = samples[i0]
+    return data[max(start - first, 0):max(stop - first, 0)]
@@ -0,0 +1,31 @@
+import importlib
+
+# scipy.signal and matplotlib.pyplot take ~200 ms each to import, more than
+# an export of a small file takes. Modules using them import them with
+# lazy_import(), so a run pays for them only once it filters or plots.
+
+class LazyModule(object):
+    """ Stands for a module, which is imported when an attribute of it is
+    first used
+    """
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        if self._module is None:
+            self.__dict__['_module'] = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __repr__(self):
+        return '<lazy module %r%s>' % (self._name, '' if self._module is None else ' (loaded)')
+
+def lazy_import(name):
+    """ e.g. signal = lazy_import('scipy.signal') """
+    return LazyModule(name)
@@ -0,0 +1,108 @@
+import os
+import sqlite3
+import threading
+import time
+
+# A file goes pending => fetched => rendered => done, or failed on the way.
+# Every step is committed at once, so after a crash the monitor resumes the
+# files which are not done, instead of losing or redoing them all.
+PENDING  = 'pending'
+FETCHED  = 'fetched'
+RENDERED = 'rendered'
+DONE     = 'done'
+FAILED   = 'failed'
+UNFINISHED = (PENDING, FETCHED, RENDERED)
+MAX_ATTEMPTS = 3
+
+SCHEMA = '''
+create table if not exists files (
+    id           text primary key,
+    name         text,
+    revision     text,
+    content_hash text,
+    state        text,
+    png          text,
+    attempts     integer default 0,
+    error        text,
+    updated      real
+);
+create index if not exists files_hash on files (content_hash, state);
+'''
+
+class Ledger(object):
+    """ Processing state of every file seen, in a sqlite database shared by
+    the threads of the monitor
+    """
+    def __init__(self, path):
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+        self.lock = threading.Lock()
+
+    def _execute(self, sql, args=()):
+        with self.lock:
+            rows = self.db.execute(sql, args).fetchall()
+            self.db.commit()
+        return rows
+
+    def get(self, file_id):
+        rows = self._execute('select * from files where id = ?', (file_id,))
+        return rows[0] if rows else None
+
+    def add(self, files):
+        """ Record files to be processed, return those which are new or
+        changed, dropping repeated changes of the same revision
+        """
+        latest = dict((f['id'], f) for f in files)
+        new = []
+        for f in files:
+            # the last change of a file wins
+            if latest[f['id']] is not f:
+                continue
+            row = self.get(f['id'])
+            if row is None:
+                self._execute('insert into files (id, name, revision, state, updated) values (?, ?, ?, ?, ?)',
+                              (f['id'], f['name'], f['revision'], PENDING, time.time()))
+            elif row['revision'] != f['revision']:
+                # keep content_hash of a done revision, the new one may have the same content
+                self._execute('update files set name = ?, revision = ?, attempts = 0, error = null, '
+                              'content_hash = case when state = ? then content_hash end, state = ?, '
+                              'updated = ? where id = ?',
+                              (f['name'], f['revision'], DONE, PENDING, time.time(), f['id']))
+            else:
+                continue
+            new.append(f)
+        return new
+
+    def unfinished(self):
+        """ Return files left over by the last run, failed ones up to MAX_ATTEMPTS times """
+        rows = self._execute('select id, name, revision from files where state in (?, ?, ?) '
+                             'or (state = ? and attempts < ?) order by updated',
+                             UNFINISHED + (FAILED, MAX_ATTEMPTS))
+        return [dict(id=r['id'], name=r['name'], revision=r['revision']) for r in rows]
+
+    def update(self, file_id, state, **fields):
+        """ fields: content_hash, png or error """
+        names = sorted(fields)
+        sql = 'update files set state = ?, updated = ?%s where id = ?' % ''.join(', %s = ?' % n for n in names)
+        self._execute(sql, [state, time.time()] + [fields[n] for n in names] + [file_id])
+
+    def failed(self, file_id, error):
+        self._execute('update files set state = ?, error = ?, attempts = attempts + 1, updated = ? where id = ?',
+                      (FAILED, error, time.time(), file_id))
+
+    def done_png(self, file_id, content_hash, png):
+        """ True if a png of the same name is done and still there for this
+        content, by an earlier revision of the file or by another file
+        """
+        if not os.path.exists(png):
+            return False
+        row = self.get(file_id)
+        if row and row['state'] == DONE and row['content_hash'] == content_hash and row['png'] == png:
+            return True
+        rows = self._execute('select 1 from files where content_hash = ? and state = ? and png = ? limit 1',
+                             (content_hash, DONE, png))
+        return bool(rows)
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,66 @@
+import numpy as np
+
+# Level of detail for long traces: level k of the pyramid keeps the min and
+# the max of every bucket of LOD_FACTOR**k samples, so a view of any width
+# is drawn from about two points per pixel. The envelope looks the same as
+# plotting every sample.
+LOD_FACTOR = 4
+# plotted as they are below this
+LOD_MIN_POINTS = 1 << 15
+DEFAULT_PIXELS = 2000
+
+class MinMaxPyramid(object):
+    """ Per-bucket min and max of y at bucket sizes of factor**level
+    x must be sorted, e.g. timestamps or sequence numbers
+    """
+    def __init__(self, x, y, factor=LOD_FACTOR, min_buckets=1024):
+        self.x = [np.asarray(x)]
+        self.lo = [np.asarray(y)]
+        self.hi = [self.lo[0]]
+        while len(self.x[-1]) > min_buckets:
+            idx = np.arange(0, len(self.x[-1]), factor)
+            self.x.append(self.x[-1][idx])
+            self.lo.append(np.minimum.reduceat(self.lo[-1], idx))
+            self.hi.append(np.maximum.reduceat(self.hi[-1], idx))
+
+    def envelope(self, xmin, xmax, points):
+        """ Return x and y of [xmin, xmax] at the finest level which needs
+        no more than the given number of points
+        """
+        for level in xrange(len(self.x)):
+            x = self.x[level]
+            i0 = max(np.searchsorted(x, xmin, 'right') - 1, 0)
+            i1 = min(np.searchsorted(x, xmax, 'left') + 1, len(x))
+            # a bucket is drawn as two points, min and max
+            n = (i1 - i0) * (1 if level == 0 else 2)
+            if n <= points:
+                break
+        if level == 0:
+            return x[i0:i1], self.lo[0][i0:i1]
+        return np.repeat(x[i0:i1], 2), np.column_stack((self.lo[level][i0:i1], self.hi[level][i0:i1])).ravel()
+
+class LodLine(object):
+    """ A line showing the envelope of the visible part of x, y, redrawn
+    on zoom and pan of the axis and of the axes sharing its x axis
+    """
+    def __init__(self, ax, x, y, fmt='b'):
+        self.ax = ax
+        self.pyramid = MinMaxPyramid(x, y)
+        self.line, = ax.plot(*self.pyramid.envelope(x[0], x[-1], self.points()) + (fmt,))
+        for other in ax.get_shared_x_axes().get_siblings(ax):
+            # shared axes get the new limits without a callback of their own
+            other.callbacks.connect('xlim_changed', lambda a: self.update(a))
+
+    def points(self):
+        return 2 * (int(self.ax.get_window_extent().width) or DEFAULT_PIXELS)
+
+    def update(self, ax):
+        xmin, xmax = ax.get_xlim()
+        # zoom and pan redraw the canvas afterwards
+        self.line.set_data(*self.pyramid.envelope(xmin, xmax, self.points()))
+
+def plot_lod(ax, x, y, fmt='b'):
+    """ ax.plot(x, y, fmt), decimated to the envelope of the view if x is long """
+    if len(x) <= LOD_MIN_POINTS:
+        return ax.plot(x, y, fmt)[0]
+    return LodLine(ax, x, y, fmt).line
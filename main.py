@@ -2,32 +2,79 @@
 # -*- coding: utf-8 -*-
 
 import argparse
-import matplotlib.pyplot as plot
+import multiprocessing
 import numpy as np
 import os
 import rx
+import time
+
+import profiling
 
 from annotation import parse_annotation, annotation_data
-from filters import acc_bp_filter, ppg125_bp_filter, ppg512_bp_filter, ecg_bp_filter, ecg_pl_filter
+from cache import load_raw_file
+from filters import acc_bp_filter, ppg125_bp_filter, ppg512_bp_filter, ecg_filter
+from filters import acc_bp_stream, ppg125_bp_stream, ppg512_bp_stream, ecg_stream
 from filters import ACC_FS, ECG_FS, PPG_FS_125, PPG_FS_512
-from parser import calc_ts, ppg125_reseq, ppg512_reseq, ecg_reseq, acc_reseq
-from parser import parse_raw_acc, acc_data
-from parser import parse_raw_ecg, ecg_data
-from parser import parse_raw_ppg125, ppg125_data
-from parser import parse_raw_ppg512, ppg512_data
-from parser import parse_raw_hr, hr_data
+from hr import hr_rows, HrStage, HR_CSV_HEADER
+from parser import calc_ts, ReseqState
+from parser import TYPE_ACC, TYPE_ECG, TYPE_PPG125, TYPE_PPG512, TYPE_HR
 from plots import plot_time_domain, plot_freq_domain, plot_annotation
 from rx import Observable
+from export import open_writer, export, output_names, COLUMN_NAMES, EXPORT_FORMATS
+from lazy import lazy_import
+from resample import align
+from spectral import welch, WelchStage
+from stream import TimestampStage, Pipeline, run_stream, STREAM_BLOCK_SIZE
+
+# only imported if --plot_type is given
+plot = lazy_import('matplotlib.pyplot')
+
+# type: channels of the aligned output, and their columns
+ALIGNED_CHANNELS = [
+        (TYPE_ACC,    ["acc_x", "acc_y", "acc_z"], [2, 3, 4]),
+        (TYPE_ECG,    ["ecg"],    [2]),
+        (TYPE_PPG125, ["ppg125"], [2]),
+        (TYPE_PPG512, ["ppg512"], [2]),
+        ]
+
+# set up by __main__ or process_file()
+args = {}
+ax1 = ax2 = None
 
 def parse_args():
     p = argparse.ArgumentParser()
-    p.add_argument('--export_csv', help='Export to csv file', action='store_true')
+    p.add_argument('--export', '--export_csv', dest='export', help='Export to files of --format', action='store_true')
+    p.add_argument('--format', default='csv', choices=sorted(EXPORT_FORMATS.keys()), \
+                   help='Export format: csv (np.savetxt), fastcsv (fixed precision), npy, npz or col (columnar row groups)')
+    p.add_argument('--precision', default=6, type=int, help='Digits after the decimal point for fastcsv')
     p.add_argument('--fft', help='Apply FFT bandpass filter', action='store_true')
     p.add_argument('--plot_type', default=None, type=int, choices=[0, 5, 9, 12], \
                    help='0: Acc, 5: ECG, 9: PPG 125 Hz, 12: PPG 512 Hz)')
+    p.add_argument('--stream', help='Process chunk by chunk in constant memory and export to files of --format', action='store_true')
+    p.add_argument('--causal', help='Use causal filters in stream mode instead of block zero-phase ones', action='store_true')
+    p.add_argument('--chunk_size', default=STREAM_BLOCK_SIZE, type=int, help='Bytes of raw data per chunk in stream mode')
+    p.add_argument('--jobs', default=1, type=int, help='Process signal types in N processes')
+    p.add_argument('--no_cache', help='Do not use or write the parsed data cache', action='store_true')
+    p.add_argument('--resample', default=None, type=float, metavar='RATE', \
+                   help='Also export all signals resampled onto a common clock of RATE Hz')
+    p.add_argument('--psd', help='Also export the Welch power spectral density of each signal', action='store_true')
+    p.add_argument('--profile', metavar='REPORT', \
+                   help='Write the rows, samples, bytes, seconds and memory of each stage to REPORT (json)')
+    p.add_argument('--cprofile', help='Also write cProfile stats of each stage next to REPORT', action='store_true')
     p.add_argument('raw_data_file', help='Specify the raw data file')
     p.add_argument('annotation_file', nargs='?', help='Specify the annotation file')
-    return vars(p.parse_args())
+    args = p.parse_args()
+    if args.stream and args.plot_type != None:
+        p.error('--plot_type is not supported in stream mode')
+    if args.stream and args.jobs > 1:
+        p.error('--jobs is not supported in stream mode')
+    if args.stream and args.format == 'npz':
+        p.error('--format npz is not supported in stream mode')
+    if args.stream and args.resample:
+        p.error('--resample is not supported in stream mode')
+    if args.cprofile and not args.profile:
+        p.error('--cprofile requires --profile')
+    return vars(args)
 
 def default_plot_fn(ax1, ax2, x, freq):
     plot_time_domain(ax1, x[:,1:])
@@ -41,78 +88,187 @@ def acc_plot_fn(ax1, ax2, x, freq):
     plot_time_domain(ax1, mag)
     plot_freq_domain(ax2, mag[:,1], freq)
 
+def print_gaps(name, state):
+    gaps = state.summary()
+    if gaps.count:
+        print '%s: %d sequence gaps, %d missing samples' % (name, gaps.count, gaps.missing)
+
+def psd_name(arg_fname):
+    """ "acc_out" => "acc_psd_out" """
+    return arg_fname[:-len("_out")] + "_psd_out"
+
+def psd_columns(data_type):
+    return range(2, len(COLUMN_NAMES[data_type]))
+
+def psd_writer(data_type, arg_fname):
+    """ Return a callable exporting the (frequency, psd) array of data_type """
+    names = ["freq"] + COLUMN_NAMES[data_type][2:]
+    return lambda x: export(args[psd_name(arg_fname)], x, args["format"], names, precision=args["precision"])
+
+def stage_name(arg_fname, stage):
+    """ "ecg_out", "reseq" => "ecg:reseq" """
+    return arg_fname[:-len("_out")] + ":" + stage
+
 def data_handler(arg_fname, data_type, freq, fn_filters, data, fn_reseq, plot_fn=default_plot_fn):
+    """ Return (plot_fn, data, freq) if data_type is to be plotted, and the
+    processed data if it is to be resampled
+    """
+    result = [None, None]
+    stage = lambda name, fn: profiling.wrap(stage_name(arg_fname, name), fn)
     def output(x):
-        if args["export_csv"]:
-            np.savetxt(args[arg_fname], x, delimiter=',')
+        if args["export"]:
+            stage("export", export)(args[arg_fname], x, args["format"], COLUMN_NAMES[data_type],
+                                    precision=args["precision"])
 
         if args["plot_type"] != None and args["plot_type"] == data_type:
-            plot_fn(ax1, ax2, x, freq)
+            # plotting can only be done in the main process
+            result[0] = (stage("plot", plot_fn), x, freq)
+
+        if args.get("resample"):
+            result[1] = x
+
+        if args.get("psd"):
+            psd = stage("welch", lambda x: [welch(x[:,c], freq) for c in psd_columns(data_type)])(x)
+            stage("psd_export", psd_writer(data_type, arg_fname))(np.column_stack([psd[0][0]] + [p for _, p in psd]))
 
     x = Observable.just(data) \
-                  .map(calc_ts) \
-                  .map(fn_reseq) \
+                  .map(stage("calc_ts", calc_ts)) \
+                  .map(stage("reseq", fn_reseq)) \
                   .map(lambda x: np.array(x))
 
     if args["fft"]:
         for f in fn_filters:
-            x = x.map(f)
+            x = x.map(stage(f.__name__, f))
 
     x.subscribe(output)
+    print_gaps(args[arg_fname], fn_reseq)
+    return tuple(result)
 
-def acc_data_handler():
-    data_handler("acc_csv", 0, ACC_FS, [acc_bp_filter], acc_data, acc_reseq, acc_plot_fn)
+def acc_data_handler(acc_data):
+    return data_handler("acc_out", 0, ACC_FS, [acc_bp_filter], acc_data, ReseqState(3), acc_plot_fn)
 
-def ecg_data_handler():
-    data_handler("ecg_csv", 5, ECG_FS, [ecg_pl_filter, ecg_bp_filter], ecg_data, ecg_reseq)
+def ecg_data_handler(ecg_data):
+    return data_handler("ecg_out", 5, ECG_FS, [ecg_filter], ecg_data, ReseqState(12))
 
-def ppg125_data_handler():
-    data_handler("ppg125_csv", 9, PPG_FS_125, [ppg125_bp_filter], ppg125_data, ppg125_reseq)
+def ppg125_data_handler(ppg125_data):
+    return data_handler("ppg125_out", 9, PPG_FS_125, [ppg125_bp_filter], ppg125_data, ReseqState(6))
 
-def ppg512_data_handler():
-    data_handler("ppg512_csv", 12, PPG_FS_512, [ppg512_bp_filter], ppg512_data, ppg512_reseq)
+def ppg512_data_handler(ppg512_data):
+    return data_handler("ppg512_out", 12, PPG_FS_512, [ppg512_bp_filter], ppg512_data, ReseqState(12))
 
-def hr_data_handler():
-    if not args["export_csv"]:
+def hr_data_handler(hr_data):
+    if not args["export"]:
         return
 
-    with open(args['hr_csv'], 'w') as out:
-        out.write("#timestamp,reported_hr,original_hr,confidence,is_drop\n")
-        #print hr.shape
-        for i in xrange(len(hr_data)):
-            beats, confidence, local_ts, ts = hr_data[i][:]
-            drop = 0
-            if confidence == 255:
-                #'drop bcz confidence == -1'
-                drop = 1
-            elif confidence in [0, 1]:
-                if i > 0:
-                    if hr_data[i-1][1] == 3:
-                        beats = hr_data[i-1][0]
-                    else:
-                        #'drop, bcz prev confidence in [0, 1, 2, 255]'
-                        drop = 1
-                else:
-                    drop = 1
-            out.write("%d,%d,%d,%d,%d\n" % (ts, beats, hr_data[i][0], confidence, drop))
-
-
-def group_key_generator(x):
-    return x.split(',')[0]
-
-_group_by_handlers = {
-        '0':  {"on_next": parse_raw_acc,    "on_completed": acc_data_handler},
-        '5':  {"on_next": parse_raw_ecg,    "on_completed": ecg_data_handler},
-        '9':  {"on_next": parse_raw_ppg125, "on_completed": ppg125_data_handler},
-        '12': {"on_next": parse_raw_ppg512, "on_completed": ppg512_data_handler},
-        '22': {"on_next": parse_raw_hr,     "on_completed": hr_data_handler}
-        }
-
-def group_by_handler(x):
-    # silently drop unknow lines
-    if x.key not in _group_by_handlers.keys():
+    x = profiling.wrap("hr:hr_rows", hr_rows)(hr_data)
+    profiling.wrap("hr:export", export)(args["hr_out"], x, args["format"], COLUMN_NAMES[TYPE_HR], True, HR_CSV_HEADER)
+
+_type_handlers = [
+        (TYPE_ACC,    acc_data_handler),
+        (TYPE_ECG,    ecg_data_handler),
+        (TYPE_PPG125, ppg125_data_handler),
+        (TYPE_PPG512, ppg512_data_handler),
+        (TYPE_HR,     hr_data_handler),
+        ]
+
+# parsed raw data, inherited by the worker processes
+_raw = {}
+
+def type_handler(t):
+    """ Return the result of the handler of t, and its profiling counters """
+    return dict(_type_handlers)[t](_raw[t]), profiling.snapshot()
+
+def raw_data_handler(raw, jobs=1):
+    global _raw
+    _raw = raw
+    # types absent from the file are skipped, as unknown lines are
+    types = [t for t, _ in _type_handlers if t in raw]
+    if jobs > 1 and len(types) > 1:
+        # workers start without the counters of the parent
+        pool = multiprocessing.Pool(min(jobs, len(types)), profiling.snapshot)
+        results = pool.map(type_handler, types)
+        pool.close()
+        pool.join()
+    else:
+        results = map(type_handler, types)
+
+    processed = {}
+    for t, (r, collected) in zip(types, results):
+        profiling.merge(collected)
+        if not r:
+            continue
+        if r[0]:
+            plot_fn, x, freq = r[0]
+            plot_fn(ax1, ax2, x, freq)
+        if r[1] is not None:
+            processed[t] = r[1]
+
+    if args.get("resample"):
+        aligned_handler(processed, args["resample"])
+
+def aligned_handler(processed, rate):
+    """ Export every signal on a common clock, NaN inside sequence gaps """
+    channels = [c for c in ALIGNED_CHANNELS if len(processed.get(c[0], []))]
+    if not channels:
         return
-    x.subscribe(**_group_by_handlers[x.key])
+    x = profiling.wrap("aligned:align", align)([(processed[t], columns) for t, _, columns in channels], rate)
+    names = ["timestamp"] + sum([names for _, names, _ in channels], [])
+    profiling.wrap("aligned:export", export)(args["aligned_out"], x, args["format"], names, header=None,
+                                             precision=args["precision"])
+
+_stream_handlers = [
+        (TYPE_ACC,    "acc_out",    ACC_FS,     3,  [acc_bp_stream]),
+        (TYPE_ECG,    "ecg_out",    ECG_FS,     12, [ecg_stream]),
+        (TYPE_PPG125, "ppg125_out", PPG_FS_125, 6,  [ppg125_bp_stream]),
+        (TYPE_PPG512, "ppg512_out", PPG_FS_512, 12, [ppg512_bp_stream]),
+        ]
+
+def writer(t, arg_fname, integer=False, header=None):
+    return open_writer(args[arg_fname], args["format"], COLUMN_NAMES[t], integer, header, args["precision"],
+                       args.get("append", False))
+
+def stream_pipelines():
+    """ Return {type: Pipeline} of stream mode, and {arg_fname: ReseqState} """
+    pipelines = {}
+    reseqs = {}
+    for t, arg_fname, fs, step, fn_filters in _stream_handlers:
+        reseqs[arg_fname] = ReseqState(step)
+        stages = [("calc_ts", TimestampStage()), ("reseq", reseqs[arg_fname])]
+        if args["fft"]:
+            stages += [(fn.__name__, fn(zero_phase=not args["causal"])) for fn in fn_filters]
+        if args.get("psd"):
+            stages.append(("welch", WelchStage(fs, psd_columns(t), psd_writer(t, arg_fname))))
+        pipelines[t] = stream_pipeline(arg_fname, stages, writer(t, arg_fname))
+    pipelines[TYPE_HR] = stream_pipeline("hr_out", [("hr_rows", HrStage())],
+                                         writer(TYPE_HR, "hr_out", True, HR_CSV_HEADER))
+    return pipelines, reseqs
+
+def stream_pipeline(arg_fname, stages, sink):
+    """ stages: list of (name, stage), counted by profiling if it is enabled """
+    if profiling.enabled():
+        stages = [(n, profiling.Stage(stage_name(arg_fname, n), s)) for n, s in stages]
+        sink = profiling.Stage(stage_name(arg_fname, "export"), sink)
+    return Pipeline([s for _, s in stages], sink)
+
+def stream_handler(f):
+    pipelines, reseqs = stream_pipelines()
+    run_stream(f, pipelines, args["chunk_size"])
+    for arg_fname, state in sorted(reseqs.items()):
+        print_gaps(args[arg_fname], state)
+
+def process_file(raw_data_file, options, output_dir=None):
+    """ Export a raw data file as main.py does, without plotting
+    options: export, format, precision, fft, stream, causal, chunk_size,
+             jobs and no_cache as parse_args() returns
+    """
+    global args
+    args = dict(options, raw_data_file=raw_data_file, plot_type=None, annotation_file=None)
+    args.update(output_names(raw_data_file, output_dir, args["format"]))
+    if args["stream"]:
+        with open(raw_data_file) as f:
+            stream_handler(f)
+    else:
+        raw_data_handler(load_raw_file(raw_data_file, use_cache=not args["no_cache"]), args["jobs"])
 
 def annotation_handler():
     if args["plot_type"] != None:
@@ -122,20 +278,21 @@ if __name__ == "__main__":
     # parse arguments
     args = parse_args()
     print args
+    start = time.time()
+    if args["profile"]:
+        profiling.enable(args["cprofile"])
 
-    ax1 = ax2 = None
     if args["plot_type"] != None: _, (ax1, ax2) = plot.subplots(2, 1)
 
     # prepare something for later use
-    basename = os.path.splitext(os.path.basename(args["raw_data_file"]))[0]
-    for n in ["acc", "ecg", "ppg125", "ppg512", "hr"]:
-        args[n+"_csv"] = basename + "_" + n + ".csv"
+    args.update(output_names(args["raw_data_file"], fmt=args["format"]))
 
     # Ideally, observables can be executed in different threads.
     # However, it's difficult becuase matplotlib can only be executed in
     # the main thread and pyplot.show() only can be executed once.
     # So, we only take advantage of reactivex to build the data pipeline by
-    # observable::map().
+    # observable::map(), and run the pipelines of each signal type in
+    # worker processes with --jobs, leaving plotting to the main process.
 
     if args["annotation_file"]:
         Observable.from_(open(args["annotation_file"])) \
@@ -143,10 +300,19 @@ if __name__ == "__main__":
                   .filter(lambda x: True if x else False) \
                   .subscribe(on_next=parse_annotation, on_completed=annotation_handler)
 
-    Observable.from_(open(args["raw_data_file"])) \
-              .map(lambda x: x.strip()) \
-              .group_by(group_key_generator) \
-              .subscribe(group_by_handler)
+    if args["stream"]:
+        # timestamp, reseq, filter and write each chunk as it arrives
+        with open(args["raw_data_file"]) as f:
+            profiling.wrap("stream", stream_handler, cprofile=False)(f)
+    else:
+        # parse all record types in a single pass, or open the cached
+        # arrays, then run each pipeline on its own array
+        raw = profiling.wrap("load", load_raw_file)(args["raw_data_file"], use_cache=not args["no_cache"])
+        raw_data_handler(raw, args["jobs"])
+
+    if args["profile"]:
+        profiling.write_report(args["profile"], raw_data_file=args["raw_data_file"],
+                               bytes=os.path.getsize(args["raw_data_file"]), seconds=time.time() - start)
 
     if args["plot_type"] != None: plot.show()
 
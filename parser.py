@@ -1,16 +1,20 @@
 import numpy as np
-import re
 
+from collections import namedtuple
+
+TYPE_ACC     = 0
 TYPE_ECG     = 5
 TYPE_PPG125  = 9
 TYPE_PPG512  = 12
+TYPE_HR      = 22
 MSEC_PER_SEC = 1000
 
-acc_data    = []
-ecg_data    = []
-hr_data     = []
-ppg125_data = []
-ppg512_data = []
+# layout of a raw row: type, seq, 12 payload columns, local ts, unix ts
+NUM_COLUMNS = 16
+COL_TYPE    = 0
+COL_SEQ     = 1
+COL_TS      = 15
+BLOCK_SIZE  = 1 << 24
 
 def convert_ppg_to_mv(v):
     if v >= (1<<22):
@@ -27,6 +31,16 @@ def convert_ecg_to_mv(v):
         v = v - (1<<23)
     return v * EKG_ADC_LSB * 1000.0 / EKG_GAIN
 
+def convert_ppg_to_mv_array(raw):
+    """ Array version of convert_ppg_to_mv """
+    raw = np.where(raw >= (1<<22), raw - (1<<23), raw)
+    return (raw * 3.2 * 1000) / 65536
+
+def convert_ecg_to_mv_array(raw):
+    """ Array version of convert_ecg_to_mv """
+    raw = np.where(raw >= (1<<22), raw - (1<<23), raw)
+    return raw * EKG_ADC_LSB * 1000.0 / EKG_GAIN
+
 def is_ecg(t):
     return t == TYPE_ECG
 
@@ -39,61 +53,162 @@ def is_ppg125(t):
 def is_ppg512(t):
     return t == TYPE_PPG512
 
-def parse_raw_acc(x):
-    """ Parse one line of raw acc data and add it to acc data """
-    items = x.split(',')
-    nums = map(int, items)
-    ts_ms = nums[15] * MSEC_PER_SEC
-    seq = nums[1]
-    for i in [2, 6, 10]:
-        acc_data.append([ts_ms, seq] + nums[i:i+3])
-
-def parse_raw_hr_signals(x, index, fn, data):
-    """ Parse one line of raw ppg/ecg data and add it to ppg/ecg data """
-    items = x.split(',')
-    # convert ts to ms
-    ts_ms = int(items[15]) * MSEC_PER_SEC
-    seq = int(items[1])
-    # convert signals to mv
-    for n in index:
-        data.append([ts_ms, seq, fn(int(items[n]))])
-
-def parse_raw_ppg125(x):
-    parse_raw_hr_signals(x, range(2, 13, 2), convert_ppg_to_mv, ppg125_data)
-
-def parse_raw_ppg512(x):
-    parse_raw_hr_signals(x, range(2, 14), convert_ppg_to_mv, ppg512_data)
-
-def parse_raw_ecg(x):
-    """ Parse one line of raw ecg data and add it to ecg data """
-    parse_raw_hr_signals(x, range(2, 14), convert_ecg_to_mv, ecg_data)
-
-def parse_raw_hr(x):
-    """ Parse one line of synthesis heartrate data"""
-    items = x.split(',')
-    nums = map(int, items)
-    hr_data.append([nums[2], nums[3] & 0xff, nums[4], nums[15]])
+# type: [payload columns, values per sample, convert function (if any)]
+_raw_layouts = {
+        TYPE_ACC:    [[2, 3, 4, 6, 7, 8, 10, 11, 12], 3, None],
+        TYPE_ECG:    [range(2, 14), 1, convert_ecg_to_mv_array],
+        TYPE_PPG125: [range(2, 13, 2), 1, convert_ppg_to_mv_array],
+        TYPE_PPG512: [range(2, 14), 1, convert_ppg_to_mv_array],
+        }
+
+RAW_TYPES = sorted(_raw_layouts.keys()) + [TYPE_HR]
+
+def samples_per_row(t):
+    if t == TYPE_HR:
+        return 1
+    columns, per_sample, _ = _raw_layouts[t]
+    return len(columns) / per_sample
+
+def is_raw_row(line):
+    """ Whether a line has NUM_COLUMNS integer fields """
+    fields = line.split(',')
+    return len(fields) == NUM_COLUMNS and all(f.strip().lstrip('+-').isdigit() for f in fields)
+
+def _complete_lines(text):
+    """ Whether every line has NUM_COLUMNS fields, so a short line and a long
+    one can not make up the right number of tokens between them
+    """
+    b = np.frombuffer(text, dtype=np.uint8)
+    # the commas and newlines in order, every NUM_COLUMNS-th one a newline
+    sep = b[(b == ord(',')) | (b == ord('\n'))]
+    return len(sep) == text.count('\n') * NUM_COLUMNS and bool(np.all(sep[NUM_COLUMNS-1::NUM_COLUMNS] == ord('\n')))
+
+def tokenize_block(text, with_lines=False):
+    """ Tokenize complete lines of raw data into an int matrix, one row per line
+    with_lines: also return the index of the line of every row
+    """
+    text = text.replace('\r', '')
+    num_lines = text.count('\n')
+    tokens = np.fromstring(text.replace('\n', ','), dtype=np.int64, sep=',')
+    if tokens.size == num_lines * NUM_COLUMNS and _complete_lines(text):
+        lines = np.arange(num_lines)
+    else:
+        # slow path: silently drop lines which are not a complete row
+        all_lines = text.split('\n')[:num_lines]
+        lines = [i for i, l in enumerate(all_lines) if is_raw_row(l)]
+        text = ','.join(all_lines[i] for i in lines)
+        tokens = np.fromstring(text, dtype=np.int64, sep=',')
+        if tokens.size != len(lines) * NUM_COLUMNS:
+            raise ValueError('malformed raw data')
+        lines = np.array(lines, dtype=int)
+    m = tokens.reshape(-1, NUM_COLUMNS)
+    return (m, lines) if with_lines else m
+
+def iter_text_blocks(file_obj, block_size=BLOCK_SIZE, offset=0, partial=True):
+    """ Read the raw file in large blocks of complete lines
+    offset:  byte offset of the current position of file_obj
+    partial: also yield the last line without a newline, which a file still
+             being written may only have a part of
+    yield:   (byte offset, text) of each block
+    """
+    rest = ''
+    while True:
+        buf = file_obj.read(block_size)
+        if not buf:
+            break
+        buf = rest + buf
+        end = buf.rfind('\n') + 1
+        rest = buf[end:]
+        if end:
+            yield offset, buf[:end]
+            offset += end
+    if partial and rest.strip():
+        yield offset, rest + '\n'
+
+def iter_raw_blocks(file_obj, block_size=BLOCK_SIZE):
+    """ Read the raw file in large blocks and yield them as int matrices """
+    for _, text in iter_text_blocks(file_obj, block_size):
+        yield tokenize_block(text)
+
+def split_rows(rows, t):
+    """
+    rows: int matrix of raw rows of type t
+    return: timestamp, sequence, value(s) per sample for acc/ecg/ppg and
+            beats, confidence, local timestamp, timestamp for hr
+    """
+    if t == TYPE_HR:
+        return np.column_stack((rows[:,2], rows[:,3] & 0xff, rows[:,4], rows[:,COL_TS]))
+
+    columns, per_sample, fn = _raw_layouts[t]
+    num = samples_per_row(t)
+    values = rows[:,columns].reshape(-1, per_sample)
+    if fn:
+        values = fn(values)
+    ts_ms = np.repeat(rows[:,COL_TS] * MSEC_PER_SEC, num)
+    seq = np.repeat(rows[:,COL_SEQ], num)
+    return np.column_stack((ts_ms, seq, values)).astype(float)
+
+def split_block(block, types=None):
+    """ Dispatch a block of raw rows by type, return {type: data} """
+    out = {}
+    for t in types or RAW_TYPES:
+        rows = block[block[:,COL_TYPE] == t]
+        if len(rows):
+            out[t] = split_rows(rows, t)
+    return out
+
+def parse_raw_file(file_obj, types=None, block_size=BLOCK_SIZE):
+    """
+    Parse every record of the raw file in a single pass.
+    file_obj: The file obj come from open() or io.BytesIO
+    types:    Only extract the given types, all known types by default
+    return:   {type: numpy array}, only types present in the file
+    """
+    parts = {}
+    for block in iter_raw_blocks(file_obj, block_size):
+        for t, data in split_block(block, types).items():
+            parts.setdefault(t, []).append(data)
+    return dict((t, np.concatenate(v)) for t, v in parts.items())
+
+def interpolate_ts(ts, ratio=1, tail_step=None):
+    """
+    Spread samples evenly between consecutive whole-second timestamps.
+    ts:        per-row timestamps in ms, each row carries `ratio` samples
+    tail_step: ms between samples of the final run, which has no next
+               timestamp to spread to. Defaults to the step of the run
+               before it, or a whole second if there is only one run.
+    return:    interpolated timestamp of every sample
+    """
+    ts = np.repeat(np.asarray(ts, dtype=float), ratio)
+    if not ts.size:
+        return ts
+
+    # run-length encode the timestamps
+    starts = np.flatnonzero(np.diff(ts)) + 1
+    base = ts[np.hstack((0, starts))]
+    lengths = np.diff(np.hstack((0, starts, ts.size)))
+    if np.any(np.diff(base) < 0):
+        print "Error: timestamp equal to or larger than new base timestamp"
+
+    step = np.diff(base) / lengths[:-1]
+    if tail_step is None:
+        tail_step = step[-1] if step.size else float(MSEC_PER_SEC) / lengths[-1]
+    step = np.hstack((step, tail_step))
+
+    # position of every sample within its run
+    pos = np.arange(ts.size) - np.repeat(np.hstack((0, starts)), lengths)
+    return np.repeat(base, lengths) + np.repeat(step, lengths) * pos
 
 def calc_ts(x):
-    base_ms = 0
-    data = []
-    buf = []
-    for l in x:
-        new_ms = l[0]
-        if base_ms == 0:
-            base_ms = new_ms
-        elif base_ms != new_ms:
-            fraction = float(new_ms - base_ms) / len(buf)
-            for i in range(0, len(buf)):
-                ts_ms = base_ms + (fraction * i)
-                if ts_ms >= new_ms:
-                    print "Error: timestamp equal to or larger than new base timestamp"
-                buf[i][0] = ts_ms
-                data.append(buf[i])
-            base_ms = new_ms
-            buf = []
-        buf.append(l)
-    return data
+    """ Interpolate the timestamp column of timestamp, sequence, ... rows """
+    x = np.array(x, dtype=float).reshape(len(x), -1)
+    if len(x):
+        x[:,0] = interpolate_ts(x[:,0])
+    return x
+
+# locations: rows of (index of the first sample after the gap, original
+# sequence number before it, original sequence number after it)
+GapReport = namedtuple('GapReport', ['count', 'missing', 'locations'])
 
 def reseq(x, new_seq, orig_seq, step):
     '''
@@ -101,90 +216,82 @@ def reseq(x, new_seq, orig_seq, step):
     new_seq: last new sequence number
     orig_seq; original sequence number
     step: how many data in a sequence number
+    return: x, orig_seq, new_seq and a GapReport of x
     '''
+    x = np.asarray(x, dtype=float)
+    if not len(x):
+        return x, orig_seq, new_seq, GapReport(0, 0, np.empty((0, 3)))
     if new_seq == None:
         new_seq = 0
         orig_seq = x[0][1]
-    for d in x:
-        if (d[1] - orig_seq) > 1:
-            new_seq += (d[1] - orig_seq - 1) * step
-        orig_seq = d[1]
-        d[1] = new_seq = new_seq + 1
-    return x, orig_seq, new_seq
+
+    seq = x[:,1].copy()
+    delta = np.diff(np.hstack((orig_seq, seq)))
+    gaps = np.flatnonzero(delta > 1)
+    missing = np.zeros(len(x))
+    missing[gaps] = (delta[gaps] - 1) * step
+    x[:,1] = new_seq + np.cumsum(missing) + np.arange(1, len(x) + 1)
+
+    locations = np.column_stack((gaps, seq[gaps] - delta[gaps], seq[gaps]))
+    report = GapReport(len(gaps), int(missing.sum()), locations)
+    return x, seq[-1], x[-1,1], report
+
+class ReseqState(object):
+    """ Sequence counters of one signal, carried over chunks, plus its gaps """
+    def __init__(self, step):
+        self.step = step
+        self.new_seq = None
+        self.orig_seq = None
+        self.samples = 0
+        self.gaps = []
+
+    def __call__(self, x):
+        x, self.orig_seq, self.new_seq, report = reseq(x, self.new_seq, self.orig_seq, self.step)
+        if report.count:
+            locations = report.locations.copy()
+            locations[:,0] += self.samples
+            self.gaps.append(locations)
+        self.samples += len(x)
+        return x
+
+    def summary(self):
+        """ GapReport of everything resequenced so far """
+        locations = np.vstack(self.gaps) if self.gaps else np.empty((0, 3))
+        missing = np.sum((locations[:,2] - locations[:,1] - 1) * self.step)
+        return GapReport(len(locations), int(missing), locations)
 
 def ppg125_reseq(x):
-    x, ppg125_reseq.orig_seq, ppg125_reseq.new_seq = reseq(x, getattr(ppg125_reseq, 'orig_seq', None), getattr(ppg125_reseq, 'new_seq', None), 6)
-    return x
+    return ReseqState(6)(x)
 
 def ppg512_reseq(x):
-    x, ppg512_reseq.orig_seq, ppg512_reseq.new_seq = reseq(x, getattr(ppg512_reseq, 'orig_seq', None), getattr(ppg512_reseq, 'new_seq', None), 12)
-    return x
+    return ReseqState(12)(x)
 
 def ecg_reseq(x):
-    x, ecg_reseq.orig_seq, ecg_reseq.new_seq = reseq(x, getattr(ecg_reseq, 'orig_seq', None), getattr(ecg_reseq, 'new_seq', None), 12)
-    return x
+    return ReseqState(12)(x)
 
 def acc_reseq(x):
-    x, acc_reseq.orig_seq, acc_reseq.new_seq = reseq(x, getattr(acc_reseq, 'orig_seq', None), getattr(acc_reseq, 'new_seq', None), 3)
-    return x
+    return ReseqState(3)(x)
 
 def parse_data(file_obj, signal_type):
     """
     file_obj:    The file obj come from open() or io.BytesIO
-    signal_type: 0, 5, 9, or 12
-    return:      The list of (timestamp, mv) tuple
+    signal_type: 5, 9, or 12
+    return:      numpy array of (timestamp, mv) rows
     """
-    base_ms = 0
-    fraction = 0
-    buf = []
-    data = []
-    rule = re.compile("^%d," % signal_type)
-
-    for l in file_obj:
-        if not rule.match(l):
-            continue
-
-        a = l.rstrip("\n").split(',')
-        # extraction
-        if is_ecg(signal_type) or is_ppg512(signal_type):
-            row = a[2:14]
-        elif is_ppg125(signal_type):
-            row = a[2:13:2]
-        else:
-            print 'unknown type', signal_type
-            continue
-
-        # timestamp calculation
-        new_base_ms = int(a[15]) * MSEC_PER_SEC
-        if base_ms == 0:
-	    base_ms = new_base_ms
-	elif base_ms != new_base_ms:
-            fraction = float(new_base_ms - base_ms) / len(buf)
-	    for i in range(0, len(buf)):
-                ts_ms = base_ms + (fraction * i)
-                # sanity check
-		if ts_ms >= new_base_ms:
-	            print "Error: timestamp equal to or larger than new base timestamp"
-                data.append((ts_ms, buf[i]))
-	    base_ms = new_base_ms
-	    buf[:] = []
-
-        for i in row:
-            if is_ecg(signal_type):
-                v = convert_ecg_to_mv(float(i))
-            elif is_ppg(signal_type):
-                v = convert_ppg_to_mv(float(i))
-            buf.append(v)
-
-    return data
+    if not (is_ecg(signal_type) or is_ppg(signal_type)):
+        print 'unknown type', signal_type
+        return np.empty((0, 2))
+
+    data = parse_raw_file(file_obj, [signal_type]).get(signal_type)
+    if data is None:
+        return np.empty((0, 2))
+    return calc_ts(data)[:,[0,2]]
 
 if __name__ == "__main__":
-    print '-' * 5, 'PPG 512', '-' * 5
-    x = '12,20164,8380828,8380830,8380832,8380832,8380835,8380838,8380839,8380841,8380844,8380844,8380847,8380845,12345,1519268239'
-    parse_raw_ppg512(x)
-    print '\n'.join(map(lambda x: 'ts = %s, mv = %s' % (x[0], x[1]), ppg_data))
-
-    print '-' * 5, 'PPG 125', '-' * 5
-    x = "9,99519,17324,8369012,19363,8367862,21051,8366913,22449,8366126,23603,8365479,24560,8364943,12345,1525311794"
-    parse_raw_ppg125(x)
-    print '\n'.join(map(lambda x: 'ts = %s, mv = %s' % (x[0], x[1]), ppg_data))
+    import io
+    lines = ['12,20164,8380828,8380830,8380832,8380832,8380835,8380838,8380839,8380841,8380844,8380844,8380847,8380845,12345,1519268239',
+             '9,99519,17324,8369012,19363,8367862,21051,8366913,22449,8366126,23603,8365479,24560,8364943,12345,1525311794']
+    data = parse_raw_file(io.BytesIO('\n'.join(lines) + '\n'))
+    for t, name in [(TYPE_PPG512, 'PPG 512'), (TYPE_PPG125, 'PPG 125')]:
+        print '-' * 5, name, '-' * 5
+        print '\n'.join(map(lambda x: 'ts = %s, mv = %s' % (x[0], x[2]), data[t]))
@@ -1,6 +1,12 @@
-import matplotlib.pyplot as plot
 import numpy as np
-from scipy import signal
+
+from filters import notch_sos, butter_sos
+from lazy import lazy_import
+from lod import plot_lod
+from spectral import welch, spectrogram
+
+plot = lazy_import('matplotlib.pyplot')
+signal = lazy_import('scipy.signal')
 
 PNG_W_INCH = 18
 PNG_H_INCH = 8
@@ -12,13 +18,17 @@ MV_STEP = 0.5
 MS_STEP = 200
 
 def plot_freq_domain(ax, data, fs, color='b'):
-    win = len(data)
-    half = win / 2
-    amp = np.abs(np.fft.fft(data)) / float(win)
-    amp = amp[:half]
-    band = np.fft.fftfreq(win, 1/float(fs))
-    band = band[:half]
-    ax.plot(band, 20. * np.log10(amp), color)
+    """ Welch power spectral density in dB """
+    freq, psd = welch(data, fs)
+    ax.plot(freq, 10. * np.log10(psd), color)
+    ax.set_xlabel("Hz")
+    ax.set_ylabel("dB/Hz")
+
+def plot_spectrogram(ax, data, fs):
+    times, freq, power = spectrogram(data, fs)
+    ax.pcolormesh(times, freq, 10. * np.log10(power.T))
+    ax.set_xlabel("Second")
+    ax.set_ylabel("Hz")
 
 def plot_filter(ax, fs, w, h, color=None):
     """
@@ -32,60 +42,52 @@ def plot_filter(ax, fs, w, h, color=None):
     ax.plot(freq, mag_db, color=color)
 
 def plot_power_line_noise_filter(ax, fs):
-    f0 = 65.0
-    Q = 30.0
-    w0 = f0 / (fs/2)
-    b, a = signal.iirnotch(w0, Q)
-    w, h = signal.freqz(b, a)
+    w, h = signal.sosfreqz(notch_sos(fs))
     plot_filter(ax, fs, w, h, color='c')
 
 def plot_high_pass_filter(ax, fs, cutoff):
-    nyq = fs / 2.0
-    normalized_cutoff = cutoff / nyq
-    b, a = signal.butter(3, normalized_cutoff, btype="highpass", analog=False)
-    w, h = signal.freqz(b, a)
+    w, h = signal.sosfreqz(butter_sos(fs, cutoff, btype="highpass"))
     plot_filter(ax, fs, w, h, color='y')
 
 def plot_low_pass_filter(ax, fs, cutoff):
-    nyq = fs / 2.0
-    normalized_cutoff = cutoff / nyq
-    b, a = signal.butter(3, normalized_cutoff, btype="lowpass", analog=False)
-    w, h = signal.freqz(b, a)
+    w, h = signal.sosfreqz(butter_sos(fs, cutoff, btype="lowpass"))
     plot_filter(ax, fs, w, h, color='r')
 
 def plot_time_domain(ax, data, color='b'):
-    ax.plot(data[:,0], data[:,1], color)
+    plot_lod(ax, data[:,0], data[:,1], color)
     ax.set_xlabel("Sequence number")
     ax.set_ylabel("MV")
 
-def plot_ecg(data):
-    figsize = plot.rcParams['figure.figsize']
-    figsize[0] = PNG_W_INCH
-    figsize[1] = PNG_H_INCH
-    plot.rcParams['figure.figsize'] = figsize
+def draw_strip(ax, data, start_ts=None, end_ts=None):
+    """ Draw an ECG strip with grid lines every 0.2 s and 0.5 mV
+    start_ts, end_ts: the time range of the strip, that of data by default
+    """
+    start_ts = data[0][0] if start_ts is None else start_ts
+    end_ts = data[-1][0] if end_ts is None else end_ts
+    # vertical lines every 0.2s
+    vl = np.arange(start_ts, end_ts, MS_STEP)
+    # horizontal lines every 0.5 mV
+    hl = np.arange(MV_LOW_BOUND, MV_HIGH_BOUND, MV_STEP)
+
+    ax.set_xlim(start_ts, end_ts)
+    ax.set_ylim(MV_LOW_BOUND, MV_HIGH_BOUND)
+    # disable autoscale since it will be difficult to compare, e.g., RR interval.
+    ax.autoscale(False)
+    ax.vlines(vl, MV_LOW_BOUND, MV_HIGH_BOUND, color='r', alpha=0.2)
+    ax.hlines(hl, start_ts, end_ts, color='r', alpha=0.2)
+    plot_time_domain(ax, data, color='black')
 
+def plot_ecg(data):
     num_seg = 4
     s = np.array_split(data, num_seg)
-    _, axes = plot.subplots(num_seg, 1)
+    fig, axes = plot.subplots(num_seg, 1, figsize=(PNG_W_INCH, PNG_H_INCH))
 
     for i in range(0, num_seg):
-        start_ts = s[i][0][0]
-        end_ts = s[i][-1][0]
-        # vertical lines every 0.2s
-        vl = np.arange(start_ts, end_ts, MS_STEP)
-        # horizontal lines every 0.5 mV
-        hl = np.arange(MV_LOW_BOUND, MV_HIGH_BOUND, MV_STEP)
-
-        axes[i].set_xlim(start_ts, end_ts)
-        axes[i].set_ylim(MV_LOW_BOUND, MV_HIGH_BOUND)
-        # disable autoscale since it will be difficult to compare, e.g., RR interval.
-        axes[i].autoscale(False)
-        axes[i].vlines(vl, MV_LOW_BOUND, MV_HIGH_BOUND, color='r', alpha=0.2)
-        axes[i].hlines(hl, start_ts, end_ts, color='r', alpha=0.2)
-        plot_time_domain(axes[i], s[i], color='black')
+        draw_strip(axes[i], s[i])
 
     # adjust layout
-    plot.tight_layout(pad=0.3, h_pad = 0.2)
+    fig.tight_layout(pad=0.3, h_pad = 0.2)
+    return fig
 
 def plot_to_png(png_name):
     plot.savefig(png_name)
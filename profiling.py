@@ -0,0 +1,167 @@
+import cProfile
+import json
+import os
+import pstats
+import resource
+import threading
+import time
+
+import numpy as np
+
+# Counters of each stage of a run: calls, rows, samples, bytes, seconds and
+# memory. Stages are wrapped when a pipeline is built, and only when
+# profiling is enabled; otherwise wrap() returns the function itself, so a
+# run without --profile does exactly what it did before.
+#
+# Python 2 has no tracemalloc, so the peak allocation of a stage is taken
+# from the peak RSS of the process: rss_growth_mb is how far a stage pushed
+# the peak up, peak_rss_mb the peak after it.
+
+_enabled = False
+_cprofile = False
+_lock = threading.Lock()
+_stats = {}
+_profiles = {}
+
+def enable(cprofile=False):
+    """ Start collecting; with cprofile, also run each stage under cProfile """
+    global _enabled, _cprofile
+    _enabled = True
+    _cprofile = cprofile
+
+def enabled():
+    return _enabled
+
+def _peak_rss_kb():
+    # KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def _size(x):
+    """ Return (rows, samples, bytes) of a stage input or output """
+    if isinstance(x, np.ndarray):
+        return len(x) if x.ndim else 1, x.size, x.nbytes
+    if isinstance(x, (dict, tuple, list)):
+        # arrays in arguments or results, not file names
+        values = x.values() if isinstance(x, dict) else x
+        sizes = [_size(v) for v in values if isinstance(v, (np.ndarray, dict, tuple, list))]
+        return tuple(sum(s[i] for s in sizes) for i in range(3))
+    if isinstance(x, str):
+        return 0, 0, len(x)
+    return 0, 0, 0
+
+def _new_stats():
+    return {'calls': 0, 'rows': 0, 'samples': 0, 'bytes': 0, 'seconds': 0., 'peak_rss_mb': 0., 'rss_growth_mb': 0.}
+
+def _add(name, seconds, sizes, peak_before, peak_after):
+    with _lock:
+        s = _stats.setdefault(name, _new_stats())
+        s['calls'] += 1
+        s['rows'] += sizes[0]
+        s['samples'] += sizes[1]
+        s['bytes'] += sizes[2]
+        s['seconds'] += seconds
+        s['peak_rss_mb'] = max(s['peak_rss_mb'], peak_after / 1024.)
+        s['rss_growth_mb'] = max(s['rss_growth_mb'], (peak_after - peak_before) / 1024.)
+
+def wrap(name, fn, cprofile=True):
+    """ Return fn counting its calls under name, or fn itself if not enabled.
+    Rows, samples and bytes are those of the result, or of the arguments
+    for stages returning nothing, e.g. writers.
+    cprofile: False for a stage which runs other stages, cProfile can not nest
+    """
+    if not _enabled:
+        return fn
+    def stage(*args, **kwargs):
+        peak = _peak_rss_kb()
+        profile = cProfile.Profile() if _cprofile and cprofile else None
+        start = time.time()
+        if profile:
+            profile.enable()
+        try:
+            out = fn(*args, **kwargs)
+        finally:
+            if profile:
+                profile.disable()
+            seconds = time.time() - start
+        _add(name, seconds, _size(out if out is not None else args), peak, _peak_rss_kb())
+        if profile:
+            _add_profile(name, pstats.Stats(profile).stats)
+        return out
+    return stage
+
+class Stage(object):
+    """ A stream stage or sink counted under name, see stream.Pipeline """
+    def __init__(self, name, stage):
+        self.name = name
+        self.stage = stage
+        self.call = wrap(name, stage)
+        self.flush_stage = wrap(name + ':flush', getattr(stage, 'flush', lambda: np.empty((0, 0))))
+
+    def __call__(self, x):
+        return self.call(x)
+
+    def flush(self):
+        return self.flush_stage()
+
+    def __getattr__(self, name):
+        # close(), fname and the like of a sink
+        if name == 'stage':
+            raise AttributeError(name)
+        return getattr(self.stage, name)
+
+class _LoadedStats(object):
+    """ Stats of a profile, as pstats.Stats.add() takes them """
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+def _add_profile(name, stats):
+    with _lock:
+        if name in _profiles:
+            _profiles[name].add(_LoadedStats(stats))
+        else:
+            _profiles[name] = pstats.Stats(_LoadedStats(stats))
+
+def snapshot():
+    """ Return and clear what was collected, e.g. to send from a worker
+    process to merge() in the parent
+    """
+    global _stats, _profiles
+    with _lock:
+        stats, profiles = _stats, _profiles
+        _stats, _profiles = {}, {}
+    return stats, dict((n, p.stats) for n, p in profiles.items())
+
+def merge(collected):
+    stats, profiles = collected
+    with _lock:
+        for name, s in stats.items():
+            t = _stats.setdefault(name, _new_stats())
+            for k in ['calls', 'rows', 'samples', 'bytes', 'seconds']:
+                t[k] += s[k]
+            for k in ['peak_rss_mb', 'rss_growth_mb']:
+                t[k] = max(t[k], s[k])
+    for name, p in profiles.items():
+        _add_profile(name, p)
+
+def report():
+    """ Return {stage: counters}, with samples per second """
+    with _lock:
+        stats = dict((n, dict(s)) for n, s in _stats.items())
+    for s in stats.values():
+        s['samples_per_sec'] = s['samples'] / s['seconds'] if s['seconds'] else 0.
+    return stats
+
+def write_report(fname, **meta):
+    """ Write the report as json, and a .prof file per stage next to it if
+    cProfile is on, to be read by pstats or snakeviz
+    """
+    with open(fname, 'w') as f:
+        json.dump(dict(meta, stages=report()), f, indent=1, sort_keys=True)
+    if _profiles:
+        base = os.path.splitext(fname)[0]
+        with _lock:
+            for name, p in _profiles.items():
+                p.dump_stats('%s_%s.prof' % (base, name.replace(':', '_')))
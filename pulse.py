@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import csv
+import multiprocessing
+import numpy as np
+import os
+import sys
+import time
+import traceback
+
+import runner
+
+from cache import load_raw_file
+from export import export, output_names, EXPORT_FORMATS
+from filters import butter_sos, chain_filter, PPG_FS_125, PPG_FS_512, HIGH_PASS_CUTOFF, LOW_PASS_CUTOFF
+from hr import hr_rows
+from lazy import lazy_import
+from parser import calc_ts, ReseqState, samples_per_row, MSEC_PER_SEC, TYPE_PPG125, TYPE_PPG512, TYPE_HR
+from qrs import r_peaks, rr_intervals, hrv, device_windows, SEGMENT_SECONDS, WINDOW_SECONDS
+
+ndimage = lazy_import('scipy.ndimage')
+
+# Systolic peaks of the PPG band-passed as ppg125_bp_filter() does: the
+# largest value within a refractory period either side, which rises above
+# the middle of the recent pulse amplitude. The refractory period skips the
+# dicrotic notch. Pulse rate per window is then compared with the type 22
+# HR rows of the device.
+REFRACTORY_SECONDS = 0.3
+ENVELOPE_SECONDS = 3.
+THRESHOLD = 0.5
+# a window disagrees if pulse rate and device HR differ by more than this
+DISAGREE_BPM = 10
+
+PPG_FS = {TYPE_PPG125: PPG_FS_125, TYPE_PPG512: PPG_FS_512}
+PULSE_NAMES = ["timestamp", "beats", "pulse_rate", "device_hr", "device_rows", "dropped", "difference"]
+REPORT_NAMES = ["file", "type", "beats", "windows", "compared", "mean_abs_difference", "disagree_pct",
+                "dropped_pct"]
+
+def parse_args():
+    p = argparse.ArgumentParser(description='Detect PPG pulses in raw data files and compare pulse rate with device HR')
+    p.add_argument('--type', default=None, type=int, choices=sorted(PPG_FS), \
+                   help='PPG type, by default 12 (512 Hz) if the file has it, otherwise 9 (125 Hz)')
+    p.add_argument('--window', default=WINDOW_SECONDS, type=float, help='Seconds per window')
+    p.add_argument('--disagree', default=DISAGREE_BPM, type=float, \
+                   help='Pulse rate and device HR disagree if they differ by more bpm')
+    p.add_argument('--jobs', default=multiprocessing.cpu_count(), type=int, help='Number of worker processes')
+    p.add_argument('--format', default='csv', choices=sorted(EXPORT_FORMATS.keys()), help='Export format')
+    p.add_argument('--precision', default=6, type=int, help='Digits after the decimal point for fastcsv')
+    p.add_argument('--output_dir', help='Write outputs here instead of next to the raw data files')
+    p.add_argument('--pattern', default=runner.RAW_PATTERN, help='Raw data files to pick up from directories')
+    p.add_argument('--no_cache', help='Do not use or write the parsed data cache', action='store_true')
+    p.add_argument('--report', default=None, help='Write the disagreement of every file to this csv file')
+    p.add_argument('inputs', nargs='+', help='Raw data files, directories or glob patterns')
+    return vars(p.parse_args())
+
+def find_pulse_peaks(mv, fs):
+    """ Return the sample indices of the systolic peaks in mv """
+    refractory = int(REFRACTORY_SECONDS * fs)
+    if len(mv) <= 2 * refractory:
+        return np.empty(0, dtype=int)
+    band = chain_filter(mv, butter_sos(fs, HIGH_PASS_CUTOFF, LOW_PASS_CUTOFF))
+    peak = band == ndimage.maximum_filter1d(band, 2 * refractory + 1)
+    w = int(ENVELOPE_SECONDS * fs)
+    top = ndimage.maximum_filter1d(band, w)
+    bottom = ndimage.minimum_filter1d(band, w)
+    candidates = np.flatnonzero(peak & (band > bottom + THRESHOLD * (top - bottom)) & (top > bottom))
+    if not len(candidates):
+        return candidates
+    # a flat top gives several maxima, keep the first
+    return candidates[np.hstack((True, np.diff(candidates) > refractory))]
+
+def pulse_rate(pp, window_seconds=WINDOW_SECONDS, device=None):
+    """
+    Pulse rate of the valid pulse intervals in windows of window_seconds
+    against the device HR
+    pp:     rows of qrs.rr_intervals() of the pulses
+    device: rows of hr.hr_rows()
+    return: rows of PULSE_NAMES, device HR leaves out dropped rows
+    """
+    windows = hrv(pp, window_seconds)
+    if not len(windows):
+        return np.empty((0, len(PULSE_NAMES)))
+    step = window_seconds * MSEC_PER_SEC
+    first = np.floor(windows[0,0] / step)
+    w = (np.floor(windows[:,0] / step) - first).astype(int)
+    hr = np.empty((len(windows), 3))
+    hr[:,0] = np.nan
+    hr[:,1:] = 0
+    if device is not None and len(device):
+        hr = np.column_stack(device_windows(device, first, w[-1] + 1, step))[w]
+    return np.column_stack((windows[:,:3], hr, windows[:,2] - hr[:,0]))
+
+def pick_type(raw, t=None):
+    if t is None:
+        t = TYPE_PPG512 if len(raw.get(TYPE_PPG512, [])) else TYPE_PPG125
+    if not len(raw.get(t, [])):
+        raise ValueError('no PPG data of type %d' % t)
+    return t
+
+def process_file(job):
+    """ Run in a worker, return (file, report row, seconds, error) """
+    raw_data_file, options = job
+    start = time.time()
+    try:
+        raw = load_raw_file(raw_data_file, [TYPE_PPG125, TYPE_PPG512, TYPE_HR], use_cache=not options['no_cache'])
+        t = pick_type(raw, options['type'])
+        data = ReseqState(samples_per_row(t))(calc_ts(raw[t]))
+        ts, contiguous = r_peaks(data, PPG_FS[t], SEGMENT_SECONDS, find=find_pulse_peaks,
+                                 refractory=REFRACTORY_SECONDS)
+        pp = rr_intervals(ts, contiguous)
+        device = hr_rows(raw[TYPE_HR]) if TYPE_HR in raw else None
+        windows = pulse_rate(pp, options['window'], device)
+
+        output_dir = options['output_dir'] or os.path.dirname(raw_data_file)
+        fname = output_names(raw_data_file, output_dir, options['format'])['pulse_out']
+        export(fname, windows, options['format'], PULSE_NAMES, precision=options['precision'])
+        row = disagreement(windows, options['disagree'])
+        row = [raw_data_file, t, len(ts)] + row
+        error = None
+    except Exception:
+        row = None
+        error = traceback.format_exc()
+    return raw_data_file, row, time.time() - start, error
+
+def disagreement(windows, disagree=DISAGREE_BPM):
+    """ Return windows, compared windows, mean |difference|, % of compared
+    windows which disagree, % of device rows dropped
+    """
+    compared = windows[~np.isnan(windows[:,6])]
+    diff = np.abs(compared[:,6])
+    rows = windows[:,4].sum()
+    return [len(windows), len(compared), diff.mean() if len(diff) else np.nan,
+            100. * np.mean(diff > disagree) if len(diff) else np.nan,
+            100. * windows[:,5].sum() / rows if rows else np.nan]
+
+def run(files, options, workers=1):
+    """ Shard files over a worker pool, return the results of process_file() """
+    return runner.run(process_file, files, options, workers, describe)
+
+def describe(result):
+    raw_data_file, row, secs, _ = result
+    return '%s: %d pulses, %d windows, %d compared, |difference| %.1f bpm, %.1f%% disagree, ' \
+           '%.1f%% dropped, %.2f s' % tuple([raw_data_file] + row[2:] + [secs])
+
+def summary(results):
+    rows = [r[1] for r in results if not r[3]]
+    print '-' * 40
+    print 'files: %d, failed: %d' % (len(rows), len(runner.failed(results)))
+    compared = sum(r[4] for r in rows)
+    if compared:
+        # weighted by the compared windows of each file
+        weighted = lambda i: sum(r[i] * r[4] for r in rows if r[4]) / compared
+        print 'windows compared: %d, |difference| %.1f bpm, %.1f%% disagree' % (compared, weighted(5), weighted(6))
+    runner.print_failures(results)
+
+def write_report(fname, results):
+    with open(fname, 'wb') as f:
+        w = csv.writer(f)
+        w.writerow(REPORT_NAMES)
+        for _, row, _, error in sorted(results):
+            if not error:
+                w.writerow(row)
+
+if __name__ == "__main__":
+    args = parse_args()
+    files, _ = runner.select_files(args)
+    results = run(files, args, args['jobs'])
+    summary(results)
+    if args['report']:
+        write_report(args['report'], results)
+    sys.exit(1 if runner.failed(results) else 0)
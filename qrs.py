@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import multiprocessing
+import numpy as np
+import os
+import sys
+import time
+import traceback
+
+import runner
+
+from cache import load_raw_file
+from export import export, output_names, EXPORT_FORMATS
+from filters import butter_sos, chain_filter, ECG_FS
+from hr import hr_rows
+from lazy import lazy_import
+from parser import calc_ts, ReseqState, samples_per_row, MSEC_PER_SEC, TYPE_ECG, TYPE_HR
+from resample import to_grid
+
+ndimage = lazy_import('scipy.ndimage')
+
+# Pan-Tompkins: band-pass, derivative, squaring and moving window
+# integration, then peaks of the integrated energy above a threshold which
+# follows its recent maximum. Every step works on whole arrays; a long
+# recording is cut into segments overlapping by PAD_SECONDS, which can be
+# detected in parallel.
+QRS_LOW_CUTOFF = 5
+QRS_HIGH_CUTOFF = 15
+DERIVATIVE = np.array([1., 2., 0., -2., -1.]) / 8
+INTEGRATION_SECONDS = 0.15
+REFRACTORY_SECONDS = 0.2
+ENVELOPE_SECONDS = 2.
+THRESHOLD = 0.3
+# the R peak is looked for this far around the energy peak
+SEARCH_SECONDS = 0.075
+SEGMENT_SECONDS = 600
+PAD_SECONDS = 5
+# intervals out of this range are artifacts or missed beats
+RR_MIN_MS = 300
+RR_MAX_MS = 2000
+WINDOW_SECONDS = 60
+
+RR_NAMES = ["timestamp", "rr", "hr", "valid"]
+HRV_NAMES = ["timestamp", "beats", "hr", "sdnn", "rmssd", "pnn50", "device_hr"]
+
+def parse_args():
+    p = argparse.ArgumentParser(description='Detect R peaks in the ECG of raw data files, export RR intervals and HRV')
+    p.add_argument('--window', default=WINDOW_SECONDS, type=float, help='Seconds per HRV window')
+    p.add_argument('--segment_seconds', default=SEGMENT_SECONDS, type=float, \
+                   help='Seconds of ECG per detection segment')
+    p.add_argument('--jobs', default=multiprocessing.cpu_count(), type=int, \
+                   help='Number of worker processes detecting segments')
+    p.add_argument('--format', default='csv', choices=sorted(EXPORT_FORMATS.keys()), help='Export format')
+    p.add_argument('--precision', default=6, type=int, help='Digits after the decimal point for fastcsv')
+    p.add_argument('--output_dir', help='Write outputs here instead of next to the raw data files')
+    p.add_argument('--pattern', default=runner.RAW_PATTERN, help='Raw data files to pick up from directories')
+    p.add_argument('--no_cache', help='Do not use or write the parsed data cache', action='store_true')
+    p.add_argument('inputs', nargs='+', help='Raw data files, directories or glob patterns')
+    return vars(p.parse_args())
+
+def qrs_energy(mv, fs=ECG_FS):
+    """ Return the QRS band of mv and its integrated energy """
+    band = chain_filter(mv, butter_sos(fs, QRS_LOW_CUTOFF, QRS_HIGH_CUTOFF))
+    slope = np.convolve(band, DERIVATIVE * fs, 'same')
+    n = int(INTEGRATION_SECONDS * fs)
+    return band, np.convolve(np.square(slope), np.ones(n) / n, 'same')
+
+def find_r_peaks(mv, fs=ECG_FS):
+    """ Return the sample indices of the R peaks in mv """
+    refractory = int(REFRACTORY_SECONDS * fs)
+    if len(mv) <= 2 * refractory:
+        return np.empty(0, dtype=int)
+    band, energy = qrs_energy(mv, fs)
+    # the largest energy within a refractory period either side
+    peak = energy == ndimage.maximum_filter1d(energy, 2 * refractory + 1)
+    envelope = ndimage.maximum_filter1d(energy, int(ENVELOPE_SECONDS * fs))
+    candidates = np.flatnonzero(peak & (energy > THRESHOLD * envelope) & (energy > 0))
+    if not len(candidates):
+        return candidates
+    # a flat top gives several maxima, keep the first
+    candidates = candidates[np.hstack((True, np.diff(candidates) > refractory))]
+    # the largest deflection of the QRS band around each candidate
+    w = int(SEARCH_SECONDS * fs)
+    around = np.clip(candidates[:,np.newaxis] + np.arange(-w, w + 1), 0, len(mv) - 1)
+    r = around[np.arange(len(around)), np.argmax(np.abs(band[around]), axis=1)]
+    return np.unique(r)
+
+def _detect_segment(job):
+    find, mv, fs, offset, start, end = job
+    r = find(mv, fs) + offset
+    return r[(r >= start) & (r < end)]
+
+def detect_r_peaks(mv, fs=ECG_FS, segment_seconds=SEGMENT_SECONDS, pool=None, find=find_r_peaks,
+                   refractory=REFRACTORY_SECONDS):
+    """ find_r_peaks(), or another find(mv, fs), over overlapping segments
+    of a long recording, in a multiprocessing pool if one is given
+    refractory: seconds between two peaks of find
+    """
+    seg = int(segment_seconds * fs)
+    pad = int(PAD_SECONDS * fs)
+    jobs = [(find, mv[max(s - pad, 0):s + seg + pad], fs, max(s - pad, 0), s, s + seg)
+            for s in xrange(0, len(mv), seg)]
+    if pool and len(jobs) > 1:
+        parts = pool.map(_detect_segment, jobs)
+    else:
+        parts = map(_detect_segment, jobs)
+    if not parts:
+        return np.empty(0, dtype=int)
+    r = np.concatenate(parts)
+    # a peak next to a segment boundary may be found on both sides
+    return r[np.hstack((True, np.diff(r) > refractory * fs))] if len(r) else r
+
+def r_peaks(data, fs=ECG_FS, segment_seconds=SEGMENT_SECONDS, pool=None, find=find_r_peaks,
+            refractory=REFRACTORY_SECONDS):
+    """
+    data:   timestamp, sequence, mv rows after reseq(), e.g. as ecg_pl_filter()
+            leaves them; the QRS band is filtered here
+    return: timestamps of the R peaks, and whether each follows the one
+            before it without a sequence gap between them
+    """
+    if not len(data):
+        return np.empty(0), np.empty(0, dtype=bool)
+    values, missing = to_grid(data)
+    r = detect_r_peaks(values[:,0], fs, segment_seconds, pool, find, refractory)
+    r = r[~missing[r]]
+    k = data[:,1] - data[0,1]
+    ts = np.interp(r, k, data[:,0])
+    if not len(r):
+        return ts, np.empty(0, dtype=bool)
+    gaps = np.cumsum(missing)[r]
+    return ts, np.hstack((False, gaps[1:] == gaps[:-1]))
+
+def rr_intervals(ts, contiguous):
+    """ Return timestamp, rr (ms), hr (bpm), valid rows, one per beat after the first """
+    rr = np.diff(ts)
+    valid = contiguous[1:] & (rr >= RR_MIN_MS) & (rr <= RR_MAX_MS)
+    with np.errstate(divide='ignore'):
+        hr = 60. * MSEC_PER_SEC / rr
+    return np.column_stack((ts[1:], rr, hr, valid))
+
+def device_windows(device, first, n, step):
+    """
+    device: rows of hr.hr_rows()
+    return: the mean reported HR of the rows which are not dropped, the
+            number of rows and of dropped rows, of n windows of step ms
+            from window number first
+    """
+    w = (np.floor(device[:,0] * MSEC_PER_SEC / step) - first).astype(int)
+    inside = (w >= 0) & (w < n)
+    w, device = w[inside], device[inside]
+    kept = device[:,4] == 0
+    rows = np.bincount(w, minlength=n)
+    dropped = np.bincount(w[~kept], minlength=n)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        hr = np.bincount(w[kept], device[kept,1], n) / (rows - dropped)
+    return hr, rows, dropped
+
+def hrv(rr, window_seconds=WINDOW_SECONDS, device=None):
+    """
+    Heart rate and HRV of the valid intervals in windows of window_seconds
+    rr:     rows of rr_intervals()
+    device: rows of hr.hr_rows(), for the mean device HR of each window
+    return: window start, beats, hr, sdnn, rmssd, pnn50, device hr rows
+    """
+    if not len(rr):
+        return np.empty((0, len(HRV_NAMES)))
+    step = window_seconds * MSEC_PER_SEC
+    first = np.floor(rr[0,0] / step)
+    window = (np.floor(rr[:,0] / step) - first).astype(int)
+    n = window[-1] + 1
+    valid = rr[:,3] > 0
+    ms = rr[:,1]
+
+    i = window[valid]
+    count = np.bincount(i, minlength=n)
+    total = np.bincount(i, ms[valid], n)
+    square = np.bincount(i, np.square(ms[valid]), n)
+    # successive differences of valid intervals in the same window
+    pair = valid[1:] & valid[:-1] & (window[1:] == window[:-1])
+    d = np.diff(ms)[pair]
+    j = window[1:][pair]
+    pairs = np.bincount(j, minlength=n)
+
+    device_hr = np.empty(n)
+    device_hr.fill(np.nan)
+    if device is not None and len(device):
+        device_hr = device_windows(device, first, n, step)[0]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total / count
+        sdnn = np.sqrt(np.maximum(square - count * np.square(mean), 0) / (count - 1))
+        rmssd = np.sqrt(np.bincount(j, np.square(d), n) / pairs)
+        pnn50 = 100. * np.bincount(j, np.abs(d) > 50, n) / pairs
+        out = np.column_stack(((first + np.arange(n)) * step, count, 60. * MSEC_PER_SEC / mean,
+                               sdnn, rmssd, pnn50, device_hr))
+    return out[count > 0]
+
+def process_file(raw_data_file, options, pool=None):
+    """ Export RR intervals and HRV of a raw data file, return (beats, rr, hrv) """
+    raw = load_raw_file(raw_data_file, [TYPE_ECG, TYPE_HR], use_cache=not options['no_cache'])
+    if TYPE_ECG not in raw or not len(raw[TYPE_ECG]):
+        raise ValueError('no ECG data')
+    data = ReseqState(samples_per_row(TYPE_ECG))(calc_ts(raw[TYPE_ECG]))
+    ts, contiguous = r_peaks(data, ECG_FS, options['segment_seconds'], pool)
+    rr = rr_intervals(ts, contiguous)
+    device = hr_rows(raw[TYPE_HR]) if TYPE_HR in raw else None
+    windows = hrv(rr, options['window'], device)
+
+    output_dir = options['output_dir'] or os.path.dirname(raw_data_file)
+    names = output_names(raw_data_file, output_dir, options['format'])
+    export(names['rr_out'], rr, options['format'], RR_NAMES, precision=options['precision'])
+    export(names['hrv_out'], windows, options['format'], HRV_NAMES, precision=options['precision'])
+    return len(ts), rr, windows
+
+def process_job(job, pool=None):
+    """ process_file() of a (raw data file, options) job of runner.run(),
+    return (file, (beats, rr, hrv), seconds, error)
+    """
+    raw_data_file, options = job
+    start = time.time()
+    try:
+        result = process_file(raw_data_file, options, pool)
+        error = None
+    except Exception:
+        result = None
+        error = traceback.format_exc()
+    return raw_data_file, result, time.time() - start, error
+
+def describe(result):
+    raw_data_file, (beats, rr, windows), secs, _ = result
+    valid = rr[:,3] > 0
+    line = '%s: %d beats in %.2f s' % (raw_data_file, beats, secs)
+    if valid.any():
+        line += ', hr %.1f bpm' % (60. * MSEC_PER_SEC / rr[valid,1].mean())
+    both = windows[~np.isnan(windows[:,6])] if len(windows) else windows
+    if len(both):
+        line += ', |ecg - device| hr %.1f bpm' % np.abs(both[:,2] - both[:,6]).mean()
+    return line
+
+if __name__ == "__main__":
+    args = parse_args()
+    files, _ = runner.select_files(args)
+
+    # files are taken one at a time, their segments are detected across the pool
+    pool = multiprocessing.Pool(args['jobs']) if args['jobs'] > 1 else None
+    results = runner.run(lambda job: process_job(job, pool), files, args, describe=describe)
+    if pool:
+        pool.close()
+        pool.join()
+    runner.print_failures(results)
+    sys.exit(1 if runner.failed(results) else 0)
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import multiprocessing
+import numpy as np
+import os
+import sys
+import time
+import traceback
+
+import runner
+
+# drawn on an Agg canvas of its own, which needs no display and leaves
+# the pyplot backend alone
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from cache import load_raw_file
+from filters import notch_sos, band_chain, chain_sos, chain_filter, ECG_FS
+from parser import calc_ts, MSEC_PER_SEC, TYPE_ECG
+from plots import draw_strip, PNG_W_INCH, PNG_H_INCH
+
+LOW_PASS_CUTOFF = 35
+HIGH_PASS_CUTOFF = 0.5
+SEGMENTS = 4
+DPI = 100
+
+def parse_args():
+    p = argparse.ArgumentParser(description='Render ECG strips of raw data files to png files')
+    p.add_argument('--output_dir', default=None, help='Write png files here instead of next to each input')
+    p.add_argument('--pattern', default=runner.RAW_PATTERN, help='Raw data files to pick up from directories')
+    p.add_argument('--segments', default=SEGMENTS, type=int, help='Strips per page')
+    p.add_argument('--segment_seconds', default=None, type=float, \
+                   help='Seconds per strip, one png per page; by default the whole recording on one page')
+    p.add_argument('--dpi', default=DPI, type=int, help='Resolution of the png files')
+    p.add_argument('--jobs', default=multiprocessing.cpu_count(), type=int, help='Number of worker processes')
+    p.add_argument('--no_cache', help='Do not use or write the parsed data cache', action='store_true')
+    p.add_argument('--force', help='Render files even if their png files are up to date', action='store_true')
+    p.add_argument('inputs', nargs='+', help='Raw data files, directories or glob patterns')
+    return vars(p.parse_args())
+
+def filter_ecg(data):
+    """ data: (timestamp, mv) rows, return them with mv notch and bandpass filtered """
+    sos = chain_sos(notch_sos(ECG_FS), band_chain(ECG_FS, HIGH_PASS_CUTOFF, LOW_PASS_CUTOFF))
+    return np.column_stack((data[:,0], chain_filter(data[:,1], sos)))
+
+def page_names(png_name, pages):
+    if pages == 1:
+        return [png_name]
+    base, ext = os.path.splitext(png_name)
+    return ['%s_%03d%s' % (base, i + 1, ext) for i in range(pages)]
+
+class StripRenderer(object):
+    """ Render ECG strips to png files with a single figure, which is reused
+    for every page instead of creating a pyplot figure each time
+    """
+    def __init__(self, segments=SEGMENTS, dpi=DPI, width=PNG_W_INCH, height=PNG_H_INCH):
+        self.fig = Figure(figsize=(width, height), dpi=dpi)
+        FigureCanvasAgg(self.fig)
+        self.axes = [self.fig.add_subplot(segments, 1, i + 1) for i in range(segments)]
+
+    def render_page(self, strips, png_name):
+        """ strips: list of (data, start_ts, end_ts) up to one per axis """
+        for i, ax in enumerate(self.axes):
+            ax.cla()
+            if i < len(strips) and len(strips[i][0]):
+                ax.set_axis_on()
+                draw_strip(ax, *strips[i])
+            else:
+                ax.set_axis_off()
+        self.fig.tight_layout(pad=0.3, h_pad=0.2)
+        self.fig.savefig(png_name)
+
+    def render(self, data, png_name, segment_seconds=None):
+        """
+        data:            (timestamp, mv) rows
+        segment_seconds: split data into strips of this length over as many
+                         pages as needed, otherwise into one page of strips
+        return:          names of the png files
+        """
+        n = len(self.axes)
+        if segment_seconds:
+            step = segment_seconds * MSEC_PER_SEC
+            starts = data[0,0] + np.arange(max(np.ceil((data[-1,0] - data[0,0]) / step), 1)) * step
+            parts = np.split(data, np.searchsorted(data[:,0], starts[1:]))
+            strips = [(p, s, s + step) for p, s in zip(parts, starts)]
+        else:
+            strips = [(p, None, None) for p in np.array_split(data, n)]
+        pages = [strips[i:i+n] for i in range(0, len(strips), n)]
+        names = page_names(png_name, len(pages))
+        for page, name in zip(pages, names):
+            self.render_page(page, name)
+        return names
+
+# one renderer per process and layout
+_renderers = {}
+
+def get_renderer(segments=SEGMENTS, dpi=DPI):
+    key = (segments, dpi)
+    if key not in _renderers:
+        _renderers[key] = StripRenderer(segments, dpi)
+    return _renderers[key]
+
+def png_path(raw_data_file, output_dir=None):
+    name = os.path.splitext(os.path.basename(raw_data_file))[0] + '.png'
+    return os.path.join(output_dir or os.path.dirname(raw_data_file), name)
+
+def render_file(job):
+    """ Run in a worker, return (file, png files, seconds, error) """
+    raw_data_file, options = job
+    start = time.time()
+    names = []
+    try:
+        raw = load_raw_file(raw_data_file, [TYPE_ECG], use_cache=not options['no_cache'])
+        if TYPE_ECG not in raw or not len(raw[TYPE_ECG]):
+            raise ValueError('no ECG data')
+        data = filter_ecg(calc_ts(raw[TYPE_ECG])[:,[0,2]])
+        renderer = get_renderer(options['segments'], options['dpi'])
+        names = renderer.render(data, png_path(raw_data_file, options['output_dir']), options['segment_seconds'])
+        error = None
+    except Exception:
+        error = traceback.format_exc()
+    return raw_data_file, names, time.time() - start, error
+
+def is_up_to_date(raw_data_file, options):
+    """ True if the png file, or the first page of them, is newer than the raw data file """
+    png = png_path(raw_data_file, options['output_dir'])
+    mtime = os.path.getmtime(raw_data_file)
+    return any(os.path.exists(n) and os.path.getmtime(n) >= mtime for n in [png, page_names(png, 2)[0]])
+
+def run(files, options, workers=1):
+    """ Shard files over a worker pool, return the results of render_file() """
+    # each worker reuses its figure over files
+    return runner.run(render_file, files, options, workers, describe)
+
+def describe(result):
+    raw_data_file, names, secs, _ = result
+    return '%s: %d png in %.2f s' % (raw_data_file, len(names), secs)
+
+def summary(results, skipped):
+    failed = runner.failed(results)
+    print '-' * 40
+    print 'rendered: %d, skipped: %d, failed: %d' % (len(results) - len(failed), len(skipped), len(failed))
+    print 'png files: %d in %.2f worker seconds' % (sum(len(r[1]) for r in results), sum(r[2] for r in results))
+    runner.print_failures(results)
+
+if __name__ == "__main__":
+    args = parse_args()
+    files, skipped = runner.select_files(args, is_up_to_date)
+    results = run(files, args, args['jobs'])
+    summary(results, skipped)
+    sys.exit(1 if runner.failed(results) else 0)
@@ -0,0 +1,80 @@
+import numpy as np
+
+from fractions import Fraction
+from lazy import lazy_import
+
+signal = lazy_import('scipy.signal')
+
+from parser import MSEC_PER_SEC
+
+MAX_DENOMINATOR = 1000
+
+def to_grid(x, columns=(2,)):
+    """ Place samples on their own uniform grid by resequenced sequence numbers
+    x:      timestamp, sequence, value(s) rows after reseq()
+    return: values (grid length, len(columns)) with gaps linearly
+            interpolated, and a mask of the grid points inside gaps
+    """
+    k = (x[:,1] - x[0,1]).astype(int)
+    grid = np.arange(k[-1] + 1)
+    missing = np.ones(len(grid), dtype=bool)
+    missing[k] = False
+    values = np.column_stack([np.interp(grid, k, x[:,c]) for c in columns])
+    return values, missing
+
+def sample_rate(x):
+    """ Effective sample rate from the interpolated timestamps and sequence numbers """
+    span = x[-1,0] - x[0,0]
+    return (x[-1,1] - x[0,1]) * MSEC_PER_SEC / span if span > 0 else None
+
+def resample_stream(x, rate, columns=(2,), fs=None):
+    """
+    Resample one stream onto a uniform clock of the given rate.
+    fs:     sample rate of x, estimated from its timestamps by default
+    return: timestamps and values (n, len(columns)), NaN inside gaps
+    """
+    values, missing = to_grid(x, columns)
+    fs = fs or sample_rate(x) or rate
+    ratio = Fraction(float(rate) / fs).limit_denominator(MAX_DENOMINATOR)
+    up, down = ratio.numerator, ratio.denominator
+    if up == down:
+        out = values.copy()
+    else:
+        out = signal.resample_poly(values, up, down, axis=0)
+
+    # an output sample is missing if a neighbouring input sample is
+    j = np.arange(len(out))
+    pos = j * down / float(up)
+    lo = np.minimum(np.floor(pos).astype(int), len(missing) - 1)
+    hi = np.minimum(lo + 1, len(missing) - 1)
+    out[missing[lo] | (missing[hi] & (pos > lo))] = np.nan
+
+    ts = x[0,0] + j * float(MSEC_PER_SEC) / rate
+    return ts, out
+
+def align(streams, rate):
+    """
+    Map streams onto one common clock
+    streams: list of (data, columns) or (data, columns, fs)
+    rate:    sample rate of the common clock
+    return:  (n, 1 + all columns) array of timestamp and values, NaN where
+             a stream has no data
+    """
+    parts = [resample_stream(s[0], rate, *s[1:]) for s in streams if len(s[0])]
+    if not parts:
+        return np.empty((0, 1))
+    step = float(MSEC_PER_SEC) / rate
+    t0 = min(ts[0] for ts, _ in parts)
+    t1 = max(ts[-1] for ts, _ in parts)
+    n = int(round((t1 - t0) / step)) + 1
+
+    out = np.empty((n, 1 + sum(v.shape[1] for _, v in parts)))
+    out.fill(np.nan)
+    out[:,0] = t0 + np.arange(n) * step
+    c = 1
+    for ts, v in parts:
+        i = int(round((ts[0] - t0) / step))
+        m = min(len(v), n - i)
+        out[i:i+m,c:c+v.shape[1]] = v[:m]
+        c += v.shape[1]
+    return out
@@ -0,0 +1,80 @@
+import glob
+import multiprocessing
+import os
+import sys
+
+from export import SIGNAL_NAMES
+
+# The file loop of the batch CLIs: batch.py, render.py, pulse.py and qrs.py. A
+# process function takes a (raw data file, options) job and returns a
+# (raw data file, result, seconds, error) tuple, error being the formatted
+# traceback if it failed, so one bad file does not stop the others.
+RAW_PATTERN = '*.csv'
+
+def is_output(path):
+    """ Whether path is an export or a png file of render.py """
+    base, ext = os.path.splitext(os.path.basename(path))
+    return ext == '.png' or any(base.endswith('_' + n) for n in SIGNAL_NAMES)
+
+def find_files(inputs, pattern=RAW_PATTERN):
+    """ Expand directories and glob patterns into a sorted list of raw data files """
+    files = set()
+    for i in inputs:
+        if os.path.isdir(i):
+            paths = glob.glob(os.path.join(i, pattern))
+        else:
+            paths = glob.glob(i)
+        files.update(p for p in paths if os.path.isfile(p) and not is_output(p))
+    return sorted(files)
+
+def select_files(options, is_up_to_date=None):
+    """ Return the raw data files to process and those skipped as up to date,
+    creating the output directory if needed
+    options:       inputs, pattern, output_dir and force as parse_args() returns
+    is_up_to_date: is_up_to_date(raw data file, options)
+    """
+    if options['output_dir'] and not os.path.exists(options['output_dir']):
+        os.makedirs(options['output_dir'])
+    files = find_files(options['inputs'], options['pattern'])
+    skipped = []
+    if is_up_to_date and not options.get('force'):
+        skipped = [f for f in files if is_up_to_date(f, options)]
+        files = sorted(set(files) - set(skipped))
+    return files, skipped
+
+def run(process, files, options, workers=1, describe=str):
+    """ Shard files over a worker pool, return the results of process() in
+    the order they finish. Workers are reused over files, so are loaded
+    modules, filter designs and figures.
+    describe: the line report() prints for a result without error
+    """
+    jobs = [(f, options) for f in files]
+    if workers > 1 and len(files) > 1:
+        pool = multiprocessing.Pool(min(workers, len(files)))
+        results = []
+        for r in pool.imap_unordered(process, jobs):
+            report(r, describe)
+            results.append(r)
+        pool.close()
+        pool.join()
+    else:
+        results = [report(process(j), describe) for j in jobs]
+    return results
+
+def report(result, describe=str):
+    raw_data_file, _, secs, error = result
+    if error:
+        print 'FAILED %s after %.2f s' % (raw_data_file, secs)
+    else:
+        print describe(result)
+    sys.stdout.flush()
+    return result
+
+def failed(results):
+    return [r for r in results if r[3]]
+
+def print_failures(results):
+    for raw_data_file, _, _, error in failed(results):
+        print '=' * 40
+        print raw_data_file
+        print error
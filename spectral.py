@@ -0,0 +1,141 @@
+import numpy as np
+from lazy import lazy_import
+
+signal = lazy_import('scipy.signal')
+
+NPERSEG = 1024
+OVERLAP = 0.5
+# frames transformed per rfft call, bounds the memory of long signals
+MAX_FRAMES = 1024
+
+_windows = {}
+
+def get_window(name, n):
+    """ Return a window function of n points, computed only once
+    The returned array is shared, do not modify it.
+    """
+    key = (name, n)
+    w = _windows.get(key)
+    if w is None:
+        w = _windows[key] = signal.get_window(name, n)
+    return w
+
+def frames(x, nperseg, step):
+    """ Return a (frames, nperseg) view of the overlapping frames of 1-D x """
+    n = (len(x) - nperseg) // step + 1
+    if n <= 0:
+        return np.empty((0, nperseg))
+    s = x.strides[0]
+    return np.lib.stride_tricks.as_strided(x, (n, nperseg), (step * s, s), writeable=False)
+
+def _density(power, fs, window):
+    """ Scale power of one-sided spectra to power spectral density (unit**2/Hz) """
+    psd = power / (fs * np.sum(np.square(window)))
+    # double all but DC and Nyquist
+    psd[...,1:psd.shape[-1] - 1 + len(window) % 2] *= 2
+    return psd
+
+class Stft(object):
+    """ Short-time Fourier transform over consecutive chunks of a signal.
+    Every call returns the spectra of the frames completed by the chunk, the
+    samples of an unfinished frame are kept for the next call.
+    fs:      sampling frequency
+    nperseg: samples per frame
+    overlap: fraction of a frame shared with the next one
+    detrend: subtract the mean of every frame
+    """
+    def __init__(self, fs, nperseg=NPERSEG, overlap=OVERLAP, window='hann', detrend=False):
+        self.fs = fs
+        self.nperseg = nperseg
+        self.step = max(int(nperseg * (1 - overlap)), 1)
+        self.window = get_window(window, nperseg)
+        self.detrend = detrend
+        self.freq = np.fft.rfftfreq(nperseg, 1. / fs)
+        self.buf = np.empty(0)
+        # sample number of buf[0]
+        self.offset = 0
+
+    def _batches(self, data):
+        """ Yield (start sample of each frame, spectra) MAX_FRAMES frames at a time """
+        x = np.concatenate((self.buf, np.asarray(data, dtype=float)))
+        f = frames(x, self.nperseg, self.step)
+        for i in xrange(0, len(f), MAX_FRAMES):
+            seg = f[i:i+MAX_FRAMES]
+            if self.detrend:
+                seg = seg - seg.mean(axis=1)[:,np.newaxis]
+            starts = self.offset + (i + np.arange(len(seg))) * self.step
+            yield starts, np.fft.rfft(seg * self.window, axis=1)
+        used = len(f) * self.step
+        self.buf = x[used:]
+        self.offset += used
+
+    def __call__(self, data):
+        """ data: 1-D samples
+        return: start sample of each frame, complex spectra (frames, bins)
+        """
+        batches = list(self._batches(data))
+        if not batches:
+            return np.empty(0, int), np.empty((0, len(self.freq)), complex)
+        starts, spectra = zip(*batches)
+        return np.concatenate(starts), np.concatenate(spectra)
+
+class Welch(Stft):
+    """ Welch power spectral density averaged over consecutive chunks,
+    the same as scipy.signal.welch() on the whole signal
+    """
+    def __init__(self, fs, nperseg=NPERSEG, overlap=OVERLAP, window='hann'):
+        Stft.__init__(self, fs, nperseg, overlap, window, detrend=True)
+        self.total = np.zeros(len(self.freq))
+        self.count = 0
+
+    def __call__(self, data):
+        for _, spectra in self._batches(data):
+            self.total += np.sum(np.square(np.abs(spectra)), axis=0)
+            self.count += len(spectra)
+
+    def result(self):
+        """ Return frequencies and power spectral density (unit**2/Hz) """
+        if not self.count:
+            # shorter than a frame, use what there is as one frame
+            if len(self.buf) < 2:
+                return self.freq, np.zeros(len(self.freq))
+            return welch(self.buf, self.fs, len(self.buf))
+        return self.freq, _density(self.total / self.count, self.fs, self.window)
+
+def welch(data, fs, nperseg=NPERSEG, overlap=OVERLAP, window='hann'):
+    """ Return frequencies and power spectral density of 1-D data """
+    w = Welch(fs, min(nperseg, len(data)), overlap, window)
+    w(data)
+    return w.result()
+
+def spectrogram(data, fs, nperseg=NPERSEG, overlap=OVERLAP, window='hann'):
+    """ Return frame center times (s), frequencies and power (frames, bins) """
+    s = Stft(fs, min(nperseg, len(data)), overlap, window, detrend=True)
+    starts, spectra = s(data)
+    times = (starts + s.nperseg / 2.) / fs
+    return times, s.freq, _density(np.square(np.abs(spectra)), fs, s.window)
+
+class WelchStage(object):
+    """ A pipeline stage passing chunks through unchanged while averaging
+    the power spectral density of some columns
+    out: called with the (frequency, psd of each column) array on flush()
+    """
+    def __init__(self, fs, columns=(2,), out=None, nperseg=NPERSEG, overlap=OVERLAP):
+        self.columns = list(columns)
+        self.out = out
+        self.welch = [Welch(fs, nperseg, overlap) for _ in columns]
+
+    def __call__(self, x):
+        for w, c in zip(self.welch, self.columns):
+            w(x[:,c])
+        return x
+
+    def result(self):
+        freq = self.welch[0].result()[0]
+        return np.column_stack([freq] + [w.result()[1] for w in self.welch])
+
+    def flush(self):
+        # nothing is written for a signal which never shows up
+        if self.out and (self.welch[0].count or len(self.welch[0].buf)):
+            self.out(self.result())
+        return np.empty((0, 0))
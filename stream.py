@@ -0,0 +1,78 @@
+import numpy as np
+
+from parser import iter_raw_blocks, split_block, interpolate_ts
+
+STREAM_BLOCK_SIZE = 1 << 20
+
+class TimestampStage(object):
+    """ Interpolate timestamps chunk by chunk.
+    The samples of the last second are held back until the next timestamp
+    shows up, or until flush() at the end of the stream.
+    """
+    def __init__(self):
+        self.pending = None
+        self.step = None
+
+    def __call__(self, x):
+        if self.pending is not None:
+            x = np.vstack((self.pending, x))
+        ts = x[:,0]
+        starts = np.flatnonzero(np.diff(ts)) + 1
+        if not starts.size:
+            self.pending = x
+            return x[:0]
+
+        cut = starts[-1]
+        prev = starts[-2] if starts.size > 1 else 0
+        self.step = (ts[cut] - ts[prev]) / (cut - prev)
+        self.pending = x[cut:]
+        done = x[:cut]
+        done[:,0] = interpolate_ts(ts[:cut + 1])[:cut]
+        return done
+
+    def flush(self):
+        x = self.pending
+        self.pending = None
+        if x is None:
+            return np.empty((0, 0))
+        x[:,0] = interpolate_ts(x[:,0], tail_step=self.step)
+        return x
+
+class Pipeline(object):
+    """ Run chunks through stages, then hand them to the sink, e.g. a
+    writer of export.open_writer()
+    """
+    def __init__(self, stages, sink):
+        self.stages = stages
+        self.sink = sink
+
+    def _run(self, x, stages):
+        for stage in stages:
+            if not len(x):
+                return
+            x = stage(x)
+        if len(x):
+            self.sink(x)
+
+    def feed(self, x):
+        self._run(x, self.stages)
+
+    def close(self):
+        # flushed rows still have to go through the following stages
+        for i, stage in enumerate(self.stages):
+            if hasattr(stage, 'flush'):
+                self._run(stage.flush(), self.stages[i+1:])
+        self.sink.close()
+
+def run_stream(file_obj, pipelines, block_size=STREAM_BLOCK_SIZE):
+    """
+    file_obj:  The file obj come from open() or io.BytesIO
+    pipelines: {type: Pipeline}, rows of other types are dropped
+    """
+    try:
+        for block in iter_raw_blocks(file_obj, block_size):
+            for t, data in split_block(block, pipelines.keys()).items():
+                pipelines[t].feed(data)
+    finally:
+        for p in pipelines.values():
+            p.close()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import hashlib
+import os
+import pickle
+import sys
+import time
+
+import main
+from cache import cache_path
+from export import output_names, read_columnar_trailer, EXPORT_FORMATS
+from parser import iter_text_blocks, tokenize_block, split_block, ReseqState
+from stream import STREAM_BLOCK_SIZE
+
+# The state of a raw data file being followed: the byte offset up to which
+# rows are processed, the stages of every pipeline with what they hold back
+# (timestamps of the last second, sequence counters, filter state) and the
+# size of every output at that point. It is saved after each pass, so the
+# next pass parses only the rows appended since.
+TAIL_VERSION = 2
+FOLLOW_INTERVAL = 5
+# outputs which are cut back to the last saved state before appending; a
+# col output is cut back to its row groups and gets its saved footer again
+TRUNCATE_FORMATS = ['csv', 'fastcsv', 'npy']
+
+def parse_args():
+    p = argparse.ArgumentParser(description='Process only the rows appended to a raw data file since the last run')
+    p.add_argument('--fft', help='Apply FFT bandpass filter', action='store_true')
+    p.add_argument('--causal', help='Use causal filters instead of block zero-phase ones', action='store_true')
+    p.add_argument('--format', default='csv', choices=sorted(f for f in EXPORT_FORMATS if f != 'npz'), \
+                   help='Export format')
+    p.add_argument('--precision', default=6, type=int, help='Digits after the decimal point for fastcsv')
+    p.add_argument('--chunk_size', default=STREAM_BLOCK_SIZE, type=int, help='Bytes of raw data per chunk')
+    p.add_argument('--output_dir', help='Write outputs here instead of the current directory')
+    p.add_argument('--follow', help='Keep checking the file for appended rows', action='store_true')
+    p.add_argument('--interval', default=FOLLOW_INTERVAL, type=float, help='Seconds between checks with --follow')
+    p.add_argument('--finish', help='The file is complete, flush the rows held back and drop the state', \
+                   action='store_true')
+    p.add_argument('--reset', help='Forget the saved state and start from the beginning', action='store_true')
+    p.add_argument('raw_data_file', help='Specify the raw data file')
+    args = p.parse_args()
+    if args.follow and args.finish:
+        p.error('--finish can not be used with --follow')
+    return vars(args)
+
+def state_path(raw_data_file, output_dir=None, fmt='csv', cache_dir=None):
+    """ One state per set of outputs, so a file can be tailed into several """
+    outputs = hashlib.sha1(os.path.abspath(output_dir or '.')).hexdigest()[:8]
+    return '%s.%s.%s.tail' % (os.path.splitext(cache_path(raw_data_file, cache_dir))[0], fmt, outputs)
+
+def new_state(options):
+    return {'version': TAIL_VERSION, 'options': options, 'offset': 0, 'stages': None, 'sizes': {}, 'trailers': {}}
+
+def load_state(path):
+    try:
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+    except (IOError, EOFError, pickle.UnpicklingError):
+        return None
+    return state if state.get('version') == TAIL_VERSION else None
+
+def save_state(path, state):
+    d = os.path.dirname(path)
+    if d and not os.path.exists(d):
+        os.makedirs(d)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+    os.rename(tmp, path)
+
+def restore_outputs(state, names):
+    """ Drop rows written after the state was saved, e.g. by an interrupted pass """
+    for n in names:
+        if not os.path.exists(n):
+            continue
+        if n not in state['sizes']:
+            os.remove(n)
+        elif state['options']['format'] == 'col':
+            # appending started by writing over the footer
+            trailer = state['trailers'][n]
+            with open(n, 'r+b') as f:
+                f.truncate(state['sizes'][n] - len(trailer))
+                f.seek(0, os.SEEK_END)
+                f.write(trailer)
+        elif os.path.getsize(n) > state['sizes'][n] and state['options']['format'] in TRUNCATE_FORMATS:
+            with open(n, 'r+b') as f:
+                f.truncate(state['sizes'][n])
+
+def process_new(raw_data_file, state, block_size=STREAM_BLOCK_SIZE, finish=False):
+    """ Run the rows appended since state['offset'] through the pipelines of
+    stream mode, appending to the outputs, and update state
+    return: the number of bytes processed
+    """
+    main.args["append"] = state['stages'] is not None
+    pipelines, _ = main.stream_pipelines()
+    if state['stages'] is not None:
+        for t, p in pipelines.items():
+            p.stages = state['stages'][t]
+
+    start = end = state['offset']
+    with open(raw_data_file, 'rb') as f:
+        f.seek(start)
+        # a line still being written is left for the next pass
+        for offset, text in iter_text_blocks(f, block_size, start, partial=False):
+            for t, data in split_block(tokenize_block(text), pipelines.keys()).items():
+                pipelines[t].feed(data)
+            end = offset + len(text)
+
+    for p in pipelines.values():
+        if finish:
+            p.close()
+        else:
+            # keep what the stages hold back for the next pass
+            p.sink.close()
+    state['offset'] = end
+    state['stages'] = dict((t, p.stages) for t, p in pipelines.items())
+    state['sizes'] = dict((p.sink.fname, os.path.getsize(p.sink.fname)) for p in pipelines.values()
+                          if os.path.exists(p.sink.fname) and (p.sink.out is not None or p.sink.fname in state['sizes']))
+    if state['options']['format'] == 'col':
+        state['trailers'] = dict((n, read_columnar_trailer(n)) for n in state['sizes'])
+    return end - start
+
+def print_gaps(state):
+    fnames = dict((h[0], h[1]) for h in main._stream_handlers)
+    for t, stages in sorted((state['stages'] or {}).items()):
+        for s in stages:
+            if isinstance(s, ReseqState):
+                main.print_gaps(main.args[fnames[t]], s)
+
+if __name__ == "__main__":
+    args = parse_args()
+    raw_data_file = args['raw_data_file']
+    main.args = dict(args, stream=True, psd=False, plot_type=None, annotation_file=None)
+    names = output_names(raw_data_file, args['output_dir'], args['format'])
+    main.args.update(names)
+    if args['output_dir'] and not os.path.exists(args['output_dir']):
+        os.makedirs(args['output_dir'])
+    # a saved state only goes with the same outputs and processing
+    options = dict((k, args[k]) for k in ['fft', 'causal', 'format', 'precision', 'output_dir'])
+
+    outputs = [names[h[1]] for h in main._stream_handlers] + [names['hr_out']]
+    path = state_path(raw_data_file, args['output_dir'], args['format'])
+    state = None if args['reset'] else load_state(path)
+    if state is not None and state['options'] != options:
+        print 'The options differ from those of the saved state, run with --reset to start over'
+        sys.exit(1)
+    if state is None:
+        state = new_state(options)
+    else:
+        restore_outputs(state, outputs)
+
+    try:
+        while True:
+            if os.path.getsize(raw_data_file) < state['offset']:
+                print '%s shrank, starting over' % raw_data_file
+                state = new_state(options)
+                # no size is saved for any output, so all of them go
+                restore_outputs(state, outputs)
+            n = process_new(raw_data_file, state, args['chunk_size'], args['finish'])
+            if args['finish']:
+                if os.path.exists(path):
+                    os.remove(path)
+            else:
+                save_state(path, state)
+            if n or not args['follow']:
+                print '%s: %d new bytes, offset %d' % (raw_data_file, n, state['offset'])
+                sys.stdout.flush()
+            if not args['follow']:
+                break
+            time.sleep(args['interval'])
+    except KeyboardInterrupt:
+        pass
+    print_gaps(state)
@@ -0,0 +1,36 @@
+# Raw data files of bench.generate shared by the tests, written once per
+# run into a temporary directory.
+
+import atexit
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from bench.generate import generate
+from cache import load_raw_file
+from parser import calc_ts, ReseqState, samples_per_row
+
+_dir = None
+_files = {}
+
+def tmp_dir():
+    global _dir
+    if _dir is None:
+        _dir = tempfile.mkdtemp()
+        atexit.register(shutil.rmtree, _dir, True)
+    return _dir
+
+def raw_file(seconds=120, seed=5):
+    """ Path of a generated raw data file of `seconds` """
+    key = (seconds, seed)
+    if key not in _files:
+        _files[key] = os.path.join(tmp_dir(), 'raw_%d_%d.csv' % key)
+        generate(_files[key], seconds / 3600., seed)
+    return _files[key]
+
+def prepared(t, seconds=120, seed=5):
+    """ Data of type t as main.py has it before filtering """
+    raw = load_raw_file(raw_file(seconds, seed), [t], use_cache=False)
+    return np.array(ReseqState(samples_per_row(t))(calc_ts(raw[t])))
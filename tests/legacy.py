@@ -0,0 +1,81 @@
+# The line by line parser and resequencing which main.py used before the
+# vectorized engine, kept as the reference the tests compare against.
+
+from parser import convert_ppg_to_mv, convert_ecg_to_mv, MSEC_PER_SEC
+
+def parse_raw_acc(x, data):
+    nums = map(int, x.split(','))
+    ts_ms = nums[15] * MSEC_PER_SEC
+    seq = nums[1]
+    for i in [2, 6, 10]:
+        data.append([ts_ms, seq] + nums[i:i+3])
+
+def parse_raw_hr_signals(x, index, fn, data):
+    items = x.split(',')
+    ts_ms = int(items[15]) * MSEC_PER_SEC
+    seq = int(items[1])
+    values = [fn(int(items[n])) for n in index]
+    for v in values:
+        data.append([ts_ms, seq, v])
+
+def parse_raw_hr(x, data):
+    nums = map(int, x.split(','))
+    data.append([nums[2], nums[3] & 0xff, nums[4], nums[15]])
+
+_parsers = {
+        0:  parse_raw_acc,
+        5:  lambda x, data: parse_raw_hr_signals(x, range(2, 14), convert_ecg_to_mv, data),
+        9:  lambda x, data: parse_raw_hr_signals(x, range(2, 13, 2), convert_ppg_to_mv, data),
+        12: lambda x, data: parse_raw_hr_signals(x, range(2, 14), convert_ppg_to_mv, data),
+        22: parse_raw_hr,
+        }
+
+def parse_lines(lines):
+    """ Return {type: list of rows}, dropping unknown types and lines which
+    are not 16 integers
+    """
+    data = {}
+    for l in lines:
+        l = l.rstrip('\r\n')
+        items = l.split(',')
+        if len(items) != 16:
+            continue
+        try:
+            t = int(items[0])
+            if t not in _parsers:
+                continue
+            rows = []
+            _parsers[t](l, rows)
+        except ValueError:
+            continue
+        data.setdefault(t, []).extend(rows)
+    return data
+
+def calc_ts(x):
+    base_ms = 0
+    data = []
+    buf = []
+    for l in x:
+        new_ms = l[0]
+        if base_ms == 0:
+            base_ms = new_ms
+        elif base_ms != new_ms:
+            fraction = float(new_ms - base_ms) / len(buf)
+            for i in range(0, len(buf)):
+                buf[i][0] = base_ms + (fraction * i)
+                data.append(buf[i])
+            base_ms = new_ms
+            buf = []
+        buf.append(l)
+    return data
+
+def reseq(x, new_seq, orig_seq, step):
+    if new_seq == None:
+        new_seq = 0
+        orig_seq = x[0][1]
+    for d in x:
+        if (d[1] - orig_seq) > 1:
+            new_seq += (d[1] - orig_seq - 1) * step
+        orig_seq = d[1]
+        d[1] = new_seq = new_seq + 1
+    return x, orig_seq, new_seq
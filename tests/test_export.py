@@ -0,0 +1,114 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from export import open_writer, export, read_columnar, ColumnarWriter, NpyWriter, COLUMN_NAMES
+from parser import TYPE_ECG, TYPE_ACC
+from tests.generated import prepared
+
+def write_chunks(fname, fmt, x, names, parts=3, **kwargs):
+    """ Write x over several writers, each appending to what the last one closed """
+    for i, part in enumerate(np.array_split(x, parts)):
+        w = open_writer(fname, fmt, names, append=i > 0, **kwargs)
+        for chunk in np.array_split(part, 4):
+            w(chunk)
+        w.close()
+
+class ExportTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.ecg = prepared(TYPE_ECG, 60)
+        cls.acc = prepared(TYPE_ACC, 60)
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def path(self, name):
+        return os.path.join(self.tmp, name)
+
+    def test_csv_append(self):
+        fname = self.path('ecg.csv')
+        write_chunks(fname, 'csv', self.ecg, COLUMN_NAMES[TYPE_ECG], header='timestamp,seq,mv')
+        np.testing.assert_array_equal(np.loadtxt(fname, delimiter=',', skiprows=1), self.ecg)
+
+    def test_fastcsv_append(self):
+        fname = self.path('acc.csv')
+        write_chunks(fname, 'fastcsv', self.acc, COLUMN_NAMES[TYPE_ACC], precision=3)
+        np.testing.assert_allclose(np.loadtxt(fname, delimiter=','), self.acc, atol=5e-4)
+
+    def test_npy_append(self):
+        fname = self.path('ecg.npy')
+        write_chunks(fname, 'npy', self.ecg, COLUMN_NAMES[TYPE_ECG])
+        np.testing.assert_array_equal(np.load(fname, mmap_mode='r'), self.ecg)
+
+    def test_npy_reopen_drops_unclosed_rows(self):
+        fname = self.path('ecg.npy')
+        w = NpyWriter(fname)
+        w(self.ecg[:1000])
+        w.close()
+        # rows written by a writer which never closed are not in the header
+        w = NpyWriter(fname, append=True)
+        w(self.ecg[1000:2000])
+        w.out.close()
+        w = NpyWriter(fname, append=True)
+        w(self.ecg[1000:3000])
+        w.close()
+        np.testing.assert_array_equal(np.load(fname), self.ecg[:3000])
+
+    def test_npz(self):
+        fname = self.path('acc.npz')
+        export(fname, self.acc, 'npz', COLUMN_NAMES[TYPE_ACC])
+        z = np.load(fname)
+        for i, n in enumerate(COLUMN_NAMES[TYPE_ACC]):
+            np.testing.assert_array_equal(z[n], self.acc[:,i])
+
+    def test_col_append(self):
+        fname = self.path('acc.col')
+        names = COLUMN_NAMES[TYPE_ACC]
+        for i, part in enumerate(np.array_split(self.acc, 3)):
+            # small row groups, so groups are split over chunks and writers
+            w = ColumnarWriter(fname, names, group_rows=1000, append=i > 0)
+            for chunk in np.array_split(part, 4):
+                w(chunk)
+            w.close()
+        data = read_columnar(fname)
+        for i, n in enumerate(names):
+            np.testing.assert_array_equal(data[n], self.acc[:,i])
+        np.testing.assert_array_equal(read_columnar(fname, ['z'])['z'], self.acc[:,4])
+
+    def test_col_reopen_other_columns(self):
+        fname = self.path('ecg.col')
+        export(fname, self.ecg, 'col', COLUMN_NAMES[TYPE_ECG])
+        w = ColumnarWriter(fname, ['timestamp', 'mv'], append=True)
+        self.assertRaises(ValueError, w, self.ecg[:,[0,2]])
+
+    def test_col_empty(self):
+        fname = self.path('empty.col')
+        export(fname, np.empty((0, 2)), 'col', ['a', 'b'])
+        data = read_columnar(fname)
+        self.assertEqual(sorted(data), ['a', 'b'])
+        self.assertEqual(data['a'].shape, (0,))
+        self.assertEqual(data['a'].dtype, np.float64)
+
+    def test_integer(self):
+        x = np.arange(30, dtype=np.int64).reshape(-1, 3) * 1000003
+        for fmt in ['csv', 'fastcsv', 'npy', 'col']:
+            fname = self.path('int.' + fmt)
+            write_chunks(fname, fmt, x, ['a', 'b', 'c'], integer=True)
+            if fmt == 'col':
+                y = np.column_stack([read_columnar(fname)[n] for n in 'abc'])
+            elif fmt == 'npy':
+                y = np.load(fname)
+            else:
+                y = np.loadtxt(fname, delimiter=',', dtype=np.int64)
+            np.testing.assert_array_equal(y, x)
+
+if __name__ == '__main__':
+    unittest.main()
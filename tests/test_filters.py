@@ -0,0 +1,57 @@
+import unittest
+
+import numpy as np
+from scipy import signal
+
+from filters import ecg_chain, butter_sos, stream_filter, acc_bp_stream, impulse_length
+from filters import ACC_FS, HIGH_PASS_CUTOFF, LOW_PASS_CUTOFF
+from parser import TYPE_ACC, TYPE_ECG
+from tests.generated import prepared
+
+def run_chunks(stage, x, sizes):
+    """ Feed x in chunks of the given sizes, cycling, and flush """
+    out = []
+    i = 0
+    while i < len(x):
+        n = sizes[len(out) % len(sizes)]
+        out.append(stage(x[i:i+n].copy()))
+        i += n
+    out.append(stage.flush())
+    return np.vstack([o for o in out if o.size])
+
+class StreamFilterTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.ecg = prepared(TYPE_ECG)
+        cls.acc = prepared(TYPE_ACC)
+
+    def test_causal_chunks(self):
+        sos = ecg_chain()
+        out = run_chunks(stream_filter(sos), self.ecg, [1000, 37, 5000])
+        zi = signal.sosfilt_zi(sos) * self.ecg[0,2]
+        expected, _ = signal.sosfilt(sos, self.ecg[:,2], zi=zi)
+        np.testing.assert_array_equal(out[:,:2], self.ecg[:,:2])
+        np.testing.assert_allclose(out[:,2], expected, rtol=1e-9, atol=1e-9)
+
+    def test_block_filtfilt(self):
+        sos = ecg_chain()
+        out = run_chunks(stream_filter(sos, zero_phase=True), self.ecg, [1000, 37, 5000])
+        expected = signal.sosfiltfilt(sos, self.ecg[:,2])
+        self.assertEqual(len(out), len(self.ecg))
+        np.testing.assert_array_equal(out[:,:2], self.ecg[:,:2])
+        # the edges of the whole signal are padded by sosfiltfilt
+        n = impulse_length(sos)
+        tol = 1e-5 * np.ptp(expected)
+        np.testing.assert_allclose(out[n:-n,2], expected[n:-n], atol=tol)
+
+    def test_block_filtfilt_columns(self):
+        out = run_chunks(acc_bp_stream(zero_phase=True), self.acc, [999, 4096])
+        sos = butter_sos(ACC_FS, HIGH_PASS_CUTOFF, LOW_PASS_CUTOFF)
+        expected = signal.sosfiltfilt(sos, self.acc[:,2:], axis=0)
+        n = impulse_length(sos)
+        tol = 1e-5 * np.ptp(expected, axis=0)
+        self.assertTrue(np.all(np.abs(out[n:-n,2:] - expected[n:-n]) <= tol))
+
+if __name__ == '__main__':
+    unittest.main()
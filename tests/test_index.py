@@ -0,0 +1,59 @@
+import unittest
+
+import numpy as np
+
+from cache import load_raw_file
+from index import load_index, build_index, read_samples, read_time_range
+from parser import calc_ts, RAW_TYPES, TYPE_ECG, TYPE_ACC, TYPE_HR, MSEC_PER_SEC
+from tests.generated import raw_file
+
+class IndexTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.raw_file = raw_file()
+        cls.raw = load_raw_file(cls.raw_file, use_cache=False)
+        cls.index = load_index(cls.raw_file, use_cache=False)
+
+    def windows(self, n):
+        # the start, the middle, a single sample and inside the final second
+        return [(0, 100), (n / 3, n / 3 + 5000), (n / 2, n / 2 + 1), (max(n - 150, 0), n), (n - 1, n), (0, n)]
+
+    def test_read_samples(self):
+        for t in RAW_TYPES:
+            whole = self.raw[t]
+            for start, stop in self.windows(len(whole)):
+                np.testing.assert_array_equal(read_samples(self.raw_file, t, start, stop, self.index),
+                                              whole[start:stop])
+
+    def test_read_samples_interpolated(self):
+        for t in [TYPE_ECG, TYPE_ACC]:
+            whole = calc_ts(self.raw[t])
+            for start, stop in self.windows(len(whole)):
+                np.testing.assert_array_equal(read_samples(self.raw_file, t, start, stop, self.index, True),
+                                              whole[start:stop])
+
+    def test_read_time_range(self):
+        whole = calc_ts(self.raw[TYPE_ECG])
+        ts = whole[:,0]
+        for start_ms, end_ms in [(ts[0], ts[0] + 1500), (ts[1000] + 0.5, ts[9000]), (ts[-150], ts[-1] + 1)]:
+            expected = whole[(ts >= start_ms) & (ts < end_ms)]
+            np.testing.assert_array_equal(read_time_range(self.raw_file, TYPE_ECG, start_ms, end_ms,
+                                                          self.index, True), expected)
+
+    def test_read_time_range_hr(self):
+        hr = self.raw[TYPE_HR]
+        start_ms, end_ms = hr[10,3] * MSEC_PER_SEC, hr[20,3] * MSEC_PER_SEC
+        expected = hr[(hr[:,3] * MSEC_PER_SEC >= start_ms) & (hr[:,3] * MSEC_PER_SEC < end_ms)]
+        self.assertEqual(len(expected), 10)
+        np.testing.assert_array_equal(read_time_range(self.raw_file, TYPE_HR, start_ms, end_ms, self.index),
+                                      expected)
+
+    def test_small_blocks(self):
+        index = build_index(self.raw_file, block_size=4093)
+        for t in RAW_TYPES:
+            for a, b in zip(index[t], self.index[t]):
+                np.testing.assert_array_equal(a, b)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from ledger import Ledger, PENDING, FETCHED, RENDERED, DONE, FAILED, MAX_ATTEMPTS
+
+def f(file_id, revision='r1', name=None):
+    return {'id': file_id, 'name': name or file_id + '.csv', 'revision': revision}
+
+class LedgerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.ledger = Ledger(os.path.join(self.tmp, 'ledger.sqlite'))
+        self.png = os.path.join(self.tmp, 'a.png')
+        open(self.png, 'w').close()
+
+    def tearDown(self):
+        self.ledger.close()
+        shutil.rmtree(self.tmp)
+
+    def ids(self, files):
+        return [x['id'] for x in files]
+
+    def test_add(self):
+        self.assertEqual(self.ids(self.ledger.add([f('a'), f('b')])), ['a', 'b'])
+        self.assertEqual(self.ledger.get('a')['state'], PENDING)
+        # the same revision again is dropped
+        self.assertEqual(self.ledger.add([f('a')]), [])
+        # of repeated changes in one poll, the last wins
+        new = self.ledger.add([f('b', 'r2'), f('c'), f('b', 'r3')])
+        self.assertEqual([(x['id'], x['revision']) for x in new], [('c', 'r1'), ('b', 'r3')])
+        self.assertEqual(self.ledger.get('b')['revision'], 'r3')
+
+    def test_new_revision(self):
+        self.ledger.add([f('a'), f('b')])
+        self.ledger.update('a', DONE, content_hash='h1', png=self.png)
+        self.ledger.update('b', FETCHED, content_hash='h2')
+        self.ledger.failed('b', 'boom')
+        self.ledger.add([f('a', 'r2'), f('b', 'r2')])
+        a, b = self.ledger.get('a'), self.ledger.get('b')
+        self.assertEqual((a['state'], a['revision'], a['content_hash']), (PENDING, 'r2', 'h1'))
+        # a revision which was not done keeps no hash, attempts start over
+        self.assertEqual((b['state'], b['content_hash'], b['attempts'], b['error']), (PENDING, None, 0, None))
+
+    def test_update(self):
+        self.ledger.add([f('a')])
+        self.ledger.update('a', FETCHED, content_hash='h1')
+        self.ledger.update('a', RENDERED, png=self.png)
+        row = self.ledger.get('a')
+        self.assertEqual((row['state'], row['content_hash'], row['png']), (RENDERED, 'h1', self.png))
+
+    def test_unfinished(self):
+        self.ledger.add([f('a'), f('b'), f('c'), f('d')])
+        self.ledger.update('a', DONE)
+        self.ledger.update('b', RENDERED)
+        # apart, so the order of updates is told by their time
+        time.sleep(0.01)
+        for _ in range(MAX_ATTEMPTS):
+            self.ledger.failed('d', 'boom')
+        self.ledger.failed('c', 'boom')
+        self.assertEqual(self.ledger.get('c')['attempts'], 1)
+        self.assertEqual(self.ledger.get('c')['state'], FAILED)
+        # in the order they were last updated, d has failed too often
+        self.assertEqual(self.ids(self.ledger.unfinished()), ['b', 'c'])
+        self.assertEqual(self.ledger.unfinished()[0], f('b'))
+
+    def test_done_png(self):
+        self.ledger.add([f('a'), f('b')])
+        self.ledger.update('a', FETCHED, content_hash='h1')
+        self.ledger.update('a', RENDERED, png=self.png)
+        self.assertFalse(self.ledger.done_png('a', 'h1', self.png))
+        self.ledger.failed('a', 'upload failed')
+        self.assertFalse(self.ledger.done_png('a', 'h1', self.png))
+        self.ledger.update('a', DONE)
+        self.assertTrue(self.ledger.done_png('a', 'h1', self.png))
+        self.assertFalse(self.ledger.done_png('a', 'h2', self.png))
+        self.assertFalse(self.ledger.done_png('a', 'h1', os.path.join(self.tmp, 'b.png')))
+        # another file of the same content and png name
+        self.assertTrue(self.ledger.done_png('b', 'h1', self.png))
+        os.remove(self.png)
+        self.assertFalse(self.ledger.done_png('a', 'h1', self.png))
+
+    def test_reopen(self):
+        self.ledger.add([f('a')])
+        self.ledger.update('a', FETCHED, content_hash='h1')
+        self.ledger.close()
+        self.ledger = Ledger(os.path.join(self.tmp, 'ledger.sqlite'))
+        self.assertEqual(self.ledger.get('a')['state'], FETCHED)
+        self.assertEqual(self.ids(self.ledger.unfinished()), ['a'])
+
+if __name__ == '__main__':
+    unittest.main()
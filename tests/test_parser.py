@@ -0,0 +1,90 @@
+import copy
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from bench.generate import generate
+from parser import parse_raw_file, calc_ts, ReseqState, samples_per_row, RAW_TYPES, TYPE_HR
+from tests import legacy
+
+# corrupt lines a partly written or damaged file may have
+BAD_LINES = ['5,20001,1,2,3,4,5,6,7,8,9,10,11,12,13\n',
+             '5,x,1,2,3,4,5,6,7,8,9,10,11,12,13,1519268240\n',
+             '9,99001,1,2,3,4,5,6,7,8,9,10,11,12,13,\n',
+             '42,1,1,2,3,4,5,6,7,8,9,10,11,12,13,1519268240\n',
+             '\n']
+
+class ParserTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.mkdtemp()
+        raw_file = os.path.join(cls.tmp, 'raw.csv')
+        generate(raw_file, 60 / 3600., seed=7)
+        with open(raw_file) as f:
+            lines = f.readlines()
+        # scatter corrupt lines over the file
+        for i, l in enumerate(BAD_LINES):
+            lines.insert((i + 1) * len(lines) / (len(BAD_LINES) + 1), l)
+        cls.text = ''.join(lines)
+        cls.legacy = legacy.parse_lines(lines)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp)
+
+    def parse(self, block_size=1 << 24):
+        return parse_raw_file(io.BytesIO(self.text), block_size=block_size)
+
+    def test_parse_raw_file(self):
+        data = self.parse()
+        self.assertEqual(sorted(data), sorted(self.legacy))
+        for t in RAW_TYPES:
+            np.testing.assert_allclose(data[t], np.array(self.legacy[t], dtype=float), rtol=1e-12)
+
+    def test_small_blocks(self):
+        # blocks ending in the middle of a line
+        whole = self.parse()
+        data = self.parse(block_size=4093)
+        for t in RAW_TYPES:
+            np.testing.assert_array_equal(data[t], whole[t])
+
+    def test_short_and_long_line(self):
+        # 15 and 17 fields make up the tokens of two rows between them
+        lines = self.text.splitlines(True)[:200]
+        lines[100:100] = ['5,20001,1,2,3,4,5,6,7,8,9,10,11,12,9\n',
+                          '9,99001,1,2,3,4,5,6,7,8,9,10,11,12,13,1519268240,7\n']
+        data = parse_raw_file(io.BytesIO(''.join(lines)))
+        expected = legacy.parse_lines(lines)
+        self.assertEqual(sorted(data), sorted(expected))
+        for t in expected:
+            np.testing.assert_allclose(data[t], np.array(expected[t], dtype=float), rtol=1e-12)
+
+    def test_calc_ts(self):
+        data = self.parse()
+        for t in RAW_TYPES:
+            if t == TYPE_HR:
+                continue
+            expected = legacy.calc_ts(copy.deepcopy(self.legacy[t]))
+            # the legacy routine leaves the samples of the last second out
+            np.testing.assert_allclose(calc_ts(data[t])[:len(expected)], expected, rtol=1e-12)
+
+    def test_reseq(self):
+        data = self.parse()
+        for t in RAW_TYPES:
+            if t == TYPE_HR:
+                continue
+            x = calc_ts(data[t])
+            expected, _, _ = legacy.reseq(x.tolist(), None, None, samples_per_row(t))
+            state = ReseqState(samples_per_row(t))
+            # carried over chunks as the stream mode does
+            out = np.vstack([state(x[i:i+1000]) for i in xrange(0, len(x), 1000)])
+            np.testing.assert_array_equal(out, np.array(expected))
+            self.assertTrue(state.summary().count > 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from bench.generate import beat_times, ppg_mv
+from export import output_names
+from parser import TYPE_PPG125, TYPE_PPG512
+from pulse import find_pulse_peaks, pulse_rate, disagreement, describe, process_file, PPG_FS, PULSE_NAMES
+from pulse import REFRACTORY_SECONDS
+from qrs import detect_r_peaks
+from tests.generated import raw_file
+
+SECONDS = 120
+# the systolic peak of the generator follows the R peak by this much
+DELAY = 0.3
+
+def options(output_dir, t=None):
+    return {'no_cache': True, 'type': t, 'window': 60, 'disagree': 10, 'output_dir': output_dir,
+            'format': 'csv', 'precision': 6}
+
+class PulseTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        rng = np.random.RandomState(3)
+        beats = beat_times(SECONDS, rng)
+        cls.beats = beats[beats < SECONDS]
+        cls.mv = dict((t, ppg_mv(np.arange(SECONDS * fs) / float(fs), cls.beats, rng)) for t, fs in PPG_FS.items())
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_pulses_after_beats(self):
+        for t, fs in PPG_FS.items():
+            p = find_pulse_peaks(self.mv[t], fs)
+            self.assertEqual(len(p), len(self.beats))
+            np.testing.assert_allclose(p / float(fs), self.beats + DELAY, atol=0.01)
+
+    def test_segments(self):
+        for t, fs in PPG_FS.items():
+            whole = find_pulse_peaks(self.mv[t], fs)
+            segments = detect_r_peaks(self.mv[t], fs, 10, find=find_pulse_peaks, refractory=REFRACTORY_SECONDS)
+            np.testing.assert_array_equal(segments, whole)
+
+    def test_short(self):
+        fs = PPG_FS[TYPE_PPG125]
+        self.assertEqual(len(find_pulse_peaks(self.mv[TYPE_PPG125][:2 * int(REFRACTORY_SECONDS * fs)], fs)), 0)
+        windows = pulse_rate(np.empty((0, 4)))
+        self.assertEqual(windows.shape, (0, len(PULSE_NAMES)))
+        self.assertEqual(disagreement(windows)[:2], [0, 0])
+
+    def test_process_file(self):
+        fname = os.path.join(self.tmp, 'a.csv')
+        shutil.copy(raw_file(SECONDS), fname)
+        for t in [None, TYPE_PPG125]:
+            f, row, secs, error = process_file((fname, options(self.tmp, t)))
+            self.assertIsNone(error)
+            # 512 Hz if the file has it
+            self.assertEqual(row[1], t or TYPE_PPG512)
+            self.assertTrue(abs(row[2] - SECONDS / 0.85) < 5)
+            # windows, compared windows, |difference|, disagree %
+            self.assertEqual(row[3:5], [3, 3])
+            self.assertTrue(row[5] < 2)
+            self.assertEqual(row[6], 0)
+            windows = np.loadtxt(output_names(fname, self.tmp)['pulse_out'], delimiter=',')
+            np.testing.assert_allclose(np.abs(windows[:,6]).mean(), row[5])
+
+    def test_describe(self):
+        row = ['a.csv', TYPE_PPG512, 70, 5, 4, 1.5, 25., 50.]
+        self.assertEqual(describe(('a.csv', row, 0.5, None)), 'a.csv: 70 pulses, 5 windows, 4 compared, '
+                         '|difference| 1.5 bpm, 25.0% disagree, 50.0% dropped, 0.50 s')
+
+    def test_no_ppg(self):
+        fname = os.path.join(self.tmp, 'a.csv')
+        with open(fname, 'w') as out:
+            out.write('22,1,70,256,0,0,0,0,0,0,0,0,0,0,0,1519268239\n')
+        f, row, _, error = process_file((fname, options(self.tmp)))
+        self.assertIsNone(row)
+        self.assertIn('no PPG data', error)
+
+if __name__ == '__main__':
+    unittest.main()
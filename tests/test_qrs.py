@@ -0,0 +1,91 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from bench.generate import beat_times, ecg_mv
+from cache import load_raw_file
+from export import output_names
+from filters import ECG_FS
+from hr import hr_rows
+from parser import TYPE_ECG, TYPE_HR
+from qrs import find_r_peaks, detect_r_peaks, r_peaks, rr_intervals, hrv, process_job, REFRACTORY_SECONDS
+from tests.generated import raw_file, prepared
+
+SECONDS = 120
+
+def options(output_dir):
+    return {'no_cache': True, 'segment_seconds': 30, 'window': 60, 'output_dir': output_dir,
+            'format': 'csv', 'precision': 6}
+
+class QrsTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        rng = np.random.RandomState(3)
+        beats = beat_times(SECONDS, rng)
+        cls.beats = beats[beats < SECONDS]
+        cls.mv = ecg_mv(np.arange(SECONDS * ECG_FS) / float(ECG_FS), cls.beats, rng)
+        cls.ecg = prepared(TYPE_ECG, SECONDS)
+
+    def test_r_peaks_at_beats(self):
+        r = find_r_peaks(self.mv)
+        self.assertEqual(len(r), len(self.beats))
+        np.testing.assert_allclose(r / float(ECG_FS), self.beats, atol=0.03)
+
+    def test_segments(self):
+        whole = find_r_peaks(self.mv)
+        # boundaries every 10 s cut through beats
+        np.testing.assert_array_equal(detect_r_peaks(self.mv, segment_seconds=10), whole)
+        pool = multiprocessing.Pool(2)
+        try:
+            np.testing.assert_array_equal(detect_r_peaks(self.mv, segment_seconds=10, pool=pool), whole)
+        finally:
+            pool.close()
+            pool.join()
+
+    def test_short(self):
+        self.assertEqual(len(find_r_peaks(self.mv[:2 * int(REFRACTORY_SECONDS * ECG_FS)])), 0)
+        self.assertEqual(len(detect_r_peaks(self.mv[:0])), 0)
+        ts, contiguous = r_peaks(self.ecg[:0])
+        self.assertEqual((len(ts), len(contiguous)), (0, 0))
+        self.assertEqual(hrv(rr_intervals(ts, contiguous)).shape, (0, 7))
+
+    def test_hr_against_device(self):
+        ts, contiguous = r_peaks(self.ecg, segment_seconds=30)
+        # the generator beats about every 0.85 s
+        self.assertTrue(abs(len(ts) - SECONDS / 0.85) < 5)
+        # an interval over a sequence gap is not contiguous
+        self.assertFalse(contiguous.all())
+        rr = rr_intervals(ts, contiguous)
+        self.assertTrue(rr[:,3].sum() > 0.9 * len(rr))
+        device = hr_rows(load_raw_file(raw_file(SECONDS), [TYPE_HR], use_cache=False)[TYPE_HR])
+        windows = hrv(rr, 60, device)
+        self.assertEqual(len(windows), 3)
+        self.assertEqual(windows[:,1].sum(), rr[:,3].sum())
+        np.testing.assert_allclose(windows[:,2], windows[:,6], atol=2)
+
+    def test_process_job(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            fname = os.path.join(tmp, 'a.csv')
+            shutil.copy(raw_file(SECONDS), fname)
+            f, (beats, rr, windows), _, error = process_job((fname, options(tmp)))
+            self.assertIsNone(error)
+            names = output_names(fname, tmp)
+            np.testing.assert_allclose(np.loadtxt(names['rr_out'], delimiter=','), rr)
+            self.assertEqual(np.loadtxt(names['hrv_out'], delimiter=',').shape, windows.shape)
+            # a file without ECG fails alone
+            with open(fname, 'w') as out:
+                out.write('22,1,70,256,0,0,0,0,0,0,0,0,0,0,0,1519268239\n')
+            f, result, _, error = process_job((fname, options(tmp)))
+            self.assertIsNone(result)
+            self.assertIn('no ECG data', error)
+        finally:
+            shutil.rmtree(tmp)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+
+import numpy as np
+from scipy import signal
+
+from filters import ECG_FS, ACC_FS
+from parser import TYPE_ACC, TYPE_ECG
+from spectral import welch, spectrogram, Welch, WelchStage, NPERSEG
+from tests.generated import prepared
+
+class SpectralTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.ecg = prepared(TYPE_ECG)
+        cls.acc = prepared(TYPE_ACC)
+
+    def assert_psd(self, actual, expected):
+        np.testing.assert_allclose(actual, expected, rtol=1e-9, atol=1e-12 * expected.max())
+
+    def test_welch(self):
+        for nperseg in [NPERSEG, 256, 1000]:
+            f, p = welch(self.ecg[:,2], ECG_FS, nperseg)
+            ef, ep = signal.welch(self.ecg[:,2], ECG_FS, nperseg=nperseg)
+            np.testing.assert_allclose(f, ef)
+            self.assert_psd(p, ep)
+
+    def test_welch_chunks(self):
+        w = Welch(ECG_FS)
+        for chunk in np.array_split(self.ecg[:,2], 97):
+            w(chunk)
+        f, p = w.result()
+        self.assert_psd(p, signal.welch(self.ecg[:,2], ECG_FS, nperseg=NPERSEG)[1])
+
+    def test_shorter_than_a_frame(self):
+        x = self.ecg[:300,2]
+        f, p = welch(x, ECG_FS)
+        ef, ep = signal.welch(x, ECG_FS, nperseg=len(x))
+        np.testing.assert_allclose(f, ef)
+        self.assert_psd(p, ep)
+
+    def test_welch_stage(self):
+        out = []
+        stage = WelchStage(ACC_FS, (2, 3, 4), out.append, nperseg=256)
+        for chunk in np.array_split(self.acc, 13):
+            np.testing.assert_array_equal(stage(chunk), chunk)
+        stage.flush()
+        f, p = signal.welch(self.acc[:,2:], ACC_FS, nperseg=256, axis=0)
+        self.assertEqual(len(out), 1)
+        np.testing.assert_allclose(out[0][:,0], f)
+        for i in range(3):
+            self.assert_psd(out[0][:,i+1], p[:,i])
+
+    def test_spectrogram(self):
+        t, f, p = spectrogram(self.ecg[:,2], ECG_FS, 512)
+        ef, et, ep = signal.spectrogram(self.ecg[:,2], ECG_FS, window='hann', nperseg=512, noverlap=256)
+        np.testing.assert_allclose(t, et)
+        np.testing.assert_allclose(f, ef)
+        self.assert_psd(p, ep.T)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+import glob
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+from export import read_columnar
+from tail import state_path
+from tests.generated import raw_file
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+OPTIONS = ['--fft', '--causal']
+
+def run(script, args, cwd):
+    return subprocess.check_output([sys.executable, os.path.join(ROOT, script)] + args, cwd=cwd,
+                                   stderr=subprocess.STDOUT, env=dict(os.environ, MPLBACKEND='Agg'))
+
+def load(fname):
+    if fname.endswith('.col'):
+        return read_columnar(fname)
+    with open(fname, 'rb') as f:
+        return f.read()
+
+class TailTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.raw = raw_file(60)
+        with open(cls.raw, 'rb') as f:
+            cls.text = f.read()
+        cls.full = tempfile.mkdtemp()
+        shutil.copy(cls.raw, os.path.join(cls.full, 'a.csv'))
+        for fmt in ['csv', 'col']:
+            run('main.py', ['--stream', '--export', '--no_cache', '--format', fmt] + OPTIONS + ['a.csv'], cls.full)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.full)
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.fname = os.path.join(self.tmp, 'a.csv')
+        open(self.fname, 'wb').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def append(self, n):
+        """ Grow the raw data file to the first n bytes, cut mid-line """
+        with open(self.fname, 'ab') as f:
+            f.write(self.text[os.path.getsize(self.fname):n])
+
+    def tail(self, fmt, output_dir='out', finish=False):
+        args = ['--format', fmt, '--output_dir', output_dir] + OPTIONS + (['--finish'] if finish else [])
+        run('tail.py', args + ['a.csv'], self.tmp)
+
+    def assertOutputs(self, fmt, output_dir='out'):
+        full = sorted(glob.glob(os.path.join(self.full, 'a_*.' + fmt)))
+        self.assertEqual(len(full), 5)
+        for n in full:
+            a = load(n)
+            b = load(os.path.join(self.tmp, output_dir, os.path.basename(n)))
+            if fmt == 'col':
+                self.assertEqual(sorted(a), sorted(b))
+                for k in a:
+                    np.testing.assert_array_equal(a[k], b[k])
+            else:
+                self.assertEqual(a, b, n)
+
+    def interrupted(self, fmt):
+        cuts = [len(self.text) * i // 5 + 17 for i in range(1, 5)]
+        for i, n in enumerate(cuts):
+            self.append(n)
+            if i == 2:
+                # a pass whose outputs are written but whose state is lost
+                path = state_path(self.fname, os.path.join(self.tmp, 'out'), fmt)
+                shutil.copy(path, path + '.saved')
+                self.tail(fmt)
+                os.rename(path + '.saved', path)
+            self.tail(fmt)
+        self.append(len(self.text))
+        self.tail(fmt, finish=True)
+        self.assertOutputs(fmt)
+
+    def test_interrupted_csv(self):
+        self.interrupted('csv')
+
+    def test_interrupted_col(self):
+        self.interrupted('col')
+
+    def test_two_outputs(self):
+        for n in [len(self.text) // 3, len(self.text) * 2 // 3 + 5]:
+            self.append(n)
+            self.tail('csv', 'out')
+            self.tail('col', 'out2')
+        self.assertEqual(len(glob.glob(os.path.join(self.tmp, '.npcache', '*.tail'))), 2)
+        self.append(len(self.text))
+        self.tail('csv', 'out', finish=True)
+        self.tail('col', 'out2', finish=True)
+        self.assertOutputs('csv', 'out')
+        self.assertOutputs('col', 'out2')
+
+    def test_shrink(self):
+        # rows of another file, longer than the whole of this one
+        with open(raw_file(90, 7), 'rb') as f:
+            other = f.read()
+        with open(self.fname, 'wb') as f:
+            f.write(other)
+        self.tail('csv')
+        self.assertTrue(len(other) > len(self.text))
+        open(self.fname, 'wb').close()
+        self.append(len(self.text))
+        self.tail('csv', finish=True)
+        self.assertOutputs('csv')
+
+if __name__ == '__main__':
+    unittest.main()